@@ -0,0 +1,79 @@
+"""
+Micro-benchmark registry.
+
+Apps declare cases in a ``benchmarks`` module:
+
+    @benchmark('course_serializer')
+    def course_serializer(size):
+        courses = list(Course.objects.all()[:size])
+        return lambda: CourseSerializer(courses, many=True).data
+
+The decorated function is the setup, it runs once and returns the callable
+that gets timed. The ``benchmark`` management command runs the cases.
+"""
+import json
+import statistics
+import time
+
+from django.utils.module_loading import autodiscover_modules
+
+registry = {}
+
+
+def benchmark(name):
+    def register(setup):
+        registry[name] = setup
+        return setup
+
+    return register
+
+
+def autodiscover():
+    autodiscover_modules('benchmarks')
+    return registry
+
+
+def run(setup, size, repeat=5):
+    """
+    Time the callable returned by ``setup(size)`` ``repeat`` times
+    """
+    function = setup(size)
+    function()  # warm up caches and lazy imports
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {
+        'size': size,
+        'repeat': repeat,
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.fmean(timings),
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Cases whose median is more than ``threshold`` (a fraction) slower
+    than the baseline, as {name: ratio}
+    """
+    regressions = {}
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous or previous['size'] != result['size'] or not previous['median']:
+            continue
+        ratio = result['median'] / previous['median']
+        if ratio > 1 + threshold:
+            regressions[name] = ratio
+    return regressions
+
+
+def load(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def save(path, results):
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2, sort_keys=True)
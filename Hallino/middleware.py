@@ -0,0 +1,38 @@
+import logging
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .queries import QueryRecorder
+
+logger = logging.getLogger('Hallino.queries')
+
+
+class QueryInspectorMiddleware:
+    """
+    Records the SQL of each request, reports it in the X-Query-* response
+    headers and logs the statement templates repeated often enough to look
+    like an N+1.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_INSPECTOR_ENABLED', settings.DEBUG):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+
+        repeated = recorder.repeated()
+        response['X-Query-Count'] = len(recorder)
+        response['X-Query-Duration-Ms'] = f'{recorder.duration * 1000:.1f}'
+        response['X-N-Plus-One'] = len(repeated)
+
+        if repeated:
+            logger.warning(
+                'Possible N+1 on %s %s: %s queries\n%s',
+                request.method, request.path, len(recorder),
+                '\n'.join(f'{count} x {template}' for template, count in repeated.items())
+            )
+        return response
@@ -0,0 +1,230 @@
+"""
+Eager loading planned from a serializer's declared fields.
+
+The planner walks the fields a serializer reads, nested serializers,
+``source=`` paths and related fields included, and turns them into the
+select_related, prefetch_related and only() a queryset needs to be
+serialized in a constant number of queries:
+
+* forward foreign keys and one-to-ones rendered by a nested serializer
+  are joined with select_related, rendered as a primary key they only
+  need the key column
+* many-to-many and reverse foreign keys are prefetched, with a queryset
+  planned the same way for the nested serializer, or loading just the
+  keys for a PrimaryKeyRelatedField
+* plain fields make up the only() of each level
+
+Properties, methods and SerializerMethodFields can read anything, so a
+level that has them loads every column, and the levels below a
+SerializerMethodField or a custom to_representation do too.
+"""
+from copy import deepcopy
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField, SlugRelatedField
+
+
+class Plan:
+    """
+    What a serializer reads of one model: fields, joined and prefetched
+    relations, and attributes that are not model fields
+    """
+    def __init__(self, model):
+        self.model = model
+        self.fields = set()
+        self.attributes = set()
+        self.select = {}
+        self.prefetch = {}
+        # Code the planner can't see reads this level and the ones below
+        self.opaque = False
+
+    def relation(self, field):
+        """
+        Plan of the model on the other side of a relation, joined or prefetched
+        """
+        if field.many_to_many or field.one_to_many:
+            relations = self.prefetch
+        else:
+            relations = self.select
+            if field.concrete:
+                self.fields.add(field.name)
+        if field.name not in relations:
+            relations[field.name] = Plan(field.related_model)
+            if field.one_to_many:
+                # Prefetched rows are matched to their parent by the foreign key
+                relations[field.name].fields.add(field.remote_field.name)
+        return relations[field.name]
+
+    def resolve(self, attrs):
+        """
+        The plan owning the last of the ``attrs`` path and its model field,
+        None when it is not one
+        """
+        plan = self
+        for attr in attrs[:-1]:
+            try:
+                field = plan.model._meta.get_field(attr)
+            except FieldDoesNotExist:
+                plan.attributes.add(attr)
+                return plan, None
+            if not field.is_relation:
+                plan.fields.add(field.name)
+                return plan, None
+            plan = plan.relation(field)
+        try:
+            return plan, plan.model._meta.get_field(attrs[-1])
+        except FieldDoesNotExist:
+            if attrs[-1] != 'pk':
+                plan.attributes.add(attrs[-1])
+            return plan, None
+
+    def add_serializer(self, serializer):
+        if type(serializer).to_representation is not serializers.Serializer.to_representation:
+            self.opaque = True
+        for field in serializer.fields.values():
+            if not field.write_only:
+                self.add_field(field)
+
+    def add_field(self, field):
+        nested = field.child if isinstance(field, serializers.ListSerializer) else field
+        if field.source == '*':
+            if isinstance(nested, serializers.BaseSerializer):
+                self.add_serializer(nested)
+            else:
+                self.opaque = True
+            return
+
+        plan, model_field = self.resolve(field.source_attrs)
+        if model_field is None:
+            return
+        if not model_field.is_relation:
+            plan.fields.add(model_field.name)
+            return
+
+        related = field.child_relation if isinstance(field, ManyRelatedField) else field
+        if isinstance(nested, serializers.BaseSerializer):
+            plan.relation(model_field).add_serializer(nested)
+        elif isinstance(related, PrimaryKeyRelatedField):
+            if model_field.concrete and not model_field.many_to_many:
+                # Rendered from the key column, the row itself is never loaded
+                plan.fields.add(model_field.name)
+            else:
+                plan.relation(model_field)
+        elif isinstance(related, SlugRelatedField):
+            plan.relation(model_field).resolve(related.slug_field.split('__'))
+        else:
+            plan.relation(model_field).opaque = True
+
+    def require(self, path):
+        """
+        Load the field at the lookup ``path``, such as an ordering the
+        paginator reads back
+        """
+        plan, model_field = self.resolve(path.split('__'))
+        if model_field is not None and not model_field.is_relation:
+            plan.fields.add(model_field.name)
+
+    def only_fields(self, annotations=(), opaque=False, prefix=''):
+        """
+        only() arguments of this level and the joined levels, and whether
+        any of them leaves columns out
+        """
+        opaque = opaque or self.opaque
+        concrete = {field.name for field in self.model._meta.concrete_fields}
+        if opaque or self.attributes - set(annotations):
+            fields = concrete
+        else:
+            fields = self.fields | {self.model._meta.pk.name}
+        partial = fields != concrete
+        names = {prefix + name for name in fields}
+        for name, plan in self.select.items():
+            names.add(prefix + name)
+            joined, joined_partial = plan.only_fields(opaque=opaque, prefix=f'{prefix}{name}__')
+            if joined_partial:
+                names |= joined
+                partial = True
+        return names, partial
+
+    def select_paths(self, prefix=''):
+        for name, plan in self.select.items():
+            yield prefix + name
+            yield from plan.select_paths(f'{prefix}{name}__')
+
+    def prefetches(self, opaque=False, prefix=''):
+        opaque = opaque or self.opaque
+        for name, plan in self.prefetch.items():
+            queryset = plan.apply(plan.model._default_manager.all(), opaque=opaque)
+            yield Prefetch(prefix + name, queryset=queryset)
+        for name, plan in self.select.items():
+            yield from plan.prefetches(opaque, f'{prefix}{name}__')
+
+    def apply(self, queryset, opaque=False):
+        """
+        ``queryset`` with the joins, prefetches and only() of the plan added
+        to the ones it already has
+        """
+        query = queryset.query
+        seen = [getattr(lookup, 'prefetch_to', lookup) for lookup in queryset._prefetch_related_lookups]
+        prefetches = [
+            prefetch for prefetch in self.prefetches(opaque)
+            if not any(lookup == prefetch.prefetch_to or lookup.startswith(f'{prefetch.prefetch_to}__')
+                       or prefetch.prefetch_to.startswith(f'{lookup}__') for lookup in seen)
+        ]
+        if prefetches:
+            queryset = queryset.prefetch_related(*prefetches)
+
+        # Joins and column lists picked by the view itself are left alone
+        if query.select_related is not False or not query.deferred_loading[1]:
+            return queryset
+        paths = list(self.select_paths())
+        if paths:
+            queryset = queryset.select_related(*paths)
+        fields, partial = self.only_fields(annotations=query.annotations, opaque=opaque)
+        if partial:
+            # A related manager sets its instance on every row from the
+            # foreign key, deferring it would load it one row at a time
+            fields |= {field.name for field in queryset._known_related_objects}
+            queryset = queryset.only(*sorted(fields))
+        return queryset
+
+
+@lru_cache(maxsize=None)
+def get_plan(serializer_class):
+    """
+    Plan of a serializer class, built once per process
+    """
+    plan = Plan(serializer_class.Meta.model)
+    plan.add_serializer(serializer_class())
+    return plan
+
+
+def plan_queryset(queryset, serializer_class, ordering=()):
+    """
+    ``queryset`` with what ``serializer_class`` reads loaded up front,
+    plus the ``ordering`` lookups
+    """
+    plan = get_plan(serializer_class)
+    if ordering:
+        plan = deepcopy(plan)
+        for field in ordering:
+            if isinstance(field, str) and field.lstrip('-') not in queryset.query.annotations:
+                plan.require(field.lstrip('-'))
+    return plan.apply(queryset)
+
+
+class QueryPlanMixin:
+    """
+    Plans the queryset of list and retrieve against the serializer that
+    renders it, so they run a constant number of queries
+    """
+    planned_actions = ('list', 'retrieve')
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action not in self.planned_actions:
+            return queryset
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        return plan_queryset(queryset, self.get_serializer_class(), ordering)
@@ -0,0 +1,81 @@
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+REPEAT_THRESHOLD = getattr(settings, 'QUERY_INSPECTOR_REPEAT_THRESHOLD', 3)
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_NUMBER = re.compile(r'\b\d+\b')
+_SPACES = re.compile(r'\s+')
+
+
+def get_template(sql):
+    """
+    Statement template of an SQL string, so that the same query issued
+    for different rows groups together.
+    """
+    sql = _IN_LIST.sub('IN (...)', sql)
+    sql = _NUMBER.sub('N', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+class QueryRecorder:
+    """
+    Records every statement executed on all database connections
+    while the context is active.
+
+        with QueryRecorder() as recorder:
+            ...
+        recorder.repeated()
+    """
+
+    def __init__(self, threshold=None):
+        self.threshold = threshold or REPEAT_THRESHOLD
+        self.queries = []
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.monotonic() - start))
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __len__(self):
+        return len(self.queries)
+
+    @property
+    def duration(self):
+        return sum(duration for sql, duration in self.queries)
+
+    def templates(self):
+        return Counter(get_template(sql) for sql, duration in self.queries)
+
+    def repeated(self):
+        """
+        Templates executed at least ``threshold`` times, the N+1 suspects
+        """
+        return {
+            template: count
+            for template, count in self.templates().most_common()
+            if count >= self.threshold
+        }
+
+    def report(self):
+        return '\n'.join(
+            f'{count} x {template}'
+            for template, count in self.templates().most_common()
+        )
@@ -39,6 +39,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'phonenumber_field',
     'users.apps.UsersConfig',
     'rest_framework',
@@ -57,8 +58,13 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'Hallino.middleware.QueryInspectorMiddleware',
 ]
 
+# SQL recording per request, see Hallino.middleware.QueryInspectorMiddleware
+QUERY_INSPECTOR_ENABLED = int(os.getenv('QUERY_INSPECTOR_ENABLED', DEBUG))
+QUERY_INSPECTOR_REPEAT_THRESHOLD = 3
+
 ROOT_URLCONF = 'Hallino.urls'
 
 TEMPLATES = [
@@ -79,8 +85,9 @@ TEMPLATES = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework_simplejwt.authentication.JWTStatelessUserAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'authentication.backends.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -90,10 +97,87 @@ REST_FRAMEWORK = {
         'rest_framework.filters.SearchFilter',
         'rest_framework.filters.OrderingFilter',
     ],
+    # Keyset pages: constant cost at any depth, no COUNT(*) unless ?count=true
+    'DEFAULT_PAGINATION_CLASS': 'learning.pagination.KeysetPagination',
+    'PAGE_SIZE': 20,
+}
+
+# Access tokens carry is_staff, the user type and authored course ids, so
+# permissions are decided without loading the user. Claims refresh with the token.
+SIMPLE_JWT = {
+    'TOKEN_USER_CLASS': 'users.tokens.ClaimsUser',
+    'TOKEN_OBTAIN_SERIALIZER': 'users.serializers.ClaimsTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'users.serializers.ClaimsTokenRefreshSerializer',
+    'ROTATE_REFRESH_TOKENS': True,
 }
 
 WSGI_APPLICATION = 'Hallino.wsgi.application'
 
+# Shared cache tier; the local memory default is per process, set
+# CACHE_BACKEND to Redis or Memcached when running several workers
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Whether every process reads the same cache. Course trees and token
+# snapshots are invalidated in the cache, so they are only cached when it is.
+SHARED_CACHE = CACHES['default']['BACKEND'] not in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# Text search configuration of the search vectors, 'simple' as content mixes Farsi and English
+SEARCH_CONFIG = 'simple'
+
+# Country code of phone numbers searched without one, see users.filters.normalize_phone
+PHONE_DEFAULT_COUNTRY_CODE = '98'
+
+# Spacing of the order keys of chapters, lessons, slides and choices, see learning.ordering
+ORDER_GAP = 1024
+
+# Slide activity counters, see learning.counters. Increments are buffered per
+# process for up to the interval and spread over the shards. Whether a slide
+# is active is cached for the lookup timeout.
+SLIDE_COUNTER_SHARDS = 16
+SLIDE_COUNTER_FLUSH_INTERVAL = 1.0
+SLIDE_COUNTER_FLUSH_SIZE = 1000
+SLIDE_COUNTER_LOOKUP_TIMEOUT = 60
+
+# Token to user snapshots, see authentication.backends.CachedTokenAuthentication,
+# only cached with SHARED_CACHE. Revoking a token or changing its user takes
+# effect at once in the shared cache and this process, but other processes
+# keep serving their local copy for up to TOKEN_CACHE_LOCAL_TTL seconds: that
+# is the revocation window. Without a shared cache it takes effect at once.
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 300
+TOKEN_CACHE_LOCAL_TTL = 30
+
+# Compiled answer keys kept per process and response ids graded per range, see learning.grading
+ANSWER_KEY_CACHE_SIZE = 100000
+GRADING_BATCH_SIZE = 10000
+
+# Highest score the leaderboard count trees tell apart, higher scores are
+# ranked from the entry index instead, and rows every tree node is split
+# over, see users.leaderboard
+LEADERBOARD_MAX_SCORE = (1 << 20) - 1
+LEADERBOARD_NODE_SHARDS = 16
+
+# Progress weight of required slides of required lessons and of every other
+# slide, and bitmaps remapped per batch on compaction, see learning.progress
+PROGRESS_REQUIRED_WEIGHT = 1
+PROGRESS_OPTIONAL_WEIGHT = 0
+PROGRESS_REMAP_BATCH_SIZE = 5000
+
+# Streaks reset or reminded per statement by the daily roll_streaks job, see users.streaks
+STREAK_BATCH_SIZE = 50000
+
+# Course trees are invalidated by version bumps, the timeout bounds how long
+# a tree outlives a bump the cache missed
+COURSE_TREE_CACHE_TIMEOUT = 3600
+
 DATABASES = {
     'default': {
         'ENGINE': os.getenv('DATABASE_ENGINE'),
@@ -0,0 +1,79 @@
+from importlib import import_module
+
+from django.urls import URLPattern, URLResolver, reverse
+
+from .queries import QueryRecorder
+
+
+def get_routes(urlconf):
+    """
+    Named GET routes of a urlconf module as {name: URLPattern}
+    """
+    routes = {}
+
+    def collect(patterns):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                collect(pattern.url_patterns)
+            elif isinstance(pattern, URLPattern) and pattern.name:
+                callback = pattern.callback
+                if hasattr(callback, 'actions'):
+                    allows_get = 'get' in callback.actions
+                else:
+                    allows_get = hasattr(getattr(callback, 'view_class', None), 'get')
+                if allows_get:
+                    routes.setdefault(pattern.name, pattern)
+
+    collect(import_module(urlconf).urlpatterns)
+    return routes
+
+
+class QueryBudgetTestMixin:
+    """
+    Checks every GET route of ``urlconf`` against ``query_budgets``.
+
+    Routes without a declared budget fail, and so do routes that repeat
+    a statement template often enough to look like an N+1. Subclasses set
+    ``route_objects`` to {lookup name: instance}; the lookup name resolves
+    parent kwargs such as ``chapter_pk``, and the model of the route's
+    serializer resolves its own ``pk`` or ``slug``.
+    """
+    urlconf = None
+    namespace = None
+    query_budgets = {}
+    route_objects = {}
+
+    def get_route_kwargs(self, pattern):
+        kwargs = {}
+        for key in pattern.pattern.regex.groupindex:
+            if key == 'format':
+                continue
+            name, _, field = key.rpartition('_')
+            if name:
+                obj = self.route_objects[name]
+            else:
+                model = pattern.callback.cls.serializer_class.Meta.model
+                obj = next(o for o in self.route_objects.values() if isinstance(o, model))
+            kwargs[key] = getattr(obj, field)
+        return kwargs
+
+    def test_every_route_has_a_query_budget(self):
+        missing = set(get_routes(self.urlconf)) - set(self.query_budgets)
+        self.assertEqual(missing, set(), 'Routes without a declared query budget')
+
+    def test_routes_stay_within_query_budget(self):
+        for name, pattern in get_routes(self.urlconf).items():
+            with self.subTest(route=name):
+                url = reverse(f'{self.namespace}:{name}', kwargs=self.get_route_kwargs(pattern))
+                with QueryRecorder() as recorder:
+                    response = self.client.get(url)
+
+                self.assertEqual(response.status_code, 200, url)
+                self.assertLessEqual(
+                    len(recorder), self.query_budgets[name],
+                    f'{url} is over its query budget:\n{recorder.report()}'
+                )
+                self.assertEqual(
+                    recorder.repeated(), {},
+                    f'{url} repeats queries per row:\n{recorder.report()}'
+                )
@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from users.models import User
+
+TOKEN_CACHE_SIZE = getattr(settings, 'TOKEN_CACHE_SIZE', 10000)
+TOKEN_CACHE_TTL = getattr(settings, 'TOKEN_CACHE_TTL', 300)
+TOKEN_CACHE_LOCAL_TTL = getattr(settings, 'TOKEN_CACHE_LOCAL_TTL', 30)
+
+# Everything but the password hash, which never leaves the database
+SNAPSHOT_FIELDS = [f.attname for f in User._meta.concrete_fields if f.attname != 'password']
+
+
+class TokenCache:
+    """
+    Bounded in-process LRU of token key to user snapshot, entries expire
+    after ``ttl`` seconds. Counts hits and misses of both cache tiers.
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.counts = Counter()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, snapshot):
+        with self._lock:
+            self._entries[key] = (snapshot, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.counts.clear()
+
+    def stats(self):
+        lookups = sum(self.counts.values())
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'local_hits': self.counts['local'],
+            'shared_hits': self.counts['shared'],
+            'misses': self.counts['miss'],
+            'local_hit_rate': self.counts['local'] / lookups if lookups else 0.0,
+            'hit_rate': (self.counts['local'] + self.counts['shared']) / lookups if lookups else 0.0,
+        }
+
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_LOCAL_TTL)
+
+
+def get_cache_key(key):
+    return f'authentication:token:{key}'
+
+
+def get_version_key(key):
+    return f'authentication:token:{key}:version'
+
+
+def invalidate_token(key):
+    """
+    Drop a token from the shared tier and this process. Other processes
+    hold it for at most TOKEN_CACHE_LOCAL_TTL seconds.
+    """
+    # A new version outlives every snapshot taken under the old one, so a
+    # lookup that read the database before now can't store a stale one
+    cache.set(get_version_key(key), int(time.time() * 1000), TOKEN_CACHE_TTL)
+    cache.delete(get_cache_key(key))
+    token_cache.delete(key)
+
+
+def invalidate_user_tokens(user_id):
+    for key in Token.objects.filter(user_id=user_id).values_list('key', flat=True):
+        invalidate_token(key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that serves the user from a snapshot cached per
+    token, first in process then in the shared cache, instead of joining
+    Token to User on every request. Without a shared cache other processes
+    never see a revocation, so every request reads the token.
+    """
+    def authenticate_credentials(self, key):
+        if not getattr(settings, 'SHARED_CACHE', False):
+            return super().authenticate_credentials(key)
+        snapshot = token_cache.get(key)
+        if snapshot is not None:
+            token_cache.counts['local'] += 1
+        else:
+            # Shared snapshots count only under the current version of the token
+            shared = cache.get_many([get_cache_key(key), get_version_key(key)])
+            version = shared.get(get_version_key(key), 0)
+            entry = shared.get(get_cache_key(key))
+            if entry is not None and entry[0] == version:
+                snapshot = entry[1]
+                token_cache.counts['shared'] += 1
+            else:
+                token_cache.counts['miss'] += 1
+                try:
+                    token = Token.objects.select_related('user').get(key=key)
+                except Token.DoesNotExist:
+                    raise exceptions.AuthenticationFailed(_('Invalid token.'))
+                snapshot = tuple(getattr(token.user, field) for field in SNAPSHOT_FIELDS)
+                cache.set(get_cache_key(key), (version, snapshot), TOKEN_CACHE_TTL)
+            token_cache.set(key, snapshot)
+
+        user = User.from_db(Token.objects.db, SNAPSHOT_FIELDS, snapshot)
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return user, Token(key=key, user=user)
@@ -0,0 +1,25 @@
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from Hallino.benchmarks import benchmark
+from users.models import User
+from .backends import CachedTokenAuthentication, token_cache
+
+
+@benchmark('authentication.cached_token_auth')
+def cached_token_auth(size):
+    """
+    ``size`` token authentications over users.token_auth's user mix, from
+    the warm in-process cache
+    """
+    users = list(User.objects.all()[:max(1, size // 10)])
+    keys = [Token.objects.get_or_create(user=user)[0].key for user in users]
+    factory = APIRequestFactory()
+    requests = [
+        Request(factory.get('/', HTTP_AUTHORIZATION=f'Token {keys[i % len(keys)]}'))
+        for i in range(size)
+    ]
+    authentication = CachedTokenAuthentication()
+    token_cache.clear()
+    return lambda: [authentication.authenticate(request) for request in requests]
@@ -0,0 +1,24 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from users.models import User
+from .backends import invalidate_token, invalidate_user_tokens
+
+
+@receiver(post_save, sender=User, dispatch_uid='invalidate_user_tokens')
+def invalidate_on_user_save(sender, instance, raw=False, **kwargs):
+    """
+    Password changes, deactivation and any other edit drop the cached user
+    """
+    if raw:
+        return
+    transaction.on_commit(lambda: invalidate_user_tokens(instance.pk))
+
+
+@receiver(post_delete, sender=Token, dispatch_uid='invalidate_deleted_token')
+def invalidate_on_token_delete(sender, instance, **kwargs):
+    # The collector clears the key before the commit callbacks run
+    key = instance.key
+    transaction.on_commit(lambda: invalidate_token(key))
@@ -1,3 +1,65 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
 
-# Create your tests here.
+from users.models import User
+from .backends import get_cache_key, invalidate_token, token_cache
+
+
+@override_settings(SHARED_CACHE=True)
+class CachedTokenAuthenticationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.user = User.objects.create_user(
+            'user@example.com', 'Test', 'User', '+989121234567', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.url = reverse('users:user-detail', kwargs={'pk': self.user.pk})
+
+    def test_user_is_served_from_the_cache(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        # Only the user detail lookup is left
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+        stats = token_cache.stats()
+        self.assertEqual((stats['misses'], stats['local_hits']), (1, 1))
+
+    @override_settings(SHARED_CACHE=False)
+    def test_tokens_are_not_cached_per_process(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertEqual(token_cache.stats()['size'], 0)
+
+    def test_shared_tier_refills_other_processes(self):
+        self.client.get(self.url)
+        token_cache.clear()
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+        self.assertEqual(token_cache.stats()['shared_hits'], 1)
+
+    def test_deactivation_invalidates_immediately(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_logout_invalidates_immediately(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(reverse('authentication:logout')).status_code, 200)
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_snapshots_read_before_an_invalidation_are_ignored(self):
+        self.client.get(self.url)
+        stale = cache.get(get_cache_key(self.token.key))
+        invalidate_token(self.token.key)
+        # A lookup that read the database before the invalidation stores its snapshot late
+        cache.set(get_cache_key(self.token.key), stale)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        token_cache.clear()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
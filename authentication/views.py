@@ -1,10 +1,11 @@
 from django.contrib.auth import logout, login
 from rest_framework import status
 from rest_framework.authtoken.models import Token
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from authentication.backends import token_cache
 from authentication.serializers import RegisterSerializer, LoginSerializer
 from users.serializers import UserSerializer
 
@@ -47,6 +48,18 @@ class LogoutView(APIView):
 
     @staticmethod
     def post(request):
-        request.user.auth_token.delete()
+        # Deleting the token drops its cached user, see authentication.signals
+        Token.objects.filter(user_id=request.user.pk).delete()
         logout(request)
         return Response(status=status.HTTP_200_OK)
+
+
+class TokenCacheStatsView(APIView):
+    """
+    Size and hit rates of this process' token cache
+    """
+    permission_classes = [IsAdminUser]
+
+    @staticmethod
+    def get(request):
+        return Response(token_cache.stats())
@@ -50,7 +50,7 @@ class CourseAdmin(admin.ModelAdmin):
     ]
     search_fields = ['title', 'slug', 'description', 'authors__user__email']
     filter_horizontal = ['categories', 'authors', 'requirements']
-    readonly_fields = ['created_at', 'updated_at', 'rating']
+    readonly_fields = ['created_at', 'updated_at', 'rating', 'rating_count']
     list_editable = ['is_published', 'is_active']
     list_per_page = 20
     inlines = [ChapterInline]
@@ -70,7 +70,7 @@ class CourseAdmin(admin.ModelAdmin):
             'fields': ('start_date', 'end_date')
         }),
         ('Status', {
-            'fields': ('is_published', 'is_active', 'rating')
+            'fields': ('is_published', 'is_active', 'rating', 'rating_count')
         }),
         ('Metadata', {
             'fields': ('created_at', 'updated_at'),
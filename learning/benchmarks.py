@@ -0,0 +1,175 @@
+from itertools import count
+
+from django.db import transaction
+from django.db.models import F
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from Hallino.benchmarks import benchmark
+from users.models import User, Author, UserResponse
+from . import counters, grading, progress
+from .learning_constants import LearningConstants
+from .models import Course, Chapter, Lesson, BaseQuestion, Slide
+from .search import autocomplete
+from .permissions import IsAuthorOrReadOnly, IsCourseAuthorOrReadOnly, IsStaffOrReadOnly
+from .serializers import CourseSerializer, SlideSerializer, BaseQuestionSerializer
+
+
+def author_request(method='patch'):
+    """
+    Request by the user of an author, so permission checks walk the author lists
+    """
+    author = Author.objects.select_related('user').first()
+    request = Request(getattr(APIRequestFactory(), method)('/'))
+    request.user = author.user
+    return request
+
+
+@benchmark('learning.course_serializer')
+def course_serializer(size):
+    courses = list(Course.objects.prefetch_related(
+        'authors', 'categories', 'requirements')[:size])
+    return lambda: CourseSerializer(courses, many=True).data
+
+
+@benchmark('learning.slide_serializer')
+def slide_serializer(size):
+    slides = list(Slide.objects.all()[:size])
+    return lambda: SlideSerializer(slides, many=True).data
+
+
+@benchmark('learning.question_serializer')
+def question_serializer(size):
+    questions = list(BaseQuestion.objects.prefetch_related('choices')[:size])
+    return lambda: BaseQuestionSerializer(questions, many=True).data
+
+
+@benchmark('learning.is_author_or_read_only')
+def is_author_or_read_only(size):
+    request = author_request()
+    permission = IsAuthorOrReadOnly()
+    objects = list(Lesson.objects.all()[:size // 2]) + list(Chapter.objects.all()[:size // 2])
+    return lambda: [permission.has_object_permission(request, None, obj) for obj in objects]
+
+
+@benchmark('learning.is_course_author_or_read_only')
+def is_course_author_or_read_only(size):
+    request = author_request()
+    permission = IsCourseAuthorOrReadOnly()
+    courses = list(Course.objects.all()[:size])
+    return lambda: [permission.has_object_permission(request, None, course) for course in courses]
+
+
+@benchmark('learning.is_staff_or_read_only')
+def is_staff_or_read_only(size):
+    request = author_request()
+    permission = IsStaffOrReadOnly()
+    return lambda: [permission.has_permission(request, None) for _ in range(size)]
+
+
+@benchmark('learning.autocomplete')
+def autocomplete_titles(size):
+    """
+    ``size`` lookups with prefixes cut from stored titles, seed_data --courses 5000
+    gives the 100k lesson titles the endpoint is sized for
+    """
+    titles = Lesson.objects.order_by('?').values_list('title', flat=True)[:size]
+    prefixes = [title[:3] for title in titles]
+    return lambda: [autocomplete(prefix) for prefix in prefixes]
+
+
+@benchmark('learning.course_save_slug')
+def course_save_slug(size):
+    numbers = count()
+
+    def save_courses():
+        for _ in range(size):
+            Course(title=f'Benchmark course {next(numbers)}', description='',
+                   duration=1, price=0).save()
+
+    return save_courses
+
+
+@benchmark('learning.slide_counters')
+def slide_counters(size):
+    """
+    ``size`` increments spread over ten slides, buffered and written by one flush
+    """
+    slide_ids = list(Slide.objects.values_list('id', flat=True)[:10])
+    buffer = counters.CounterBuffer(interval=3600, size=size + 1)
+
+    def run():
+        for i in range(size):
+            buffer.add(slide_ids[i % len(slide_ids)], LearningConstants.COUNTER_VIEWS)
+        buffer.flush()
+    return run
+
+
+@benchmark('learning.slide_counter_updates')
+def slide_counter_updates(size):
+    """
+    The same increments as one UPDATE ... SET comments_count = comments_count + 1 each
+    """
+    slide_ids = list(Slide.objects.values_list('id', flat=True)[:10])
+    return lambda: [
+        Slide.objects.filter(id=slide_ids[i % len(slide_ids)]).update(comments_count=F('comments_count') + 1)
+        for i in range(size)
+    ]
+
+
+@benchmark('learning.grading')
+def grade_answers(size):
+    """
+    ``size`` in-memory submissions graded against compiled keys, half of
+    them correct, tens of thousands a second per core is the target
+    """
+    question_ids = list(BaseQuestion.objects.filter(choices__isnull=False).distinct().values_list(
+        'id', flat=True)[:100])
+    keys = grading.compile_keys(question_ids)
+    submissions = []
+    for i in range(size):
+        key = keys[question_ids[i % len(question_ids)]]
+        chosen = key.correct if i % 2 else key.options - key.correct
+        submissions.append((key, chosen, list(key.accepted)))
+    return lambda: [grading.grade(key, chosen, texts) for key, chosen, texts in submissions]
+
+
+@benchmark('learning.regrade_responses')
+def regrade_responses(size):
+    """
+    One range of ``size`` stored responses graded and written back
+    """
+    first = UserResponse.objects.order_by('id').values_list('id', flat=True).first() or 0
+
+    def run():
+        UserResponse.objects.filter(id__gte=first, id__lt=first + size).update(is_correct=None)
+        grading.grade_range(first, first + size)
+    return run
+
+
+@benchmark('learning.complete_slide')
+def complete_slide(size):
+    """
+    ``size`` slides completed for one user, one bit set each whatever the
+    course size, rolled back after timing
+    """
+    user_id = User.objects.values_list('id', flat=True).first()
+    slide_ids = list(Slide.objects.filter(is_active=True, position__isnull=False).values_list(
+        'id', flat=True)[:size])
+
+    def run():
+        with transaction.atomic():
+            for slide_id in slide_ids:
+                progress.complete_slide(user_id, slide_id)
+            transaction.set_rollback(True)
+    return run
+
+
+@benchmark('learning.course_progress')
+def course_progress(size):
+    """
+    Dashboards of 50 courses, ``size`` of them, each read in one query
+    """
+    user_ids = list(User.objects.values_list('id', flat=True)[:size])
+    course_ids = list(Course.objects.values_list('id', flat=True)[:50])
+    return lambda: [progress.course_progress(user_id, course_ids) for user_id in user_ids]
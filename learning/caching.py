@@ -0,0 +1,117 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Category, Course, Chapter, Lesson, Editor, BaseQuestion, Choice, Slide
+from .serializers import OutlineChapterSerializer
+
+TREE_TIMEOUT = getattr(settings, 'COURSE_TREE_CACHE_TIMEOUT', 3600)
+
+
+def _version_key(course_id):
+    return f'learning:course:{course_id}:version'
+
+
+def _tree_key(course_id, version):
+    return f'learning:course:{course_id}:tree:{version}'
+
+
+def _new_version():
+    # Never restart from 1, an evicted version key could then point at old trees
+    return int(time.time() * 1000)
+
+
+def get_course_ids(instance):
+    """
+    Ids of the courses whose content tree contains the instance
+    """
+    if isinstance(instance, Course):
+        return [instance.id]
+    if isinstance(instance, Chapter):
+        return [instance.course_id]
+
+    if isinstance(instance, Category):
+        lookup = Q(categories=instance)
+    elif isinstance(instance, Lesson):
+        lookup = Q(chapters__id=instance.chapter_id)
+    elif isinstance(instance, Slide):
+        lookup = Q(chapters__lessons__id=instance.lesson_id)
+    elif isinstance(instance, BaseQuestion):
+        lookup = Q(chapters__lessons__slides__question=instance)
+    elif isinstance(instance, Choice):
+        lookup = Q(chapters__lessons__slides__question__id=instance.question_id)
+    elif isinstance(instance, Editor):
+        lookup = (Q(chapters__lessons__slides__editor=instance) |
+                  Q(chapters__lessons__slides__question__editor=instance))
+    else:
+        return []
+    return list(Course.objects.filter(lookup).values_list('id', flat=True).distinct())
+
+
+def get_moved_from_course_ids(instance):
+    """
+    Ids of the courses a chapter, lesson or slide leaves by the move being saved
+    """
+    moved_from = getattr(instance, 'moved_from', None)
+    parent_id = moved_from() if moved_from else None
+    if parent_id is None:
+        return []
+    if isinstance(instance, Chapter):
+        return [parent_id]
+    lookup = Q(chapters__id=parent_id) if isinstance(instance, Lesson) else Q(chapters__lessons__id=parent_id)
+    return list(Course.objects.filter(lookup).values_list('id', flat=True))
+
+
+def get_course_version(course_id):
+    key = _version_key(course_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_course_versions(course_ids):
+    for course_id in set(course_ids):
+        try:
+            cache.incr(_version_key(course_id))
+        except ValueError:
+            cache.set(_version_key(course_id), _new_version(), timeout=None)
+
+
+def invalidate_course_tree(*course_ids):
+    """
+    Bump the tree version of the given courses once the current transaction
+    commits, so readers can't cache uncommitted state under the new version.
+    """
+    course_ids = [course_id for course_id in course_ids if course_id]
+    if course_ids:
+        transaction.on_commit(lambda: bump_course_versions(course_ids))
+
+
+def build_course_tree(course):
+    return {
+        'id': course.id,
+        'slug': course.slug,
+        'title': course.title,
+        'chapters': OutlineChapterSerializer(course.get_outline(), many=True).data
+    }
+
+
+def get_course_tree(course):
+    """
+    Serialized outline of the course, built once per content version. A
+    cache of this process only would miss the bumps of the others, so
+    without a shared one the tree is built every time.
+    """
+    if not getattr(settings, 'SHARED_CACHE', False):
+        return build_course_tree(course)
+    key = _tree_key(course.id, get_course_version(course.id))
+    tree = cache.get(key)
+    if tree is None:
+        tree = build_course_tree(course)
+        cache.set(key, tree, timeout=TREE_TIMEOUT)
+    return tree
@@ -0,0 +1,182 @@
+"""
+Write-behind activity counters of slides.
+
+Increments add up in a per-process buffer. The buffer is flushed as one
+INSERT ... ON CONFLICT that adds the pending amounts to a random shard of
+each counter, so concurrent workers rarely wait on the same row. Reads sum
+the shards. Counts still in a buffer are lost if the process dies, at most
+SLIDE_COUNTER_FLUSH_INTERVAL seconds of them.
+"""
+import atexit
+import logging
+import random
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_finished
+from django.db import DataError, IntegrityError, connection, transaction
+from django.db.models import Sum
+
+from .learning_constants import LearningConstants
+from .models import Slide, SlideCounter
+
+SLIDE_COUNTER_SHARDS = getattr(settings, 'SLIDE_COUNTER_SHARDS', 16)
+SLIDE_COUNTER_FLUSH_INTERVAL = getattr(settings, 'SLIDE_COUNTER_FLUSH_INTERVAL', 1.0)
+SLIDE_COUNTER_FLUSH_SIZE = getattr(settings, 'SLIDE_COUNTER_FLUSH_SIZE', 1000)
+SLIDE_COUNTER_LOOKUP_TIMEOUT = getattr(settings, 'SLIDE_COUNTER_LOOKUP_TIMEOUT', 60)
+
+# Largest id a bigint column takes
+MAX_SLIDE_ID = (1 << 63) - 1
+
+logger = logging.getLogger(__name__)
+
+COUNTER_NAMES = dict(LearningConstants.SLIDE_COUNTER_CHOICES)
+COUNTER_KINDS = {name: kind for kind, name in LearningConstants.SLIDE_COUNTER_CHOICES}
+
+
+def get_active_lesson_id(slide_id):
+    """
+    Lesson of the slide when it is active, 0 otherwise. Cached for
+    SLIDE_COUNTER_LOOKUP_TIMEOUT seconds, so increments of a hot slide skip
+    the lookup.
+    """
+    if not 0 < slide_id <= MAX_SLIDE_ID:
+        return 0
+    key = f'learning:slide:{slide_id}:lesson'
+    lesson_id = cache.get(key)
+    if lesson_id is None:
+        lesson_id = Slide.objects.filter(pk=slide_id, is_active=True).values_list(
+            'lesson_id', flat=True).first() or 0
+        cache.set(key, lesson_id, SLIDE_COUNTER_LOOKUP_TIMEOUT)
+    return lesson_id
+
+
+def write_counts(counts):
+    """
+    Add {(slide id, kind): amount} to the counter shards in one statement.
+    Counts of slides deleted in the meantime are dropped.
+    """
+    if not counts:
+        return
+    # Sorted, so concurrent flushes lock shared rows in the same order
+    rows = [(slide_id, kind, random.randrange(SLIDE_COUNTER_SHARDS), amount)
+            for (slide_id, kind), amount in sorted(counts.items())]
+    table = connection.ops.quote_name(SlideCounter._meta.db_table)
+    slides = connection.ops.quote_name(Slide._meta.db_table)
+    values = ', '.join(['(%s::bigint, %s::integer, %s::smallint, %s::bigint)'] * len(rows))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (slide_id, kind, shard, value) '
+            f'SELECT v.slide_id, v.kind, v.shard, v.value '
+            f'FROM (VALUES {values}) AS v (slide_id, kind, shard, value) '
+            f'JOIN {slides} s ON s.id = v.slide_id '
+            f'ON CONFLICT (slide_id, kind, shard) DO UPDATE SET value = {table}.value + EXCLUDED.value',
+            [value for row in rows for value in row]
+        )
+
+
+class CounterBuffer:
+    """
+    Pending increments of this process, flushed every ``interval`` seconds
+    or once ``size`` counters are pending, whichever comes first
+    """
+    def __init__(self, interval, size):
+        self.interval = interval
+        self.size = size
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def add(self, slide_id, kind, amount=1):
+        with self._lock:
+            self._counts[slide_id, kind] += amount
+            full = len(self._counts) >= self.size
+        if full:
+            self.flush()
+
+    def pending(self, slide_id, kind):
+        with self._lock:
+            return self._counts.get((slide_id, kind), 0)
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            self._flushed_at = time.monotonic()
+        if not counts:
+            # Nothing to write, don't open a connection, at exit there may be no database
+            return
+        try:
+            with transaction.atomic():
+                write_counts(counts)
+        except (DataError, IntegrityError):
+            # Some row can't be written, write the others one by one
+            self._flush_each(counts)
+        except Exception:
+            # Put the counts back for the next flush rather than losing them
+            with self._lock:
+                self._counts.update(counts)
+            raise
+
+    def _flush_each(self, counts):
+        pending = dict(counts)
+        for key, amount in counts.items():
+            try:
+                with transaction.atomic():
+                    write_counts({key: amount})
+            except (DataError, IntegrityError):
+                # Retrying would fail the same way, every flush after it too
+                logger.warning('Dropped %s increments of slide counter %s', amount, key, exc_info=True)
+            except Exception:
+                with self._lock:
+                    self._counts.update(pending)
+                raise
+            del pending[key]
+
+    def flush_if_due(self):
+        if self._counts and time.monotonic() - self._flushed_at >= self.interval:
+            self.flush()
+
+
+buffer = CounterBuffer(SLIDE_COUNTER_FLUSH_INTERVAL, SLIDE_COUNTER_FLUSH_SIZE)
+
+
+def increment(slide_id, kind, amount=1):
+    buffer.add(slide_id, kind, amount)
+
+
+def get_counts(slides):
+    """
+    {slide id: {counter name: total}} summed over the shards in one query,
+    with the legacy Slide.comments_count and this process' pending
+    increments added
+    """
+    counts = {
+        slide.id: {**dict.fromkeys(COUNTER_KINDS, 0), 'comments': slide.comments_count}
+        for slide in slides
+    }
+    rows = SlideCounter.objects.filter(slide_id__in=counts).values(
+        'slide_id', 'kind').annotate(total=Sum('value')).order_by()
+    for row in rows:
+        counts[row['slide_id']][COUNTER_NAMES[row['kind']]] += row['total']
+    for slide_id, slide_counts in counts.items():
+        for kind, name in COUNTER_NAMES.items():
+            slide_counts[name] += buffer.pending(slide_id, kind)
+    return counts
+
+
+def flush_on_request_finished(sender, **kwargs):
+    buffer.flush_if_due()
+
+
+def flush_at_exit():
+    try:
+        buffer.flush()
+    except Exception:
+        logger.exception('Lost slide counter increments at exit')
+
+
+request_finished.connect(flush_on_request_finished, dispatch_uid='flush_slide_counters')
+atexit.register(flush_at_exit)
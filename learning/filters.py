@@ -1,7 +1,12 @@
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast
 from django_filters import rest_framework as filters
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
 
 from .learning_constants import LearningConstants
 from .models import Course, Chapter, Lesson, BaseQuestion, Slide
+from .search import SEARCH_CONFIG
 
 
 class CourseFilter(filters.FilterSet):
@@ -10,12 +15,47 @@ class CourseFilter(filters.FilterSet):
     language = filters.ChoiceFilter(choices=Course.LANGUAGE_CHOICES)
     level = filters.ChoiceFilter(choices=LearningConstants.LEVEL_CHOICES)
     category = filters.CharFilter(field_name='categories__title')
-    author = filters.CharFilter(field_name='authors__username')
+    author = filters.CharFilter(method='filter_author')
 
     class Meta:
         model = Course
         fields = ['is_published', 'is_active', 'language', 'level']
 
+    def filter_author(self, queryset, name, value):
+        # A subquery, so courses with two matching authors aren't listed twice
+        authors = Course.authors.through.objects.filter(
+            Q(author__user__firstname__iexact=value) | Q(author__user__lastname__iexact=value))
+        return queryset.filter(id__in=authors.values('course_id'))
+
+
+class CourseSearchFilter(BaseFilterBackend):
+    """
+    Ranked full-text search over the stored course search vector, ?q=<query>.
+    Results are ordered by rank unless ?ordering is given.
+    """
+    search_param = 'q'
+
+    def get_search_query(self, request):
+        query = request.query_params.get(self.search_param, '').strip()
+        if query:
+            return SearchQuery(query, search_type='websearch', config=SEARCH_CONFIG)
+
+    def filter_queryset(self, request, queryset, view):
+        query = self.get_search_query(request)
+        if query is None:
+            return queryset
+
+        queryset = queryset.filter(search_vector=query).annotate(
+            # float8, so the rank survives the round trip through a page cursor
+            rank=Cast(SearchRank(F('search_vector'), query), FloatField()),
+            title_headline=SearchHeadline('title', query, config=SEARCH_CONFIG),
+            description_headline=SearchHeadline(
+                'description', query, config=SEARCH_CONFIG, max_fragments=2),
+        )
+        if not request.query_params.get(OrderingFilter.ordering_param):
+            queryset = queryset.order_by('-rank', '-created_at')
+        return queryset
+
 
 class ChapterFilter(filters.FilterSet):
     course = filters.NumberFilter(field_name='course__id')
@@ -0,0 +1,203 @@
+"""
+Grading of user responses against compiled answer keys.
+
+A question's answer key holds the ids of its correct choices, the ids of
+all of its choices, and for text input the normalized texts of its
+correct choices, which are the accepted answers. Keys are compiled in two
+queries for any number of questions and kept per process; editing a
+question or a choice bumps a shared version that drops every process's
+keys on its next lookup.
+
+Single responses are graded inline on submit. regrade_responses walks the
+stored responses in id ranges and grades a whole range from one flat
+query, writing back only the results that changed.
+"""
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from users.models import UserResponse
+from .models import BaseQuestion, Choice
+
+ANSWER_KEY_CACHE_SIZE = getattr(settings, 'ANSWER_KEY_CACHE_SIZE', 100000)
+GRADING_BATCH_SIZE = getattr(settings, 'GRADING_BATCH_SIZE', 10000)
+
+TEXT_QUESTION_TYPE = 3
+VERSION_KEY = 'learning:answer-keys:version'
+
+_SPACES = re.compile(r'\s+')
+
+
+class AnswerKey(NamedTuple):
+    is_text: bool
+    correct: frozenset
+    options: frozenset
+    accepted: frozenset
+
+
+def normalize_answer(text):
+    """
+    Case and whitespace insensitive form of a typed answer
+    """
+    return _SPACES.sub(' ', text).strip().casefold()
+
+
+def compile_keys(question_ids):
+    """
+    {question id: AnswerKey} of the given questions, in two queries
+    """
+    questions = BaseQuestion.objects.filter(id__in=question_ids).values_list(
+        'id', 'question_type', 'is_text_input')
+    correct, options, accepted = defaultdict(set), defaultdict(set), defaultdict(set)
+    choices = Choice.objects.filter(question_id__in=question_ids).values_list(
+        'question_id', 'id', 'text', 'is_correct')
+    for question_id, choice_id, text, is_correct in choices:
+        options[question_id].add(choice_id)
+        if is_correct:
+            correct[question_id].add(choice_id)
+            accepted[question_id].add(normalize_answer(text))
+    return {
+        question_id: AnswerKey(
+            is_text=is_text_input or question_type == TEXT_QUESTION_TYPE,
+            correct=frozenset(correct[question_id]),
+            options=frozenset(options[question_id]),
+            accepted=frozenset(accepted[question_id]),
+        )
+        for question_id, question_type, is_text_input in questions
+    }
+
+
+def get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, int(time.time() * 1000), timeout=None)
+
+
+def invalidate_answer_keys():
+    """
+    Drop the compiled keys of every process once the current transaction commits
+    """
+    transaction.on_commit(bump_version)
+
+
+class AnswerKeyCache:
+    """
+    Compiled answer keys of this process, valid for one shared version.
+    Compiles only the questions it has not seen, clears itself when full.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._keys = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get_many(self, question_ids):
+        version = get_version()
+        with self._lock:
+            if version != self._version or len(self._keys) > self.maxsize:
+                self._keys, self._version = {}, version
+            keys = self._keys
+        missing = [question_id for question_id in set(question_ids) if question_id not in keys]
+        if missing:
+            compiled = compile_keys(missing)
+            with self._lock:
+                if self._version == version:
+                    self._keys.update(compiled)
+            keys = {**keys, **compiled}
+        return {question_id: keys[question_id] for question_id in question_ids if question_id in keys}
+
+    def clear(self):
+        with self._lock:
+            self._keys, self._version = {}, None
+
+
+answer_keys = AnswerKeyCache(ANSWER_KEY_CACHE_SIZE)
+
+
+def grade(key, choice_ids=(), text_answers=()):
+    """
+    Whether an answer to the question of ``key`` is correct: exactly the
+    correct choices among the question's choices, or only accepted texts
+    """
+    if key.is_text:
+        answers = {normalize_answer(text) for text in text_answers or () if text and text.strip()}
+        return bool(answers) and answers <= key.accepted
+    return bool(key.correct) and key.options.intersection(choice_ids) == key.correct
+
+
+def grade_answers(keys, question_ids, choice_ids=(), text_answers=()):
+    """
+    Whether a response is correct for every one of its questions, None
+    when it has no gradable question
+    """
+    graded = [grade(keys[question_id], choice_ids, text_answers)
+              for question_id in question_ids if question_id in keys]
+    return all(graded) if graded else None
+
+
+def grade_response(response):
+    """
+    Grade a stored response inline and save the result
+    """
+    keys = answer_keys.get_many([response.question_id])
+    is_correct = grade_answers(keys, [response.question_id], response.choice_ids, response.text_answer)
+    if is_correct != response.is_correct:
+        response.is_correct = is_correct
+        UserResponse.objects.filter(pk=response.pk).update(is_correct=is_correct)
+    return is_correct
+
+
+def grade_range(start, stop, ungraded_only=False):
+    """
+    Grade the responses with ids in [start, stop) and write back the
+    changed results, returns (graded, changed)
+    """
+    responses = UserResponse.objects.filter(id__gte=start, id__lt=stop, question__isnull=False)
+    if ungraded_only:
+        responses = responses.filter(is_correct__isnull=True)
+    rows = list(responses.values_list('id', 'question_id', 'choice_ids', 'text_answer', 'is_correct'))
+    if not rows:
+        return 0, 0
+    keys = answer_keys.get_many({row[1] for row in rows})
+
+    changed = {True: [], False: [], None: []}
+    for response_id, question_id, choice_ids, text_answer, stored in rows:
+        is_correct = grade_answers(keys, [question_id], choice_ids, text_answer)
+        if is_correct != stored:
+            changed[is_correct].append(response_id)
+    for is_correct, ids in changed.items():
+        if ids:
+            UserResponse.objects.filter(id__in=ids).update(is_correct=is_correct)
+    return len(rows), sum(len(ids) for ids in changed.values())
+
+
+def regrade_responses(batch_size=GRADING_BATCH_SIZE, ungraded_only=False, start=None):
+    """
+    Grade every stored response, ``batch_size`` ids at a time, yielding
+    (last id, graded, changed) after each range
+    """
+    bounds = UserResponse.objects.order_by('id').values_list('id', flat=True)
+    first, last = bounds.first(), bounds.last()
+    if first is None:
+        return
+    position = max(first, start or first)
+    while position <= last:
+        stop = position + batch_size
+        graded, changed = grade_range(position, stop, ungraded_only)
+        yield stop - 1, graded, changed
+        position = stop
@@ -44,3 +44,29 @@ class LearningConstants:
         (1, 'Text'),
         (2, 'Quiz'),
     ]
+
+    # Search document entities
+    SEARCH_LESSON = 1
+    SEARCH_SLIDE = 2
+    SEARCH_QUESTION = 3
+    SEARCH_EDITOR = 4
+
+    SEARCH_ENTITY_CHOICES = [
+        (SEARCH_LESSON, 'lessons'),
+        (SEARCH_SLIDE, 'slides'),
+        (SEARCH_QUESTION, 'questions'),
+        (SEARCH_EDITOR, 'editors'),
+    ]
+
+    # Slide activity counters
+    COUNTER_COMMENTS = 1
+    COUNTER_VIEWS = 2
+    COUNTER_ATTEMPTS = 3
+    COUNTER_COMPLETIONS = 4
+
+    SLIDE_COUNTER_CHOICES = [
+        (COUNTER_COMMENTS, 'comments'),
+        (COUNTER_VIEWS, 'views'),
+        (COUNTER_ATTEMPTS, 'attempts'),
+        (COUNTER_COMPLETIONS, 'completions'),
+    ]
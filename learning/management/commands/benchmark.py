@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from Hallino import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the micro-benchmarks declared in the apps benchmarks modules '
+        'against the current database, save them as a JSON baseline or '
+        'compare them with one'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='Cases to run, all by default')
+        parser.add_argument('--size', type=int, default=100, help='Rows loaded per case')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--save', metavar='PATH', help='Write the results as a baseline')
+        parser.add_argument('--compare', metavar='PATH', help='Baseline to compare against')
+        parser.add_argument('--threshold', type=float, default=10,
+                            help='Slowdown in percent reported as a regression')
+        parser.add_argument('--list', action='store_true', help='List the cases and exit')
+
+    def handle(self, *args, **options):
+        registry = benchmarks.autodiscover()
+        if options['list']:
+            for name in sorted(registry):
+                self.stdout.write(name)
+            return
+
+        unknown = set(options['names']) - set(registry)
+        if unknown:
+            raise CommandError(f'Unknown benchmarks: {", ".join(sorted(unknown))}')
+
+        results = {}
+        for name in sorted(options['names'] or registry):
+            # Cases may write, nothing they do is kept
+            with transaction.atomic():
+                results[name] = benchmarks.run(registry[name], options['size'], options['repeat'])
+                transaction.set_rollback(True)
+            result = results[name]
+            self.stdout.write(
+                f"{name:<40}{result['median'] * 1000:>10.2f} ms median"
+                f"{result['min'] * 1000:>10.2f} ms min"
+            )
+
+        if options['save']:
+            benchmarks.save(options['save'], results)
+            self.stdout.write(f"Baseline written to {options['save']}")
+
+        if options['compare']:
+            regressions = benchmarks.compare(
+                results, benchmarks.load(options['compare']), options['threshold'] / 100)
+            for name, ratio in regressions.items():
+                self.stdout.write(self.style.ERROR(f'{name} is {(ratio - 1) * 100:.0f}% slower'))
+            if regressions:
+                raise CommandError(f'{len(regressions)} benchmarks regressed')
+            self.stdout.write(self.style.SUCCESS('No regressions'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from learning.grading import GRADING_BATCH_SIZE, regrade_responses
+
+
+class Command(BaseCommand):
+    help = 'Grade stored user responses against the current answer keys'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=GRADING_BATCH_SIZE,
+            help='Response ids graded per range')
+        parser.add_argument(
+            '--ungraded-only', action='store_true',
+            help='Skip responses that already have a result')
+        parser.add_argument(
+            '--start', type=int, default=None,
+            help='Resume from this response id')
+
+    def handle(self, *args, **options):
+        total = changed = 0
+        for last_id, graded, batch_changed in regrade_responses(
+                options['batch_size'], options['ungraded_only'], options['start']):
+            total += graded
+            changed += batch_changed
+            if options['verbosity'] > 1:
+                self.stdout.write(f'up to id {last_id}: {graded} graded, {batch_changed} changed')
+        self.stdout.write(self.style.SUCCESS(f'{total} responses graded, {changed} changed'))
@@ -0,0 +1,175 @@
+import http.client
+import json
+import random
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from learning.models import Course, Lesson, Choice
+from users.models import User
+
+DEFAULT_MIX = 'catalog=2,outline=2,bundle=4,answer=2'
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not values:
+        return 0
+    index = max(0, int(round(percent / 100 * len(values))) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay a mix of catalog, lesson player and answer submission requests '
+        'against a running server and report throughput and latency per endpoint'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://localhost:8000/api/v1/')
+        parser.add_argument('--token', help='DRF token, defaults to the token of a seeded user')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--mix', default=DEFAULT_MIX,
+                            help=f'Endpoint weights, default "{DEFAULT_MIX}"')
+        parser.add_argument('--sample', type=int, default=500,
+                            help='Courses, lessons and questions sampled as targets')
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        self.base_url = options['base_url'].rstrip('/') + '/'
+        self.timeout = options['timeout']
+        self.token = options['token'] or self.get_token()
+        self.random = random.Random(options['seed'])
+        self.lock = threading.Lock()
+        self.load_targets(options['sample'])
+
+        mix = self.parse_mix(options['mix'])
+        scenarios, weights = zip(*mix.items())
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+        deadline = time.monotonic() + options['duration']
+
+        def worker():
+            while time.monotonic() < deadline:
+                with self.lock:
+                    name = self.random.choices(scenarios, weights)[0]
+                    method, path, body = getattr(self, f'request_{name}')()
+                start = time.monotonic()
+                ok = self.send(method, path, body)
+                elapsed = time.monotonic() - start
+                with self.lock:
+                    latencies[name].append(elapsed)
+                    if not ok:
+                        errors[name] += 1
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            for _ in range(options['concurrency']):
+                executor.submit(worker)
+        elapsed = time.monotonic() - started
+
+        report = self.build_report(latencies, errors, elapsed)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_report(report)
+
+    @staticmethod
+    def parse_mix(value):
+        mix = {}
+        for item in value.split(','):
+            name, _, weight = item.partition('=')
+            if not hasattr(Command, f'request_{name.strip()}'):
+                raise CommandError(f'Unknown scenario "{name}"')
+            mix[name.strip()] = float(weight or 1)
+        return mix
+
+    @staticmethod
+    def get_token():
+        user = User.objects.filter(is_active=True).order_by('id').first()
+        if not user:
+            raise CommandError('No users to authenticate as, run seed_data or pass --token')
+        return Token.objects.get_or_create(user=user)[0].key
+
+    def load_targets(self, sample):
+        self.course_slugs = list(Course.objects.filter(
+            is_published=True, is_active=True).values_list('slug', flat=True)[:sample])
+        self.lesson_ids = list(Lesson.objects.filter(
+            is_active=True).values_list('id', flat=True)[:sample])
+        self.answers = list(Choice.objects.filter(
+            question__questions_slides__isnull=False).values_list('question_id', 'id')[:sample])
+        if not (self.course_slugs and self.lesson_ids and self.answers):
+            raise CommandError('Not enough content to replay, run seed_data first')
+
+    def request_catalog(self):
+        return 'GET', 'courses/', None
+
+    def request_outline(self):
+        return 'GET', f'courses/{self.random.choice(self.course_slugs)}/outline/', None
+
+    def request_bundle(self):
+        return 'GET', f'lessons/{self.random.choice(self.lesson_ids)}/bundle/', None
+
+    def request_answer(self):
+        question_id, choice_id = self.random.choice(self.answers)
+        return 'POST', 'user/user-responses/', {
+            'question': question_id,
+            'choice_answers': [choice_id],
+        }
+
+    def send(self, method, path, body):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method)
+        request.add_header('Authorization', f'Token {self.token}')
+        request.add_header('Content-Type', 'application/json')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                return response.status < 400
+        except (OSError, http.client.HTTPException):
+            # URLError, timeouts and dropped connections alike count as
+            # errors instead of ending the worker thread
+            return False
+
+    @staticmethod
+    def build_report(latencies, errors, elapsed):
+        report = {'elapsed': round(elapsed, 2), 'endpoints': {}}
+        total = 0
+        for name, values in sorted(latencies.items()):
+            values.sort()
+            total += len(values)
+            report['endpoints'][name] = {
+                'requests': len(values),
+                'errors': errors[name],
+                'rps': round(len(values) / elapsed, 1),
+                'p50_ms': round(percentile(values, 50) * 1000, 1),
+                'p95_ms': round(percentile(values, 95) * 1000, 1),
+                'p99_ms': round(percentile(values, 99) * 1000, 1),
+            }
+        report['requests'] = total
+        report['rps'] = round(total / elapsed, 1) if elapsed else 0
+        return report
+
+    def print_report(self, report):
+        self.stdout.write(
+            f"{'endpoint':<10}{'requests':>10}{'errors':>8}{'rps':>9}"
+            f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+        )
+        for name, row in report['endpoints'].items():
+            self.stdout.write(
+                f"{name:<10}{row['requests']:>10}{row['errors']:>8}{row['rps']:>9}"
+                f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['requests']} requests in {report['elapsed']}s, {report['rps']} req/s"
+        ))
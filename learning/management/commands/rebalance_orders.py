@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import Lag
+
+from learning.ordering import ORDER_GAP, PARENT_FIELDS, get_parent_model, lock_parent, rebalance
+
+
+class Command(BaseCommand):
+    help = 'Respace the order keys of siblings whose gaps are running out'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-gap', type=int, default=ORDER_GAP // 64,
+            help='Rebalance parents with two neighbours closer than this')
+
+    def handle(self, *args, **options):
+        for model, parent_field in PARENT_FIELDS.items():
+            parent_attname = f'{parent_field}_id'
+            crowded = set(model.objects.annotate(
+                gap=F('order') - Window(Lag('order'), partition_by=F(parent_attname), order_by=F('order').asc())
+            ).filter(gap__lt=options['min_gap']).values_list(parent_attname, flat=True))
+
+            rows = 0
+            for parent_id in crowded:
+                with transaction.atomic():
+                    lock_parent(get_parent_model(model), parent_id)
+                    rows += rebalance(model, parent_id)
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}: {len(crowded)} parents, {rows} rows respaced')
+        self.stdout.write(self.style.SUCCESS('Order keys rebalanced'))
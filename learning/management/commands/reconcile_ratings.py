@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from learning.ratings import find_drift, recompute_ratings
+
+
+class Command(BaseCommand):
+    help = 'Recompute course rating totals from the reviews and report drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report the courses that drifted')
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Rewrite every course, not only the ones that drifted')
+
+    def handle(self, *args, **options):
+        drift = find_drift()
+        for course_id, fields in sorted(drift.items()):
+            changes = ', '.join(f'{field} {stored} -> {actual}' for field, (stored, actual) in fields.items())
+            self.stdout.write(f'course {course_id}: {changes}')
+        self.stdout.write(f'{len(drift)} courses drifted')
+
+        if options['dry_run']:
+            return
+        rows = recompute_ratings(None if options['all'] else list(drift))
+        self.stdout.write(self.style.SUCCESS(f'Ratings of {rows} courses recomputed'))
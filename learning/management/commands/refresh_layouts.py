@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from learning.models import Course
+from learning.progress import refresh_layout
+
+
+class Command(BaseCommand):
+    help = 'Hand out slide positions of the course layouts and compact them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('courses', nargs='*', type=int, help='Course ids, every course by default')
+        parser.add_argument(
+            '--compact', action='store_true',
+            help='Renumber every position and remap the completion bitmaps')
+
+    def handle(self, *args, **options):
+        course_ids = options['courses'] or Course.objects.order_by('id').values_list('id', flat=True)
+        count = 0
+        for course_id in course_ids:
+            if refresh_layout(course_id, compact=options['compact'] or None) is not None:
+                count += 1
+        self.stdout.write(self.style.SUCCESS(f'Layouts of {count} courses refreshed'))
@@ -0,0 +1,225 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from learning.models import (
+    Category, Course, Chapter, Lesson,
+    Editor, BaseQuestion, Choice, Slide
+)
+from learning.ordering import ORDER_GAP
+from learning.progress import refresh_layout
+from learning.search import update_course_search_vectors, index_subtree
+from users import leaderboard
+from users.models import User, Author, UserCourse, Streak, UserResponse
+
+
+class Command(BaseCommand):
+    help = 'Seed a production sized dataset with bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='seed',
+                            help='Prefix of generated slugs and emails, change it to seed again')
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--authors', type=int, default=500)
+        parser.add_argument('--courses', type=int, default=2000)
+        parser.add_argument('--chapters', type=int, default=4, help='Chapters per course')
+        parser.add_argument('--lessons', type=int, default=5, help='Lessons per chapter')
+        parser.add_argument('--slides', type=int, default=10, help='Slides per lesson')
+        parser.add_argument('--choices', type=int, default=4, help='Choices per question')
+        parser.add_argument('--users', type=int, default=50000)
+        parser.add_argument('--responses', type=int, default=2000000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.prefix = options['prefix']
+        self.batch_size = options['batch_size']
+        self.random = random.Random(options['seed'])
+
+        categories = self.seed_categories()
+        users = self.seed_users()
+        authors = self.seed_authors(users)
+        courses, choices_by_question = self.seed_content(categories, authors)
+        self.seed_enrollments(users, courses)
+        self.seed_streaks(users)
+        self.seed_responses(users, choices_by_question)
+        self.stdout.write(self.style.SUCCESS('Seeding finished'))
+
+    def log(self, message):
+        self.stdout.write(message)
+        self.stdout.flush()
+
+    def seed_categories(self):
+        categories = Category.objects.bulk_create([
+            Category(title=f'{self.prefix} category {i}', description='Seeded category')
+            for i in range(self.options['categories'])
+        ])
+        self.log(f'{len(categories)} categories')
+        return categories
+
+    def seed_users(self):
+        # Hashing once, every seeded user logs in with "password"
+        password = make_password('password')
+        users = []
+        for start in range(0, self.options['users'], self.batch_size):
+            stop = min(start + self.batch_size, self.options['users'])
+            users += User.objects.bulk_create([
+                User(
+                    email=f'{self.prefix}-user-{i}@example.com',
+                    firstname=f'First{i}', lastname=f'Last{i}',
+                    phone_number=f'+98912{i:07d}', password=password,
+                    type=self.random.choice([1, 2])
+                )
+                for i in range(start, stop)
+            ])
+            self.log(f'{len(users)} users')
+        return [user.id for user in users]
+
+    def seed_authors(self, user_ids):
+        authors = Author.objects.bulk_create([
+            Author(user_id=user_id, bio='Seeded author')
+            for user_id in user_ids[:self.options['authors']]
+        ])
+        self.log(f'{len(authors)} authors')
+        return [author.id for author in authors]
+
+    def seed_content(self, categories, author_ids):
+        """
+        Courses are seeded in chunks, each chunk in its own transaction,
+        so memory stays flat however large the tree is.
+        """
+        slides_per_course = self.options['chapters'] * self.options['lessons'] * self.options['slides']
+        chunk = max(1, self.batch_size // max(1, slides_per_course))
+        course_ids = []
+        choices_by_question = {}
+        for start in range(0, self.options['courses'], chunk):
+            stop = min(start + chunk, self.options['courses'])
+            with transaction.atomic():
+                course_ids += self.seed_courses(range(start, stop), categories, author_ids,
+                                                choices_by_question)
+            self.log(f'{len(course_ids)} courses, {len(choices_by_question)} questions')
+        return course_ids, choices_by_question
+
+    def seed_courses(self, numbers, categories, author_ids, choices_by_question):
+        options = self.options
+        courses = Course.objects.bulk_create([
+            Course(
+                title=f'{self.prefix} course {i}', slug=f'{self.prefix}-course-{i}',
+                description=f'Seeded course number {i}', duration=self.random.randint(30, 600),
+                level=self.random.randint(1, 4), price=self.random.randint(0, 50) * 100000,
+                is_published=True, is_active=True, language=self.random.choice([1, 2])
+            )
+            for i in numbers
+        ])
+        Course.categories.through.objects.bulk_create([
+            Course.categories.through(course_id=course.id, category_id=category.id)
+            for course in courses
+            for category in self.random.sample(categories, min(2, len(categories)))
+        ])
+        Course.authors.through.objects.bulk_create([
+            Course.authors.through(course_id=course.id, author_id=author_id)
+            for course in courses
+            for author_id in self.random.sample(author_ids, min(2, len(author_ids)))
+        ])
+
+        chapters = Chapter.objects.bulk_create([
+            Chapter(course=course, title=f'Chapter {i}', description='Seeded chapter',
+                    order=i * ORDER_GAP, estimated_time=60)
+            for course in courses
+            for i in range(1, options['chapters'] + 1)
+        ])
+        lessons = Lesson.objects.bulk_create([
+            Lesson(chapter=chapter, title=f'Lesson {i}', description='Seeded lesson',
+                   order=i * ORDER_GAP, duration=10, score=10, lesson_type=self.random.choice([1, 2]))
+            for chapter in chapters
+            for i in range(1, options['lessons'] + 1)
+        ], batch_size=self.batch_size)
+
+        # Every other slide is a quiz slide with a question, choices and an editor
+        slide_count = len(lessons) * options['slides']
+        quiz_count = slide_count // 2
+        editors = Editor.objects.bulk_create([
+            Editor(initial_code='print("Hello")') for _ in range(quiz_count)
+        ], batch_size=self.batch_size)
+        questions = BaseQuestion.objects.bulk_create([
+            BaseQuestion(
+                title=f'Question {i}', question_body='Which one is correct?',
+                question_type=self.random.choice([1, 2]), editor=editor
+            )
+            for i, editor in enumerate(editors)
+        ], batch_size=self.batch_size)
+        choices = Choice.objects.bulk_create([
+            Choice(question=question, text=f'Choice {i}', order=i * ORDER_GAP, type=1, is_correct=i == 1)
+            for question in questions
+            for i in range(1, options['choices'] + 1)
+        ], batch_size=self.batch_size)
+        for choice in choices:
+            choices_by_question.setdefault(choice.question_id, []).append(choice.id)
+
+        quiz = iter(zip(questions, editors))
+        slides = []
+        for lesson in lessons:
+            for i in range(1, options['slides'] + 1):
+                slide = Slide(lesson=lesson, title=f'Slide {i}', content='Seeded slide ' * 20,
+                              type=1, order=i * ORDER_GAP)
+                if i % 2 == 0:
+                    question, editor = next(quiz, (None, None))
+                    if question:
+                        slide.type, slide.question, slide.editor = 2, question, editor
+                slides.append(slide)
+        Slide.objects.bulk_create(slides, batch_size=self.batch_size)
+        # Bulk inserts skip the signals that hand out slide positions and
+        # fill the search vectors and documents
+        for course in courses:
+            refresh_layout(course.id)
+        update_course_search_vectors([course.id for course in courses])
+        index_subtree(Chapter, [chapter.id for chapter in chapters])
+        return [course.id for course in courses]
+
+    def seed_enrollments(self, user_ids, course_ids):
+        enrollments = UserCourse.objects.bulk_create([
+            UserCourse(user_id=user_id, score=self.random.randint(0, 1000), rank=0)
+            for user_id in user_ids
+        ], batch_size=self.batch_size)
+        UserCourse.courses.through.objects.bulk_create([
+            UserCourse.courses.through(usercourse_id=enrollment.id, course_id=course_id)
+            for enrollment in enrollments
+            for course_id in self.random.sample(course_ids, min(3, len(course_ids)))
+        ], batch_size=self.batch_size)
+        # Bulk inserts skip the leaderboard signals
+        leaderboard.rebuild(self.batch_size)
+        self.log(f'{len(enrollments)} enrollments')
+
+    def seed_streaks(self, user_ids):
+        # Last interactions spread over three days, so roll_streaks has
+        # running, lapsing and broken streaks to work on
+        today = timezone.localdate()
+        streaks = []
+        for user_id in user_ids:
+            current = self.random.randint(1, 30)
+            streaks.append(Streak(
+                user_id=user_id, type=7, current_streak=current, highest_streak=current,
+                last_interaction=today - timedelta(days=self.random.randint(0, 2))))
+        Streak.objects.bulk_create(streaks, batch_size=self.batch_size)
+        self.log(f'{len(streaks)} streaks')
+
+    def seed_responses(self, user_ids, choices_by_question):
+        question_ids = list(choices_by_question)
+        if not question_ids or not user_ids:
+            return
+
+        total = self.options['responses']
+        for start in range(0, total, self.batch_size):
+            size = min(self.batch_size, total - start)
+            picks = [self.random.choice(question_ids) for _ in range(size)]
+            UserResponse.objects.bulk_create([
+                UserResponse(user_id=self.random.choice(user_ids), question_id=question_id,
+                             choice_ids=[self.random.choice(choices_by_question[question_id])])
+                for question_id in picks
+            ])
+            self.log(f'{start + size} responses')
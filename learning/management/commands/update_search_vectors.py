@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from learning.models import Course
+from learning.search import DOCUMENT_SOURCES, index_documents, update_course_search_vectors
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored search vectors of courses and search documents'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        # Id ranges keep each UPDATE short on a large catalog
+        updated = 0
+        for start, stop in self.id_ranges(Course, batch_size):
+            updated += update_course_search_vectors(
+                Course.objects.filter(id__gte=start, id__lt=stop).values('id'))
+        self.stdout.write(f'Updated {updated} courses')
+
+        for model in DOCUMENT_SOURCES:
+            indexed = 0
+            for start, stop in self.id_ranges(model, batch_size):
+                ids = list(model.objects.filter(
+                    id__gte=start, id__lt=stop).values_list('id', flat=True))
+                indexed += index_documents(model, ids)
+            self.stdout.write(f'Indexed {indexed} {model._meta.verbose_name_plural}')
+
+        self.stdout.write(self.style.SUCCESS('Search vectors are up to date'))
+
+    @staticmethod
+    def id_ranges(model, size):
+        last_id = model.objects.aggregate(Max('id'))['id__max'] or 0
+        for start in range(0, last_id + 1, size):
+            yield start, start + size
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from learning.caching import get_course_tree
+from learning.models import Course
+
+
+class Command(BaseCommand):
+    help = 'Build the cached content tree of every published course'
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'SHARED_CACHE', False):
+            self.stdout.write(self.style.WARNING('No shared cache configured, course trees are not cached'))
+            return
+        courses = Course.objects.filter(is_published=True, is_active=True)
+        count = 0
+        for course in courses.iterator():
+            get_course_tree(course)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Warmed {count} course trees'))
@@ -1,6 +1,11 @@
 from django.apps import AppConfig
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Prefetch
 from django.utils.text import slugify
 
 from learning.learning_constants import LearningConstants
@@ -98,6 +103,24 @@ class Course(models.Model):
         null=True,
         blank=True
     )
+    # Maintained per review by learning.ratings, so rating needs no AVG()
+    RATING_FIELDS = [
+        'rating', 'rating_count', 'rating_total', 'rating_1_count',
+        'rating_2_count', 'rating_3_count', 'rating_4_count', 'rating_5_count'
+    ]
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_total = models.PositiveIntegerField(default=0, editable=False)
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)
+
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        help_text='Maintained by learning.search'
+    )
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -108,28 +131,91 @@ class Course(models.Model):
         indexes = [
             models.Index(fields=['title']),
             models.Index(fields=['slug']),
+            GinIndex(fields=['search_vector']),
+            GinIndex(fields=['title'], name='course_title_trgm', opclasses=['gin_trgm_ops']),
+            models.Index(fields=['-created_at', '-id'], name='course_created_keyset'),
+            models.Index(fields=['-rating', '-id'], name='course_rating_keyset'),
         ]
 
     def __str__(self):
         return self.title
 
     def calculate_rating(self):
-        """Calculate average rating based on user reviews"""
-        pass
+        """Average rating of the reviews, from the maintained running totals"""
+        if not self.rating_count:
+            return None
+        return round(self.rating_total / self.rating_count, 1)
+
+    @property
+    def rating_distribution(self):
+        return {stars: getattr(self, f'rating_{stars}_count') for stars in range(1, 6)}
 
     def get_active_chapters(self):
         return self.chapters.filter(is_active=True).order_by('order')
 
+    def get_outline(self):
+        """
+        Active chapters with their active lessons and slide stubs,
+        loaded in three queries regardless of the course size.
+        """
+        slides = Slide.objects.filter(is_active=True).only(
+            'id', 'lesson_id', 'title', 'order', 'type', 'time_limit'
+        ).order_by('order')
+        lessons = Lesson.objects.filter(is_active=True).only(
+            'id', 'chapter_id', 'title', 'order', 'duration',
+            'is_required', 'lesson_type'
+        ).order_by('order').prefetch_related(Prefetch('slides', queryset=slides))
+        return self.get_active_chapters().only(
+            'id', 'course_id', 'title', 'order', 'estimated_time'
+        ).prefetch_related(Prefetch('lessons', queryset=lessons))
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.title)
             org_slug = self.slug
             if Course.objects.filter(slug=self.slug).exists():
                 self.slug = f"{org_slug}-{self.id}"
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Saving a loaded course must not write back stale rating totals
+            # or search vector, nor load the deferred columns to write them
+            skipped = {*self.RATING_FIELDS, 'search_vector', *self.get_deferred_fields()}
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in skipped
+            ]
+        super().save(*args, **kwargs)
+
+
+class StoredParentMixin:
+    """
+    Keeps the parent key as loaded, so signal receivers can tell a move to
+    another parent from an edit in place
+    """
+    parent_field = None
+    stored_parent_id = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.stored_parent_id = instance.__dict__.get(f'{cls.parent_field}_id')
+        return instance
+
+    def moved_from(self):
+        """
+        The parent before the move being saved, None when the parent is unchanged or unknown
+        """
+        parent_id = getattr(self, f'{self.parent_field}_id')
+        if self.stored_parent_id is not None and self.stored_parent_id != parent_id:
+            return self.stored_parent_id
+        return None
+
+    def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
+        # After post_save, every receiver saw the previous parent
+        self.stored_parent_id = getattr(self, f'{self.parent_field}_id')
 
 
-class Chapter(models.Model):
+class Chapter(StoredParentMixin, models.Model):
     course = models.ForeignKey(
         Course,
         on_delete=models.CASCADE,
@@ -145,9 +231,16 @@ class Chapter(models.Model):
         help_text='estimated in minutes')
     is_active = models.BooleanField('active', default=True)
 
+    parent_field = 'course'
+
     class Meta:
         verbose_name = 'Chapter'
         verbose_name_plural = 'Chapters'
+        # Deferred, so a reorder can swap keys within one UPDATE, see learning.ordering
+        constraints = [
+            models.UniqueConstraint(fields=['course', 'order'], name='unique_chapter_order',
+                                    deferrable=models.Deferrable.DEFERRED),
+        ]
 
     def __str__(self):
         return f"{self.course.title} - {self.title}"
@@ -157,7 +250,7 @@ class Chapter(models.Model):
         # Move to manager.py
 
 
-class Lesson(models.Model):
+class Lesson(StoredParentMixin, models.Model):
     chapter = models.ForeignKey(
         Chapter,
         on_delete=models.CASCADE,
@@ -180,9 +273,18 @@ class Lesson(models.Model):
         choices=LearningConstants.LESSON_TYPE_CHOICES
     )
 
+    parent_field = 'chapter'
+
     class Meta:
         verbose_name = 'Lesson'
         verbose_name_plural = 'Lessons'
+        constraints = [
+            models.UniqueConstraint(fields=['chapter', 'order'], name='unique_lesson_order',
+                                    deferrable=models.Deferrable.DEFERRED),
+        ]
+        indexes = [
+            GinIndex(fields=['title'], name='lesson_title_trgm', opclasses=['gin_trgm_ops']),
+        ]
 
     def __str__(self):
         return f"{self.chapter.title} - {self.title}"
@@ -191,6 +293,17 @@ class Lesson(models.Model):
         return self.slides.filter(is_active=True).order_by('order')
         # Move to manager.py
 
+    def get_bundle(self):
+        """
+        Active slides with their question, ordered visible choices and
+        editors, loaded in two queries regardless of the lesson size.
+        """
+        return self.get_active_slides().select_related(
+            'editor', 'question', 'question__editor'
+        ).prefetch_related(
+            Prefetch('question__choices', queryset=Choice.objects.filter(hidden=False).order_by('order', 'id'))
+        )
+
 
 class Editor(models.Model):
     initial_code = models.TextField(
@@ -249,6 +362,9 @@ class BaseQuestion(models.Model):
         verbose_name = 'Question'
         verbose_name_plural = 'Questions'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='question_created_keyset'),
+        ]
 
     def __str__(self):
         return self.title
@@ -281,12 +397,16 @@ class Choice(models.Model):
         verbose_name = 'Choice'
         verbose_name_plural = 'Choices'
         ordering = ['order']
+        constraints = [
+            models.UniqueConstraint(fields=['question', 'order'], name='unique_choice_order',
+                                    deferrable=models.Deferrable.DEFERRED),
+        ]
 
     def __str__(self):
         return f"{self.question.title} - {self.text}"
 
 
-class Slide(models.Model):
+class Slide(StoredParentMixin, models.Model):
     lesson = models.ForeignKey(
         Lesson,
         on_delete=models.CASCADE,
@@ -337,10 +457,161 @@ class Slide(models.Model):
         related_name='editor_slides'
     )
     order = models.PositiveIntegerField()
+    # Bit of the slide in the completion bitmaps of its course, see learning.progress
+    position = models.PositiveIntegerField(null=True, blank=True, editable=False)
+
+    parent_field = 'lesson'
 
     class Meta:
         verbose_name = 'Slide'
         verbose_name_plural = 'Slides'
+        constraints = [
+            models.UniqueConstraint(fields=['lesson', 'order'], name='unique_slide_order',
+                                    deferrable=models.Deferrable.DEFERRED),
+        ]
 
     def __str__(self):
         return f"{self.lesson.title} - {self.title}"
+
+
+class CourseLayout(models.Model):
+    """
+    Bit positions of the slides of a course in the completion bitmaps of
+    its learners, with the progress weight of each position. Positions
+    only grow, a removed slide leaves a retired position behind until the
+    layout is compacted. Maintained by learning.progress.
+    """
+    course = models.OneToOneField(
+        Course,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='layout'
+    )
+    # Slide id at each position, 0 for retired positions
+    slide_ids = ArrayField(models.BigIntegerField(), default=list)
+    weights = ArrayField(models.PositiveSmallIntegerField(), default=list)
+    total_weight = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Course layout'
+        verbose_name_plural = 'Course layouts'
+
+    def __str__(self):
+        return f"{self.course_id}: {len(self.slide_ids)} positions"
+
+
+class SearchDocument(models.Model):
+    """
+    Denormalized searchable text of a lesson, slide, question or editor,
+    with the lesson and course it is reached through. Maintained by learning.search.
+    """
+    entity_type = models.IntegerField(choices=LearningConstants.SEARCH_ENTITY_CHOICES)
+    object_id = models.BigIntegerField()
+    course = models.ForeignKey(
+        Course,
+        on_delete=models.CASCADE,
+        null=True,
+        related_name='+'
+    )
+    lesson = models.ForeignKey(
+        Lesson,
+        on_delete=models.CASCADE,
+        null=True,
+        related_name='+'
+    )
+    title = models.CharField(max_length=255, blank=True)
+    body = models.TextField(blank=True)
+    search_vector = SearchVectorField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Search document'
+        verbose_name_plural = 'Search documents'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['entity_type', 'object_id'],
+                name='unique_search_document'
+            ),
+        ]
+        indexes = [
+            GinIndex(fields=['search_vector']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_entity_type_display()} {self.object_id} - {self.title}"
+
+
+class SlideCounter(models.Model):
+    """
+    One shard of an activity counter of a slide, a counter is the sum of its
+    shards. Written in batches by learning.counters.
+    """
+    slide = models.ForeignKey(
+        Slide,
+        on_delete=models.CASCADE,
+        related_name='counters'
+    )
+    kind = models.IntegerField(choices=LearningConstants.SLIDE_COUNTER_CHOICES)
+    shard = models.PositiveSmallIntegerField()
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Slide counter'
+        verbose_name_plural = 'Slide counters'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['slide', 'kind', 'shard'],
+                name='unique_slide_counter_shard'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.slide_id} {self.get_kind_display()} [{self.shard}] - {self.value}"
+
+
+class CourseReview(models.Model):
+    course = models.ForeignKey(
+        Course,
+        on_delete=models.CASCADE,
+        related_name='reviews'
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='course_reviews'
+    )
+    rating = models.PositiveSmallIntegerField(
+        validators=[MinValueValidator(1), MaxValueValidator(5)]
+    )
+    comment = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Course review'
+        verbose_name_plural = 'Course reviews'
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['course', 'user'], name='unique_course_review'),
+        ]
+        indexes = [
+            models.Index(fields=['course', '-created_at', '-id'], name='review_course_keyset'),
+        ]
+
+    # Rating as stored, the course totals move by the difference on save
+    stored_rating = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.stored_rating = instance.__dict__.get('rating')
+        return instance
+
+    def __str__(self):
+        return f"{self.course_id} - {self.user_id}: {self.rating}"
+
+    def save(self, *args, **kwargs):
+        # The post_save update of the course totals commits with the review
+        with transaction.atomic():
+            super().save(*args, **kwargs)
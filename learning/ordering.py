@@ -0,0 +1,131 @@
+"""
+Gapped ordering keys of chapters, lessons, slides and choices.
+
+Siblings are spaced ORDER_GAP apart, so placing an item between two
+others takes the midpoint and writes a single row. Allocation locks the
+parent row, which serializes concurrent creates and moves under the same
+parent. When two neighbours are 1 apart the siblings are renumbered, and
+the rebalance_orders command does the same in the background before gaps
+run out. Keys from before the gaps, 1 to n, count as crowded: run
+rebalance_orders once after deploying to respace them all.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BooleanField, ExpressionWrapper, Max, Min, Q
+from rest_framework import serializers
+
+from .caching import get_course_ids, invalidate_course_tree
+from .models import Chapter, Lesson, Slide, Choice
+
+ORDER_GAP = getattr(settings, 'ORDER_GAP', 1024)
+
+# Placement after the last sibling, as opposed to after=None for the first place
+LAST = object()
+
+PARENT_FIELDS = {
+    Chapter: 'course',
+    Lesson: 'chapter',
+    Slide: 'lesson',
+    Choice: 'question',
+}
+
+# Children hidden from learners, who can't list them in a reorder
+ACTIVE_FILTERS = {
+    Chapter: Q(is_active=True),
+    Lesson: Q(is_active=True),
+    Slide: Q(is_active=True),
+    Choice: Q(hidden=False),
+}
+
+
+def get_parent_model(model):
+    return model._meta.get_field(PARENT_FIELDS[model]).related_model
+
+
+def get_siblings(model, parent_id):
+    return model.objects.filter(**{f'{PARENT_FIELDS[model]}_id': parent_id})
+
+
+def lock_parent(parent_model, parent_id):
+    """
+    Lock the parent row until the end of the transaction
+    """
+    list(parent_model.objects.select_for_update().filter(pk=parent_id).values_list('pk'))
+
+
+def rebalance(model, parent_id):
+    """
+    Space the siblings ORDER_GAP apart again, keeping their order, in one UPDATE
+    """
+    rows = list(get_siblings(model, parent_id).order_by('order', 'pk').only('id', 'order'))
+    changed = []
+    for position, row in enumerate(rows, start=1):
+        if row.order != position * ORDER_GAP:
+            row.order = position * ORDER_GAP
+            changed.append(row)
+    model.objects.bulk_update(changed, ['order'])
+    return len(changed)
+
+
+def allocate_order(model, parent_id, after=LAST, exclude=None):
+    """
+    Key for an item placed right after the sibling with id ``after``, first
+    for None, last by default. ``exclude`` is the item being moved. Call with
+    the parent locked.
+    """
+    siblings = get_siblings(model, parent_id)
+    if exclude is not None:
+        siblings = siblings.exclude(pk=exclude)
+
+    if after is LAST:
+        last = siblings.aggregate(last=Max('order'))['last']
+        return (last or 0) + ORDER_GAP
+    if after is None:
+        low = 0
+    else:
+        low = siblings.filter(pk=after).values_list('order', flat=True).first()
+        if low is None:
+            raise serializers.ValidationError({'after': 'Must be a sibling of the item.'})
+
+    high = siblings.filter(order__gt=low).aggregate(high=Min('order'))['high']
+    if high is None:
+        return low + ORDER_GAP
+    if high - low < 2:
+        rebalance(model, parent_id)
+        return allocate_order(model, parent_id, after, exclude)
+    return (low + high) // 2
+
+
+def reorder(parent, children, orders):
+    """
+    Apply ``orders``, {child id: position}, to the ``children`` queryset of
+    ``parent`` in one transaction: one query locks and checks the children,
+    one UPDATE writes every position as a gapped key.
+
+    The orders have to cover exactly the active children of the parent, ids
+    of other parents are rejected. Inactive children keep their place among
+    the others.
+    """
+    with transaction.atomic():
+        lock_parent(type(parent), parent.pk)
+        # A related manager's queryset sets the parent on every row, which
+        # loads a deferred parent key one row at a time
+        rows = list(children.select_for_update().annotate(
+            active=ExpressionWrapper(ACTIVE_FILTERS[children.model], output_field=BooleanField())
+        ).order_by('order', 'pk').only('id', 'order', PARENT_FIELDS[children.model]))
+        active = [row for row in rows if row.active]
+        if {row.id for row in active} != set(orders):
+            raise serializers.ValidationError(
+                {'orders': 'Orders must list every active child of this parent and nothing else.'})
+
+        # The active children fill the places of the active ones in their new order
+        ordered = iter(sorted(active, key=lambda row: orders[row.id]))
+        changed = []
+        for position, row in enumerate([next(ordered) if row.active else row for row in rows], start=1):
+            if row.order != position * ORDER_GAP:
+                row.order = position * ORDER_GAP
+                changed.append(row)
+        children.model.objects.bulk_update(changed, ['order'])
+        # bulk_update sends no signals
+        invalidate_course_tree(*get_course_ids(parent))
+    return len(changed)
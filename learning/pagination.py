@@ -1,7 +1,232 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import datetime
+import json
+from functools import reduce
+from operator import and_
+
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 100
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder cuts datetimes to milliseconds, cursors need them exact
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def approximate_count(queryset):
+    """
+    Row estimate of the planner instead of a COUNT(*) scan, exact on other databases
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination over the ordering of the queryset with the
+    primary key as tie breaker, e.g. (order, id) or (-created_at, -id).
+
+    The cursor holds the ordering values of the last row of the page, so
+    every page is an index range scan no matter how deep it is. There is no
+    COUNT(*); ?count=true adds the planner's row estimate as ``count``.
+    """
+    page_size = api_settings.PAGE_SIZE or 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.fields = [self.get_field(queryset, field.lstrip('-')) for field in self.ordering]
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ('1', 'true'):
+            self.count = approximate_count(queryset)
+
+        position, reverse = self.decode_cursor(request)
+        ordering = [self.invert(field) for field in self.ordering] if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.seek(queryset.model, ordering, position))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.next_position = self.previous_position = None
+        if rows and (has_more or reverse):
+            self.next_position = self.get_position(rows[-1])
+        if rows and (position is not None and not reverse or reverse and has_more):
+            self.previous_position = self.get_position(rows[0])
+        return rows
+
+    def get_paginated_response(self, data):
+        response = {
+            'next': self.get_link(self.next_position, reverse=False),
+            'previous': self.get_link(self.previous_position, reverse=True),
+            'results': data,
+        }
+        if self.count is not None:
+            response = {'count': self.count, **response}
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {'type': 'integer'},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    @staticmethod
+    def get_ordering(queryset):
+        """
+        Ordering applied by the view or its filters, falling back to the
+        model's, with the primary key appended as the unique tie breaker
+        """
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        if any(not isinstance(field, str) for field in ordering):
+            raise ImproperlyConfigured('KeysetPagination only orders by field names')
+        if not ordering or ordering[-1].lstrip('-') not in ('pk', 'id'):
+            descending = bool(ordering) and ordering[-1].startswith('-')
+            ordering.append('-pk' if descending else 'pk')
+        return ordering
+
+    @staticmethod
+    def get_field(queryset, name):
+        """
+        Model or annotation field behind an ordering name, None when unknown
+        """
+        annotation = queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        model, field = queryset.model, None
+        for part in name.split('__'):
+            if model is None:
+                return None
+            try:
+                field = model._meta.pk if part == 'pk' else model._meta.get_field(part)
+            except FieldDoesNotExist:
+                return None
+            model = field.related_model
+        return field
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def get_position(self, obj):
+        """
+        Ordering values of ``obj`` in their database form, so values such
+        as phone numbers can be encoded in a cursor
+        """
+        position = []
+        for name, field in zip(self.ordering, self.fields):
+            value = obj
+            for attribute in name.lstrip('-').split('__'):
+                value = getattr(value, attribute, None)
+            if value is not None and field is not None and not field.is_relation:
+                value = field.get_prep_value(value)
+            position.append(value)
+        return position
+
+    @staticmethod
+    def seek(model, ordering, position):
+        """
+        Rows after ``position`` in ``ordering``, Postgres sorts NULLs last
+        ascending and first descending
+        """
+        conditions = []
+        equal = []
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            if field.startswith('-'):
+                after = Q(**{f'{name}__isnull': False}) if value is None else Q(**{f'{name}__lt': value})
+            else:
+                after = Q(pk__in=[]) if value is None else (
+                        Q(**{f'{name}__gt': value}) | Q(**{f'{name}__isnull': True}))
+            conditions.append(reduce(and_, equal, after))
+            equal.append(Q(**{f'{name}__isnull': True}) if value is None else Q(**{name: value}))
+        condition = reduce(lambda left, right: left | right, conditions)
+
+        # A bound on the leading column lets the planner start an index range scan
+        leading, value = ordering[0], position[0]
+        try:
+            nullable = model._meta.get_field(leading.lstrip('-')).null
+        except FieldDoesNotExist:
+            nullable = True
+        if value is not None and not nullable:
+            lookup = 'lte' if leading.startswith('-') else 'gte'
+            condition &= Q(**{f'{leading.lstrip("-")}__{lookup}': value})
+        return condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            position, reverse = list(cursor['p']), bool(cursor['r'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound('Invalid cursor')
+        if len(position) != len(self.ordering):
+            raise NotFound('Invalid cursor')
+        try:
+            position = [
+                value if value is None or field is None else field.to_python(value)
+                for field, value in zip(self.fields, position)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound('Invalid cursor')
+        return position, reverse
+
+    def get_link(self, position, reverse):
+        if position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.count_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(position, reverse))
+
+    @staticmethod
+    def encode_cursor(position, reverse=False):
+        cursor = json.dumps({'p': position, 'r': int(reverse)}, cls=CursorEncoder)
+        return base64.urlsafe_b64encode(cursor.encode()).decode()
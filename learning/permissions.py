@@ -1,5 +1,112 @@
 from rest_framework import permissions
 
+from .models import Course, Chapter, Lesson, Slide, BaseQuestion, Choice
+
+# Lookup from a course to the content it owns
+COURSE_PATHS = {
+    Course: 'pk',
+    Chapter: 'chapters',
+    Lesson: 'chapters__lessons',
+    Slide: 'chapters__lessons__slides',
+    BaseQuestion: 'chapters__lessons__slides__question',
+    Choice: 'chapters__lessons__slides__question__choices',
+}
+
+
+class Authorship:
+    """
+    Whether a user authors the course that owns a piece of content.
+
+    Objects whose course is known without a query (courses, chapters,
+    content with its parents already loaded) are checked against the
+    user's authored course ids, taken from the JWT claims or loaded once.
+    Anything else costs a single EXISTS query, remembered for the rest of
+    the request.
+    """
+    def __init__(self, user):
+        self.user = user
+        self._course_ids = None
+        self._resolved = {}
+
+    @property
+    def course_ids(self):
+        if self._course_ids is None:
+            self._course_ids = getattr(self.user, 'authored_course_ids', None)
+        if self._course_ids is None:
+            self._course_ids = set(Course.authors.through.objects.filter(
+                author__user_id=self.user.pk).values_list('course_id', flat=True))
+        return self._course_ids
+
+    @staticmethod
+    def loaded_course_id(obj):
+        """
+        Id of the course owning ``obj`` if it takes no query, else None
+        """
+        if isinstance(obj, Course):
+            return obj.pk
+        if isinstance(obj, Slide):
+            obj = obj._state.fields_cache.get('lesson')
+        if isinstance(obj, Lesson):
+            obj = obj._state.fields_cache.get('chapter')
+        if isinstance(obj, Chapter):
+            return obj.course_id
+        return None
+
+    def is_author(self, obj):
+        if not self.user or not self.user.is_authenticated:
+            return False
+        model = obj._meta.concrete_model
+        if model not in COURSE_PATHS:
+            return False
+
+        course_id = self.loaded_course_id(obj)
+        if course_id is not None:
+            return course_id in self.course_ids
+        key = (model, obj.pk)
+        if key not in self._resolved:
+            courses = Course.objects.filter(**{COURSE_PATHS[model]: obj.pk})
+            self._resolved[key] = self.filter_authored(courses).exists()
+        return self._resolved[key]
+
+    def filter_authored(self, courses):
+        """
+        The courses of ``courses`` the user authors, by id when they are known
+        """
+        course_ids = self._course_ids
+        if course_ids is None:
+            course_ids = getattr(self.user, 'authored_course_ids', None)
+        if course_ids is not None:
+            return courses.filter(pk__in=course_ids)
+        return courses.filter(authors__user_id=self.user.pk)
+
+    def authored(self, objects):
+        """
+        The subset of ``objects``, all of one model, whose course the user
+        authors, in a single query. Later is_author() checks of the objects
+        reuse the answer.
+        """
+        objects = list(objects)
+        if not objects or not self.user or not self.user.is_authenticated:
+            return []
+        model = objects[0]._meta.concrete_model
+        path = COURSE_PATHS[model]
+        courses = self.filter_authored(
+            Course.objects.filter(**{f'{path}__in': [obj.pk for obj in objects]}))
+        allowed = set(courses.values_list(path, flat=True))
+        for obj in objects:
+            self._resolved[model, obj.pk] = obj.pk in allowed
+        return [obj for obj in objects if obj.pk in allowed]
+
+
+def get_authorship(request):
+    """
+    The Authorship of the request's user, shared by every check of the request
+    """
+    authorship = getattr(request, '_authorship', None)
+    if authorship is None or authorship.user is not request.user:
+        authorship = request._authorship = Authorship(request.user)
+    return authorship
+
 
 class IsStaffOrReadOnly(permissions.BasePermission):
     """
@@ -13,18 +120,12 @@ class IsStaffOrReadOnly(permissions.BasePermission):
 
 class IsAuthorOrReadOnly(permissions.BasePermission):
     """
-    Only allow authors of an object to edit it.
+    Only allow authors of the course owning an object to edit it.
     """
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
             return True
-
-        # Assuming the object has an author field that's related to Course authors
-        if hasattr(obj, 'chapter'):
-            return request.user in obj.chapter.course.authors.all()
-        elif hasattr(obj, 'course'):
-            return request.user in obj.course.authors.all()
-        return False
+        return get_authorship(request).is_author(obj)
 
 
 class IsCourseAuthorOrReadOnly(permissions.BasePermission):
@@ -34,4 +135,19 @@ class IsCourseAuthorOrReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
             return True
-        return request.user in obj.authors.all()
+        return get_authorship(request).is_author(obj)
+
+
+class IsReviewerOrReadOnly(permissions.BasePermission):
+    """
+    Anyone signed in may review, only the reviewer may edit a review.
+    """
+    def has_permission(self, request, view):
+        if request.method in permissions.SAFE_METHODS:
+            return True
+        return bool(request.user and request.user.is_authenticated)
+
+    def has_object_permission(self, request, view, obj):
+        if request.method in permissions.SAFE_METHODS:
+            return True
+        return obj.user_id == request.user.pk
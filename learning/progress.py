@@ -0,0 +1,206 @@
+"""
+Server side course progress from per user completion bitmaps.
+
+Every slide of a course owns a bit position in the course layout.
+Positions are handed out in course order and never move, so reordering or
+editing slides leaves the bitmaps of the learners untouched. A removed
+slide retires its position. Once retired positions outnumber the live
+ones the layout is compacted, and every bitmap of the course is remapped
+to the new positions under the layout lock.
+
+Completing a slide sets its bit with one upsert, whatever the size of the
+course. Progress is the weight of the completed positions over the weight
+of all positions, so optional slides and slides of optional lessons count
+for PROGRESS_OPTIONAL_WEIGHT only. The progress of any number of courses
+is read in one query.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import IntegerField
+from django.db.models.expressions import RawSQL
+
+from users.models import CourseProgress
+from .models import Course, Chapter, Lesson, CourseLayout, Slide
+
+PROGRESS_REQUIRED_WEIGHT = getattr(settings, 'PROGRESS_REQUIRED_WEIGHT', 1)
+PROGRESS_OPTIONAL_WEIGHT = getattr(settings, 'PROGRESS_OPTIONAL_WEIGHT', 0)
+PROGRESS_REMAP_BATCH_SIZE = getattr(settings, 'PROGRESS_REMAP_BATCH_SIZE', 5000)
+
+
+def slide_weight(is_active, is_required, lesson_is_active, lesson_is_required, chapter_is_active):
+    if not (is_active and lesson_is_active and chapter_is_active):
+        return 0
+    if is_required and lesson_is_required:
+        return PROGRESS_REQUIRED_WEIGHT
+    return PROGRESS_OPTIONAL_WEIGHT
+
+
+def has_bit(bitmap, position):
+    # Same bit order as get_bit() on bytea
+    return position >> 3 < len(bitmap) and bool(bitmap[position >> 3] >> (position & 7) & 1)
+
+
+def remap_bitmap(bitmap, positions, size):
+    """
+    ``bitmap`` with the bit of every old position in ``positions`` moved to
+    its new position, for a layout of ``size`` positions
+    """
+    remapped = bytearray((size + 7) // 8)
+    for old, new in positions.items():
+        if has_bit(bitmap, old):
+            remapped[new >> 3] |= 1 << (new & 7)
+    return bytes(remapped)
+
+
+def remap_progress(course_id, positions, size, batch_size=PROGRESS_REMAP_BATCH_SIZE):
+    """
+    Move the completed bits of every learner of the course to new positions
+    """
+    last_id = 0
+    while True:
+        rows = list(CourseProgress.objects.filter(course_id=course_id, id__gt=last_id).order_by('id').values_list(
+            'id', 'completed')[:batch_size])
+        if not rows:
+            return
+        CourseProgress.objects.bulk_update([
+            CourseProgress(id=progress_id, completed=remap_bitmap(bytes(completed), positions, size))
+            for progress_id, completed in rows
+        ], ['completed'])
+        last_id = rows[-1][0]
+
+
+def refresh_layout(course_id, compact=None):
+    """
+    Bring the layout of the course in line with its slides. New slides get
+    the next free positions, removed ones retire theirs. ``compact``
+    renumbers every position and remaps the bitmaps, by default once most
+    positions are retired.
+    """
+    if not Course.objects.filter(pk=course_id).exists():
+        return None
+    with transaction.atomic():
+        CourseLayout.objects.get_or_create(course_id=course_id)
+        layout = CourseLayout.objects.select_for_update().get(course_id=course_id)
+        slides = Slide.objects.filter(lesson__chapter__course_id=course_id).order_by(
+            'lesson__chapter__order', 'lesson__order', 'order').values_list(
+            'id', 'position', 'is_active', 'is_required',
+            'lesson__is_active', 'lesson__is_required', 'lesson__chapter__is_active')
+
+        slide_ids = list(layout.slide_ids)
+        weights, stored, kept = {}, {}, {}
+        for slide_id, position, *flags in slides:
+            weights[slide_id] = slide_weight(*flags)
+            stored[slide_id] = position
+            if position is not None and position < len(slide_ids) and slide_ids[position] == slide_id:
+                kept[position] = slide_id
+
+        if compact is None:
+            compact = len(slide_ids) - len(kept) > len(weights)
+        if compact:
+            new_ids = list(weights)
+            new_positions = {slide_id: position for position, slide_id in enumerate(new_ids)}
+            remap_progress(course_id, {old: new_positions[slide_id] for old, slide_id in kept.items()},
+                           len(new_ids))
+            slide_ids = new_ids
+        else:
+            slide_ids = [slide_id if position in kept else 0 for position, slide_id in enumerate(slide_ids)]
+            placed = set(kept.values())
+            slide_ids += [slide_id for slide_id in weights if slide_id not in placed]
+
+        layout.slide_ids = slide_ids
+        layout.weights = [weights.get(slide_id, 0) for slide_id in slide_ids]
+        layout.total_weight = sum(layout.weights)
+        layout.save()
+        Slide.objects.bulk_update([
+            Slide(id=slide_id, position=position)
+            for position, slide_id in enumerate(slide_ids)
+            if slide_id and stored[slide_id] != position
+        ], ['position'])
+    return layout
+
+
+def refresh_layouts(*course_ids):
+    """
+    Refresh the layouts of the given courses once the current transaction commits
+    """
+    course_ids = {course_id for course_id in course_ids if course_id}
+    if course_ids:
+        transaction.on_commit(lambda: [refresh_layout(course_id) for course_id in sorted(course_ids)])
+
+
+def _set_bit(cursor, user_id, slide_id, course_ids):
+    slides = connection.ops.quote_name(Slide._meta.db_table)
+    lessons = connection.ops.quote_name(Lesson._meta.db_table)
+    chapters = connection.ops.quote_name(Chapter._meta.db_table)
+    layouts = connection.ops.quote_name(CourseLayout._meta.db_table)
+    table = connection.ops.quote_name(CourseProgress._meta.db_table)
+
+    # Shared lock, a compaction waits for the bits set against the old positions
+    cursor.execute(
+        f'SELECT c.course_id, s.position, cardinality(l.slide_ids) FROM {slides} s '
+        f'JOIN {lessons} le ON le.id = s.lesson_id JOIN {chapters} c ON c.id = le.chapter_id '
+        f'JOIN {layouts} l ON l.course_id = c.course_id '
+        f'WHERE s.id = %s AND s.is_active AND l.slide_ids[s.position + 1] = s.id '
+        f'AND (%s::bigint[] IS NULL OR c.course_id = ANY(%s::bigint[])) FOR SHARE OF l',
+        [slide_id, course_ids, course_ids])
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    course_id, position, size = row
+    cursor.execute(
+        f'INSERT INTO {table} AS p (user_id, course_id, completed, updated_at) '
+        f"VALUES (%(user)s, %(course)s, set_bit(decode(repeat('00', %(size)s), 'hex'), %(bit)s, 1), now()) "
+        f'ON CONFLICT (user_id, course_id) DO UPDATE SET '
+        f"completed = set_bit(p.completed || decode(repeat('00', GREATEST(%(size)s - octet_length(p.completed), 0)), "
+        f"'hex'), %(bit)s, 1), updated_at = now() "
+        f'WHERE CASE WHEN octet_length(p.completed) > %(bit)s / 8 THEN get_bit(p.completed, %(bit)s) = 0 ELSE true END',
+        {'user': user_id, 'course': course_id, 'bit': position,
+         'size': max(position // 8 + 1, (size + 7) // 8)})
+    return course_id
+
+
+def complete_slide(user_id, slide_id, course_ids=None):
+    """
+    Mark an active slide completed for the user, in one of ``course_ids``
+    when given. Returns the course of the slide, None when it can't be
+    completed.
+    """
+    course_ids = list(course_ids) if course_ids is not None else None
+    with transaction.atomic(), connection.cursor() as cursor:
+        course_id = _set_bit(cursor, user_id, slide_id, course_ids)
+    if course_id is not None:
+        return course_id
+
+    # The slide is new to the layout of its course
+    slide = Slide.objects.filter(pk=slide_id, is_active=True)
+    if course_ids is not None:
+        slide = slide.filter(lesson__chapter__course_id__in=course_ids)
+    course_id = slide.values_list('lesson__chapter__course_id', flat=True).first()
+    if course_id is None:
+        return None
+    refresh_layout(course_id)
+    with transaction.atomic(), connection.cursor() as cursor:
+        return _set_bit(cursor, user_id, slide_id, course_ids)
+
+
+def course_progress(user_id, course_ids):
+    """
+    {course id: percentage} of the user for the given courses, in one
+    query. ``course_ids`` may be a queryset of ids, courses without a
+    layout have no slides and are left out.
+    """
+    layouts = connection.ops.quote_name(CourseLayout._meta.db_table)
+    table = connection.ops.quote_name(CourseProgress._meta.db_table)
+    done = RawSQL(
+        f'SELECT COALESCE(SUM(w.weight), 0) FROM {table} p, '
+        f'unnest({layouts}.weights) WITH ORDINALITY AS w (weight, position) '
+        f'WHERE p.user_id = %s AND p.course_id = {layouts}.course_id AND w.weight > 0 '
+        f'AND CASE WHEN w.position <= octet_length(p.completed) * 8 '
+        f'THEN get_bit(p.completed, (w.position - 1)::integer) = 1 ELSE false END',
+        [user_id], output_field=IntegerField())
+    rows = CourseLayout.objects.filter(course_id__in=course_ids).annotate(done=done).values_list(
+        'course_id', 'done', 'total_weight')
+    return {
+        course_id: done * 100 // total if total else 0
+        for course_id, done, total in rows
+    }
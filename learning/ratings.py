@@ -0,0 +1,109 @@
+"""
+Running rating totals of courses.
+
+Every review create, update and delete moves the count, total and star
+histogram of its course with one UPDATE of F() expressions, which also
+recomputes the stored average. Concurrent reviews never read-modify-write,
+and the catalog sorts by the indexed rating column without an AVG().
+reconcile_ratings recomputes everything from the reviews to catch drift.
+"""
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+from .models import Course, CourseReview
+
+STARS = range(1, 6)
+TOTAL_FIELDS = Course.RATING_FIELDS[1:]
+
+
+def average(total, count):
+    """
+    Average of two integer expressions as the one decimal rating, NULL without reviews
+    """
+    return Cast(
+        Cast(total, DecimalField(max_digits=14, decimal_places=4)) / NullIf(count, Value(0)),
+        DecimalField(max_digits=2, decimal_places=1)
+    )
+
+
+def apply_rating_change(course_id, old=None, new=None):
+    """
+    Move the totals of a course from a review rating ``old`` to ``new``,
+    None for a created or deleted review
+    """
+    if old == new:
+        return
+    count = (new is not None) - (old is not None)
+    total = (new or 0) - (old or 0)
+    changes = {
+        'rating_count': F('rating_count') + count,
+        'rating_total': F('rating_total') + total,
+        'rating': average(F('rating_total') + total, F('rating_count') + count),
+    }
+    if old is not None:
+        changes[f'rating_{old}_count'] = F(f'rating_{old}_count') - 1
+    if new is not None:
+        changes[f'rating_{new}_count'] = F(f'rating_{new}_count') + 1
+    Course.objects.filter(pk=course_id).update(**changes)
+
+
+def _review_aggregate(expression):
+    return Coalesce(Subquery(
+        CourseReview.objects.filter(course_id=OuterRef('pk')).order_by().values('course_id').annotate(
+            value=expression
+        ).values('value'), output_field=IntegerField()
+    ), Value(0))
+
+
+def recomputed_totals():
+    """
+    {field: expression} of every rating field recomputed from the reviews
+    """
+    totals = {
+        'rating_count': _review_aggregate(Count('id')),
+        'rating_total': _review_aggregate(Sum('rating')),
+    }
+    for stars in STARS:
+        totals[f'rating_{stars}_count'] = _review_aggregate(Count('id', filter=Q(rating=stars)))
+    return totals
+
+
+def find_drift(courses=None):
+    """
+    Courses whose stored totals differ from their reviews, as
+    {course id: {field: (stored, actual)}}
+    """
+    courses = Course.objects.all() if courses is None else courses
+    totals = recomputed_totals()
+    rows = courses.annotate(**{f'actual_{field}': expression for field, expression in totals.items()}).values(
+        'id', 'rating', *TOTAL_FIELDS, *[f'actual_{field}' for field in totals])
+
+    drift = {}
+    for row in rows.iterator():
+        fields = {
+            field: (row[field], row[f'actual_{field}'])
+            for field in TOTAL_FIELDS if row[field] != row[f'actual_{field}']
+        }
+        actual = row['actual_rating_total'] / row['actual_rating_count'] if row['actual_rating_count'] else None
+        stored = float(row['rating']) if row['rating'] is not None else None
+        if (actual is None) != (stored is None) or actual is not None and abs(actual - stored) > 0.05:
+            fields['rating'] = (row['rating'], None if actual is None else round(actual, 1))
+        if fields:
+            drift[row['id']] = fields
+    return drift
+
+
+def recompute_ratings(course_ids=None):
+    """
+    Rewrite the totals and rating of the given courses, every course for
+    None, from their reviews in one UPDATE. The courses are locked first,
+    so reviews being written wait and the UPDATE sees every committed one.
+    """
+    courses = Course.objects.all()
+    if course_ids is not None:
+        courses = courses.filter(pk__in=course_ids)
+    totals = recomputed_totals()
+    with transaction.atomic():
+        list(courses.select_for_update().values_list('pk'))
+        return courses.update(**totals, rating=average(totals['rating_total'], totals['rating_count']))
@@ -0,0 +1,215 @@
+import re
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db.models import Case, F, IntegerField, OuterRef, Q, Subquery, TextField, Value, When, Window
+from django.db.models.functions import Coalesce, Concat, Length, RowNumber
+
+from .learning_constants import LearningConstants
+from .models import Course, Chapter, Lesson, Editor, BaseQuestion, Slide, SearchDocument
+
+SEARCH_CONFIG = getattr(settings, 'SEARCH_CONFIG', 'simple')
+# A trigram index finds nothing to look up in a shorter prefix
+AUTOCOMPLETE_MIN_LENGTH = getattr(settings, 'AUTOCOMPLETE_MIN_LENGTH', 3)
+# Matches sorted per lookup, so common prefixes don't sort every title
+AUTOCOMPLETE_CANDIDATES = getattr(settings, 'AUTOCOMPLETE_CANDIDATES', 200)
+
+
+def _aggregate(through, field):
+    """
+    Space separated values of ``field`` over the rows of an M2M through
+    table that belong to the outer course
+    """
+    return Coalesce(Subquery(
+        through.objects.filter(course_id=OuterRef('pk')).values('course_id').annotate(
+            text=StringAgg(field, ' ', output_field=TextField())
+        ).values('text')
+    ), Value(''), output_field=TextField())
+
+
+def course_search_vector():
+    """
+    Title weighs most, then category titles and author names, then the description
+    """
+    category_titles = _aggregate(Course.categories.through, 'category__title')
+    author_names = _aggregate(Course.authors.through, Concat(
+        'author__user__firstname', Value(' '), 'author__user__lastname'))
+    return (
+        SearchVector('title', weight='A', config=SEARCH_CONFIG) +
+        SearchVector(category_titles, weight='B', config=SEARCH_CONFIG) +
+        SearchVector(author_names, weight='B', config=SEARCH_CONFIG) +
+        SearchVector('description', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def update_course_search_vectors(course_ids=None):
+    """
+    Recompute the stored search vector of the given courses, a list of ids or
+    an id subquery, in a single UPDATE. Every course when ``course_ids`` is None.
+    """
+    courses = Course.objects.all()
+    if course_ids is not None:
+        courses = courses.filter(id__in=course_ids)
+    return courses.update(search_vector=course_search_vector())
+
+
+def _first_slide(lookup, field):
+    return Subquery(Slide.objects.filter(lookup, is_active=True).order_by('id').values(field)[:1])
+
+
+def _lesson_documents(ids):
+    return Lesson.objects.filter(id__in=ids, is_active=True).values(
+        'id', doc_title=F('title'), doc_body=F('description'),
+        doc_lesson=F('id'), doc_course=F('chapter__course_id'))
+
+
+def _slide_documents(ids):
+    return Slide.objects.filter(id__in=ids, is_active=True).values(
+        'id', doc_title=Coalesce('title', Value(''), output_field=TextField()),
+        doc_body=Concat(
+            Coalesce('content', Value(''), output_field=TextField()), Value(' '),
+            Coalesce('hints', Value(''), output_field=TextField()), output_field=TextField()),
+        doc_lesson=F('lesson_id'), doc_course=F('lesson__chapter__course_id'))
+
+
+def _question_documents(ids):
+    # A question reached through several slides is filed under the first
+    # active one, without one it isn't indexed
+    lookup = Q(question_id=OuterRef('pk'))
+    return BaseQuestion.objects.filter(id__in=ids).values(
+        'id', doc_title=F('title'), doc_body=Coalesce('question_body', Value(''), output_field=TextField()),
+        doc_lesson=_first_slide(lookup, 'lesson_id'),
+        doc_course=_first_slide(lookup, 'lesson__chapter__course_id'))
+
+
+def _editor_documents(ids):
+    lookup = Q(editor_id=OuterRef('pk')) | Q(question__editor_id=OuterRef('pk'))
+    return Editor.objects.filter(id__in=ids).values(
+        'id', doc_title=Value(''), doc_body=F('initial_code'),
+        doc_lesson=_first_slide(lookup, 'lesson_id'),
+        doc_course=_first_slide(lookup, 'lesson__chapter__course_id'))
+
+
+DOCUMENT_SOURCES = {
+    Lesson: (LearningConstants.SEARCH_LESSON, _lesson_documents),
+    Slide: (LearningConstants.SEARCH_SLIDE, _slide_documents),
+    BaseQuestion: (LearningConstants.SEARCH_QUESTION, _question_documents),
+    Editor: (LearningConstants.SEARCH_EDITOR, _editor_documents),
+}
+
+
+def index_documents(model, ids):
+    """
+    Upsert the search documents of the given rows of a lesson, slide,
+    question or editor model: one query to read, one to write, one for the
+    vectors. Inactive lessons and slides, and questions and editors not on
+    an active slide, lose their documents instead.
+    """
+    entity_type, source = DOCUMENT_SOURCES[model]
+    ids = list(ids)
+    documents = [
+        SearchDocument(
+            entity_type=entity_type, object_id=row['id'],
+            title=(row['doc_title'] or '')[:255], body=row['doc_body'] or '',
+            lesson_id=row['doc_lesson'], course_id=row['doc_course']
+        )
+        for row in source(ids)
+        if row['doc_lesson'] is not None
+    ]
+    SearchDocument.objects.filter(entity_type=entity_type, object_id__in=ids).exclude(
+        object_id__in=[d.object_id for d in documents]).delete()
+    if not documents:
+        return 0
+    SearchDocument.objects.bulk_create(
+        documents, update_conflicts=True,
+        unique_fields=['entity_type', 'object_id'],
+        update_fields=['title', 'body', 'lesson', 'course', 'updated_at']
+    )
+    return SearchDocument.objects.filter(
+        entity_type=entity_type, object_id__in=[d.object_id for d in documents]
+    ).update(search_vector=(
+        SearchVector('title', weight='A', config=SEARCH_CONFIG) +
+        SearchVector('body', weight='B', config=SEARCH_CONFIG)
+    ))
+
+
+def index_subtree(model, ids):
+    """
+    Reindex everything below the given chapters or lessons, whose documents
+    point at the course and lesson they were reached through
+    """
+    if model is Chapter:
+        index_documents(Lesson, Lesson.objects.filter(chapter_id__in=ids).values_list('id', flat=True))
+        slides = Slide.objects.filter(lesson__chapter_id__in=ids)
+    else:
+        slides = Slide.objects.filter(lesson_id__in=ids)
+    rows = list(slides.values_list('id', 'question_id', 'editor_id', 'question__editor_id'))
+    index_documents(Slide, [row[0] for row in rows])
+    index_documents(BaseQuestion, {row[1] for row in rows if row[1]})
+    index_documents(Editor, {editor_id for row in rows for editor_id in row[2:] if editor_id})
+
+
+def remove_documents(model, ids):
+    entity_type, _ = DOCUMENT_SOURCES[model]
+    SearchDocument.objects.filter(entity_type=entity_type, object_id__in=ids).delete()
+
+
+def search_documents(query, limit=10, entity_types=None):
+    """
+    Top ``limit`` documents per entity type with their lesson and course,
+    ranked and cut per type by a window function in a single query. Only
+    documents of active lessons in active chapters of published, active
+    courses are found, hiding a parent doesn't touch the documents below it.
+    """
+    query = SearchQuery(query, search_type='websearch', config=SEARCH_CONFIG)
+    documents = SearchDocument.objects.filter(
+        search_vector=query, lesson__is_active=True, lesson__chapter__is_active=True,
+        course__is_published=True, course__is_active=True)
+    if entity_types:
+        documents = documents.filter(entity_type__in=entity_types)
+    return documents.annotate(
+        rank=SearchRank(F('search_vector'), query),
+        position=Window(RowNumber(), partition_by=F('entity_type'),
+                        order_by=SearchRank(F('search_vector'), query).desc()),
+    ).filter(position__lte=limit).select_related('lesson', 'course').only(
+        'entity_type', 'object_id', 'title', 'body',
+        'lesson__id', 'lesson__title', 'lesson__chapter_id',
+        'course__id', 'course__slug', 'course__title'
+    ).order_by('entity_type', 'position')
+
+
+def _prefix_matches(queryset, prefix, limit):
+    """
+    Titles with a word starting with ``prefix``, served by the trigram index.
+    Titles starting with the prefix come first, then the shorter ones. Up to
+    AUTOCOMPLETE_CANDIDATES titles starting with the prefix and as many with
+    any word starting with it are sorted.
+    """
+    pattern = re.escape(prefix)
+    starts = queryset.filter(title__iregex='^' + pattern).values('pk')[:AUTOCOMPLETE_CANDIDATES]
+    words = queryset.filter(title__iregex=r'\m' + pattern).values('pk')[:AUTOCOMPLETE_CANDIDATES]
+    return queryset.model.objects.filter(
+        Q(pk__in=starts) | Q(pk__in=words)
+    ).annotate(
+        starts=Case(When(title__istartswith=prefix, then=0), default=1, output_field=IntegerField())
+    ).order_by('starts', Length('title'), 'title')[:limit]
+
+
+def autocomplete(prefix, limit=10):
+    """
+    Top ``limit`` published courses and active lessons for a title prefix
+    """
+    prefix = prefix.strip()
+    if len(prefix) < AUTOCOMPLETE_MIN_LENGTH:
+        return {'courses': [], 'lessons': []}
+
+    courses = Course.objects.filter(is_published=True, is_active=True)
+    lessons = Lesson.objects.filter(
+        is_active=True, chapter__is_active=True,
+        chapter__course__is_published=True, chapter__course__is_active=True)
+    return {
+        'courses': list(_prefix_matches(courses, prefix, limit).values('id', 'slug', 'title')),
+        'lessons': list(_prefix_matches(lessons, prefix, limit).values(
+            'id', 'title', 'chapter_id', course_slug=F('chapter__course__slug'))),
+    }
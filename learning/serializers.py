@@ -4,7 +4,7 @@ from rest_framework import serializers
 from users.models import Author
 from .models import (
     Category, Course, Chapter, Lesson, Editor,
-    BaseQuestion, Choice, Slide
+    BaseQuestion, Choice, Slide, SearchDocument, CourseReview
 )
 
 
@@ -24,14 +24,38 @@ class EditorSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'updated_at']
 
 
-class ChoiceSerializer(serializers.ModelSerializer):
+class LearnerModeMixin:
+    """
+    Drops answer keys from the output when the serializer context
+    has ``learner`` set, or a callable that returns True for the instance.
+    """
+    answer_fields = ()
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        learner = self.context.get('learner')
+        if callable(learner):
+            learner = learner(instance)
+        if learner:
+            for field in self.answer_fields:
+                data.pop(field, None)
+        return data
+
+
+class ChoiceSerializer(LearnerModeMixin, serializers.ModelSerializer):
+    answer_fields = ('is_correct',)
+
+    after = serializers.IntegerField(
+        write_only=True, required=False, allow_null=True,
+        help_text='Place right after this sibling, first for null, last when left out')
+
     class Meta:
         model = Choice
         fields = [
             'id', 'question', 'text', 'alt_text', 'image',
-            'order', 'hidden', 'type', 'is_correct'
+            'order', 'hidden', 'type', 'is_correct', 'after'
         ]
-        read_only_fields = ['created_at', 'updated_at']
+        read_only_fields = ['order', 'created_at', 'updated_at']
 
     def validate(self, data):
         if data.get('type') == 2 and not data.get('image'):
@@ -45,7 +69,9 @@ class ChoiceSerializer(serializers.ModelSerializer):
         return data
 
 
-class BaseQuestionSerializer(serializers.ModelSerializer):
+class BaseQuestionSerializer(LearnerModeMixin, serializers.ModelSerializer):
+    answer_fields = ('correct_choices', 'answer_description')
+
     choices = ChoiceSerializer(many=True, read_only=True)
     correct_choices = serializers.SerializerMethodField()
 
@@ -61,8 +87,9 @@ class BaseQuestionSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def get_correct_choices(obj):
+        # Filter in Python so prefetched choices are reused
         return ChoiceSerializer(
-            obj.choices.filter(is_correct=True),
+            [choice for choice in obj.choices.all() if choice.is_correct],
             many=True
         ).data
 
@@ -84,15 +111,19 @@ class BaseQuestionSerializer(serializers.ModelSerializer):
 
 
 class SlideSerializer(serializers.ModelSerializer):
+    after = serializers.IntegerField(
+        write_only=True, required=False, allow_null=True,
+        help_text='Place right after this sibling, first for null, last when left out')
+
     class Meta:
         model = Slide
         fields = [
             'id', 'lesson', 'title', 'content', 'total_marks',
             'type', 'time_limit', 'is_active', 'is_required',
             'hints', 'alt_text', 'image', 'video_url',
-            'question', 'editor', 'order', 'created_at', 'updated_at'
+            'question', 'editor', 'order', 'created_at', 'updated_at', 'after'
         ]
-        read_only_fields = ['created_at', 'updated_at']
+        read_only_fields = ['order', 'created_at', 'updated_at']
 
     def validate(self, data):
         if data.get('type') == 2:
@@ -104,25 +135,33 @@ class SlideSerializer(serializers.ModelSerializer):
 
 
 class LessonSerializer(serializers.ModelSerializer):
+    after = serializers.IntegerField(
+        write_only=True, required=False, allow_null=True,
+        help_text='Place right after this sibling, first for null, last when left out')
+
     class Meta:
         model = Lesson
         fields = [
             'id', 'chapter', 'title', 'description', 'order',
             'duration', 'is_required', 'is_active', 'score',
-            'lesson_type', 'created_at', 'updated_at'
+            'lesson_type', 'created_at', 'updated_at', 'after'
         ]
-        read_only_fields = ['created_at', 'updated_at']
+        read_only_fields = ['order', 'created_at', 'updated_at']
 
 
 class ChapterSerializer(serializers.ModelSerializer):
+    after = serializers.IntegerField(
+        write_only=True, required=False, allow_null=True,
+        help_text='Place right after this sibling, first for null, last when left out')
+
     class Meta:
         model = Chapter
         fields = [
             'id', 'course', 'title', 'description', 'order',
             'image', 'estimated_time', 'is_active',
-            'created_at', 'updated_at'
+            'created_at', 'updated_at', 'after'
         ]
-        read_only_fields = ['created_at', 'updated_at']
+        read_only_fields = ['order', 'created_at', 'updated_at']
 
 
 class CourseSerializer(serializers.ModelSerializer):
@@ -141,6 +180,7 @@ class CourseSerializer(serializers.ModelSerializer):
         queryset=Course.objects.all(),
         required=False
     )
+    rating_distribution = serializers.DictField(child=serializers.IntegerField(), read_only=True)
 
     class Meta:
         model = Course
@@ -149,11 +189,11 @@ class CourseSerializer(serializers.ModelSerializer):
             'categories', 'duration', 'level', 'price',
             'start_date', 'end_date', 'is_published',
             'is_active', 'logo', 'video_url', 'requirements',
-            'language', 'rating',
+            'language', 'rating', 'rating_count', 'rating_distribution',
             'created_at', 'updated_at'
         ]
         read_only_fields = [
-            'created_at', 'updated_at', 'rating', 'slug'
+            'created_at', 'updated_at', 'rating', 'rating_count', 'slug'
         ]
 
     def validate(self, data):
@@ -191,3 +231,137 @@ class CourseSerializer(serializers.ModelSerializer):
         course.requirements.set(requirements)
 
         return course
+
+
+class CourseSearchSerializer(CourseSerializer):
+    rank = serializers.FloatField(read_only=True)
+    title_headline = serializers.CharField(read_only=True)
+    description_headline = serializers.CharField(read_only=True)
+
+    class Meta(CourseSerializer.Meta):
+        fields = CourseSerializer.Meta.fields + [
+            'rank', 'title_headline', 'description_headline'
+        ]
+
+
+class CourseReviewSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CourseReview
+        fields = ['id', 'course', 'user', 'rating', 'comment', 'created_at', 'updated_at']
+        read_only_fields = ['course', 'user', 'created_at', 'updated_at']
+
+
+class OutlineSlideSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Slide
+        fields = ['id', 'title', 'order', 'type', 'time_limit']
+
+
+class OutlineLessonSerializer(serializers.ModelSerializer):
+    slides = OutlineSlideSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Lesson
+        fields = [
+            'id', 'title', 'order', 'duration',
+            'is_required', 'lesson_type', 'slides'
+        ]
+
+
+class OutlineChapterSerializer(serializers.ModelSerializer):
+    lessons = OutlineLessonSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Chapter
+        fields = ['id', 'title', 'order', 'estimated_time', 'lessons']
+
+
+class BundleChoiceSerializer(LearnerModeMixin, serializers.ModelSerializer):
+    answer_fields = ('is_correct',)
+
+    class Meta:
+        model = Choice
+        fields = [
+            'id', 'text', 'alt_text', 'image',
+            'order', 'hidden', 'type', 'is_correct'
+        ]
+
+
+class BundleQuestionSerializer(LearnerModeMixin, serializers.ModelSerializer):
+    answer_fields = ('correct_choices', 'answer_description')
+
+    choices = BundleChoiceSerializer(many=True, read_only=True)
+    correct_choices = serializers.SerializerMethodField()
+    editor = EditorSerializer(read_only=True)
+
+    class Meta:
+        model = BaseQuestion
+        fields = [
+            'id', 'title', 'question_body', 'question_type',
+            'image', 'video_url', 'answer_description',
+            'editor', 'is_text_input', 'choices', 'correct_choices'
+        ]
+
+    @staticmethod
+    def get_correct_choices(obj):
+        return [choice.id for choice in obj.choices.all() if choice.is_correct]
+
+
+class BundleSlideSerializer(serializers.ModelSerializer):
+    question = BundleQuestionSerializer(read_only=True)
+    editor = EditorSerializer(read_only=True)
+
+    class Meta:
+        model = Slide
+        fields = [
+            'id', 'title', 'content', 'total_marks',
+            'type', 'time_limit', 'is_required',
+            'hints', 'alt_text', 'image', 'video_url',
+            'question', 'editor', 'order'
+        ]
+
+
+class SearchDocumentSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(source='object_id')
+    excerpt = serializers.SerializerMethodField()
+    rank = serializers.FloatField()
+    course = serializers.SerializerMethodField()
+    lesson = serializers.SerializerMethodField()
+
+    class Meta:
+        model = SearchDocument
+        fields = ['id', 'title', 'excerpt', 'rank', 'course', 'lesson']
+
+    @staticmethod
+    def get_excerpt(obj):
+        return obj.body[:200]
+
+    @staticmethod
+    def get_course(obj):
+        if obj.course_id:
+            return {'id': obj.course.id, 'slug': obj.course.slug, 'title': obj.course.title}
+
+    @staticmethod
+    def get_lesson(obj):
+        if obj.lesson_id:
+            return {'id': obj.lesson.id, 'title': obj.lesson.title, 'chapter': obj.lesson.chapter_id}
+
+
+class ReorderItemSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    order = serializers.IntegerField(min_value=1)
+
+
+class ReorderSerializer(serializers.Serializer):
+    """
+    New positions of every active child of a parent, 1 to n, each used once
+    """
+    orders = ReorderItemSerializer(many=True, allow_empty=False)
+
+    def validate_orders(self, value):
+        ids = [item['id'] for item in value]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError('Each child can be listed only once.')
+        if sorted(item['order'] for item in value) != list(range(1, len(value) + 1)):
+            raise serializers.ValidationError('Orders must be the positions 1 to n, each used once.')
+        return {item['id']: item['order'] for item in value}
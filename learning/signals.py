@@ -0,0 +1,195 @@
+from django.db import connections, transaction
+from django.db.models import QuerySet
+from django.db.models.signals import (
+    post_save, pre_delete, post_delete, m2m_changed, pre_migrate
+)
+from django.dispatch import receiver
+
+from users.models import User, Author
+from .caching import get_course_ids, get_moved_from_course_ids, invalidate_course_tree
+from .models import (
+    Category, Course, Chapter, Lesson,
+    Editor, BaseQuestion, Choice, Slide, CourseReview
+)
+from .grading import invalidate_answer_keys
+from .progress import refresh_layouts
+from .ratings import apply_rating_change
+from .search import update_course_search_vectors, index_documents, index_subtree, remove_documents
+
+
+def origin_model(origin):
+    return origin.model if isinstance(origin, QuerySet) else type(origin)
+
+
+def is_cascade(sender, origin):
+    """
+    Whether a ``sender`` row is deleted along with a row of another model,
+    whose own receivers cover the content below it
+    """
+    return origin is not None and origin_model(origin) is not sender
+
+
+def invalidate_on_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        # A moved chapter, lesson or slide leaves its old course's tree too
+        invalidate_course_tree(*get_course_ids(instance), *get_moved_from_course_ids(instance))
+
+
+def invalidate_on_delete(sender, instance, origin=None, **kwargs):
+    # pre_delete, so the parents are still there to resolve the course
+    if is_cascade(sender, origin):
+        return
+    invalidate_course_tree(*get_course_ids(instance))
+
+
+for model in [Category, Course, Chapter, Lesson, Editor, BaseQuestion, Choice, Slide]:
+    post_save.connect(invalidate_on_save, sender=model)
+    pre_delete.connect(invalidate_on_delete, sender=model)
+
+
+@receiver(m2m_changed, sender=Course.categories.through)
+def invalidate_on_categories_change(sender, instance, action, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if isinstance(instance, Course):
+        invalidate_course_tree(instance.id)
+    elif pk_set:
+        invalidate_course_tree(*pk_set)
+
+
+@receiver(post_save, sender=Course)
+def index_course(sender, instance, raw=False, **kwargs):
+    if not raw:
+        update_course_search_vectors([instance.id])
+
+
+@receiver(m2m_changed, sender=Course.categories.through)
+@receiver(m2m_changed, sender=Course.authors.through)
+def index_course_relations(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            update_course_search_vectors([instance.id])
+    elif action == 'pre_clear':
+        # pk_set is empty on clear, remember the courses before they are detached
+        instance._cleared_course_ids = list(instance.courses.values_list('id', flat=True))
+    elif action == 'post_clear':
+        update_course_search_vectors(instance.__dict__.pop('_cleared_course_ids', []))
+    elif action.startswith('post_') and pk_set:
+        update_course_search_vectors(pk_set)
+
+
+@receiver(post_save, sender=Category)
+def index_category_courses(sender, instance, raw=False, **kwargs):
+    if not raw:
+        update_course_search_vectors(Course.objects.filter(categories=instance).values('id'))
+
+
+@receiver(post_save, sender=User)
+def index_author_courses(sender, instance, raw=False, update_fields=None, **kwargs):
+    if update_fields and not {'firstname', 'lastname'} & set(update_fields):
+        return
+    if not raw:
+        update_course_search_vectors(Course.objects.filter(authors__user=instance).values('id'))
+
+
+@receiver(pre_delete, sender=Category)
+@receiver(pre_delete, sender=Author)
+def index_courses_after_delete(sender, instance, **kwargs):
+    # Cascades skip m2m_changed, reindex once the through rows are gone
+    course_ids = list(instance.courses.values_list('id', flat=True))
+    if course_ids:
+        transaction.on_commit(lambda: update_course_search_vectors(course_ids))
+
+
+@receiver(post_save, sender=Lesson)
+@receiver(post_save, sender=BaseQuestion)
+@receiver(post_save, sender=Editor)
+def index_document(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_documents(sender, [instance.id])
+
+
+@receiver(post_save, sender=Chapter)
+@receiver(post_save, sender=Lesson)
+def index_moved_subtree(sender, instance, raw=False, **kwargs):
+    # The documents below still point at the course of the old parent
+    if not raw and instance.moved_from() is not None:
+        index_subtree(sender, [instance.id])
+
+
+@receiver(post_save, sender=Slide)
+def index_slide_documents(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    index_documents(Slide, [instance.id])
+    # The question and editor are filed under the slide's lesson
+    if instance.question_id:
+        index_documents(BaseQuestion, [instance.question_id])
+    if instance.editor_id:
+        index_documents(Editor, [instance.editor_id])
+
+
+@receiver(post_delete, sender=Lesson)
+@receiver(post_delete, sender=Slide)
+@receiver(post_delete, sender=BaseQuestion)
+@receiver(post_delete, sender=Editor)
+def remove_document(sender, instance, origin=None, **kwargs):
+    # The documents below a deleted course or lesson go with it
+    if is_cascade(sender, origin) and origin_model(origin) in (Course, Chapter, Lesson):
+        return
+    remove_documents(sender, [instance.id])
+
+
+@receiver(post_save, sender=BaseQuestion)
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=BaseQuestion)
+@receiver(post_delete, sender=Choice)
+def invalidate_question_answer_keys(sender, instance, raw=False, origin=None, **kwargs):
+    # The question of cascading choices invalidates once for all of them
+    if not raw and not (sender is Choice and is_cascade(sender, origin)):
+        invalidate_answer_keys()
+
+
+@receiver(post_save, sender=Chapter)
+@receiver(post_save, sender=Lesson)
+@receiver(post_save, sender=Slide)
+def refresh_layout_on_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_layouts(*get_course_ids(instance), *get_moved_from_course_ids(instance))
+
+
+@receiver(pre_delete, sender=Chapter)
+@receiver(pre_delete, sender=Lesson)
+@receiver(pre_delete, sender=Slide)
+def refresh_layout_on_delete(sender, instance, origin=None, **kwargs):
+    # pre_delete, so the parents are still there to resolve the course. A
+    # deleted course takes its layout along.
+    if is_cascade(sender, origin):
+        return
+    refresh_layouts(*get_course_ids(instance))
+
+
+@receiver(post_save, sender=CourseReview)
+def add_review_rating(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    apply_rating_change(instance.course_id, None if created else instance.stored_rating, instance.rating)
+    instance.stored_rating = instance.rating
+
+
+@receiver(post_delete, sender=CourseReview)
+def remove_review_rating(sender, instance, origin=None, **kwargs):
+    # Reviews cascading from a deleted course have no totals left to move
+    if origin is not None and origin_model(origin) is Course:
+        return
+    apply_rating_change(instance.course_id, instance.stored_rating, None)
+    instance.stored_rating = None
+
+
+@receiver(pre_migrate)
+def create_extensions(sender, using, **kwargs):
+    # Trigram indexes need pg_trgm before any table that declares one is created
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
@@ -1,3 +1,938 @@
-from django.test import TestCase
+from io import StringIO
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from Hallino.planning import plan_queryset
+from Hallino.testing import QueryBudgetTestMixin
+from users.models import User, Author, UserResponse
+from .models import (
+    Category, Course, Chapter, Lesson, Editor,
+    BaseQuestion, Choice, Slide, SlideCounter, CourseReview, SearchDocument
+)
+from . import counters, grading
+from .learning_constants import LearningConstants
+from .ordering import ORDER_GAP
+from .pagination import KeysetPagination
+from .permissions import Authorship
+from .serializers import CourseSerializer, OutlineChapterSerializer, SlideSerializer
+
+
+def create_course(title='Python Basics', chapters=2, lessons=2, slides=2):
+    course = Course.objects.create(
+        title=title, description='description', duration=60,
+        price=0, is_published=True, is_active=True
+    )
+    Chapter.objects.bulk_create([
+        Chapter(course=course, title=f'Chapter {i}', description='description',
+                order=i, estimated_time=10)
+        for i in range(1, chapters + 1)
+    ])
+    Lesson.objects.bulk_create([
+        Lesson(chapter=chapter, title=f'Lesson {i}', description='description',
+               order=i, duration=5, score=10, lesson_type=1)
+        for chapter in course.chapters.all()
+        for i in range(1, lessons + 1)
+    ])
+    Slide.objects.bulk_create([
+        Slide(lesson=lesson, title=f'Slide {i}', content='content', type=1, order=i)
+        for lesson in Lesson.objects.filter(chapter__course=course)
+        for i in range(1, slides + 1)
+    ])
+    return course
+
+
+def create_staff(email='staff@example.com'):
+    staff = User.objects.create_user(
+        email=email, firstname='Staff', lastname='Member',
+        phone_number='+989120000000', password='password')
+    staff.is_staff = True
+    staff.save()
+    return staff
+
+
+def create_question(slide, choices=3):
+    editor = Editor.objects.create(initial_code='print()')
+    question = BaseQuestion.objects.create(
+        title=f'Question {slide.order}', question_type=1, editor=editor)
+    Choice.objects.bulk_create([
+        Choice(question=question, text=f'Choice {i}', order=i,
+               type=1, is_correct=i == 1)
+        for i in range(1, choices + 1)
+    ])
+    slide.type = 2
+    slide.question = question
+    slide.editor = editor
+    slide.save()
+    return question
+
+
+@override_settings(SHARED_CACHE=True)
+class CourseOutlineTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_outline_nests_active_content_in_order(self):
+        course = create_course()
+        Lesson.objects.filter(chapter__course=course, order=2).update(is_active=False)
+
+        response = self.client.get(
+            reverse('learning:course-outline', kwargs={'slug': course.slug}))
+
+        self.assertEqual(response.status_code, 200)
+        chapters = response.data['chapters']
+        self.assertEqual([c['order'] for c in chapters], [1, 2])
+        self.assertEqual(len(chapters[0]['lessons']), 1)
+        self.assertEqual(
+            [s['order'] for s in chapters[0]['lessons'][0]['slides']], [1, 2])
+
+    def test_outline_query_count_is_constant(self):
+        course = create_course(chapters=20, lessons=10, slides=10)
+        url = reverse('learning:course-outline', kwargs={'slug': course.slug})
+
+        # course, chapters, lessons, slides
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['chapters']), 20)
+
+        # course only, the tree comes from the cache
+        with self.assertNumQueries(1):
+            self.client.get(url)
+
+    @override_settings(SHARED_CACHE=False)
+    def test_trees_are_not_cached_per_process(self):
+        course = create_course()
+        url = reverse('learning:course-outline', kwargs={'slug': course.slug})
+        self.client.get(url)
+        with self.assertNumQueries(4):
+            self.client.get(url)
+
+    def test_outline_is_invalidated_by_content_changes(self):
+        course = create_course()
+        url = reverse('learning:course-outline', kwargs={'slug': course.slug})
+        self.client.get(url)
+
+        slide = Slide.objects.filter(lesson__chapter__course=course).first()
+        slide.title = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            slide.save()
+
+        response = self.client.get(url)
+        titles = [
+            s['title']
+            for c in response.data['chapters']
+            for lesson in c['lessons']
+            for s in lesson['slides']
+        ]
+        self.assertIn('Renamed', titles)
+
+    def test_moves_invalidate_both_courses(self):
+        source, target = create_course(), create_course(title='Target', chapters=1)
+        urls = [reverse('learning:course-outline', kwargs={'slug': course.slug}) for course in (source, target)]
+        for url in urls:
+            self.client.get(url)
+
+        lesson = Lesson.objects.filter(chapter__course=source).first()
+        lesson.chapter = target.chapters.get()
+        lesson.order = 100
+        with self.captureOnCommitCallbacks(execute=True):
+            lesson.save()
+
+        lesson_ids = [
+            [lesson['id'] for chapter in self.client.get(url).data['chapters'] for lesson in chapter['lessons']]
+            for url in urls
+        ]
+        self.assertNotIn(lesson.id, lesson_ids[0])
+        self.assertIn(lesson.id, lesson_ids[1])
+
+
+class CascadeDeleteTests(APITestCase):
+    def delete_queries(self, instance):
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                instance.delete()
+        return len(queries)
+
+    def test_course_deletes_cost_the_same_at_any_size(self):
+        small, large = create_course(title='Small', slides=1), create_course(title='Large', slides=10)
+        self.assertEqual(self.delete_queries(small), self.delete_queries(large))
+
+    def test_question_deletes_cost_the_same_at_any_size(self):
+        small, large = Slide.objects.filter(lesson__chapter__course=create_course())[:2]
+        small, large = create_question(small, choices=1), create_question(large, choices=10)
+        self.assertEqual(self.delete_queries(small), self.delete_queries(large))
+
+
+class LessonBundleTests(APITestCase):
+    def setUp(self):
+        self.course = create_course(chapters=1, lessons=1, slides=0)
+        self.lesson = Lesson.objects.get(chapter__course=self.course)
+        self.url = reverse('learning:lesson-bundle', kwargs={'pk': self.lesson.pk})
+        for i in range(1, 31):
+            editor = Editor.objects.create(initial_code='print()')
+            question = BaseQuestion.objects.create(
+                title=f'Question {i}', question_type=1, editor=editor)
+            Choice.objects.bulk_create([
+                Choice(question=question, text=f'Choice {j}', order=j,
+                       type=1, is_correct=j == 1)
+                for j in (3, 1, 2)
+            ])
+            Slide.objects.create(
+                lesson=self.lesson, type=2, order=i,
+                question=question, editor=editor)
+
+    def test_bundle_query_count_is_constant(self):
+        # lesson, slides with question and editors, choices
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['slides']), 30)
+
+    def test_bundle_hides_answer_keys_from_learners(self):
+        response = self.client.get(self.url)
+
+        question = response.data['slides'][0]['question']
+        self.assertTrue(response.data['learner'])
+        self.assertNotIn('correct_choices', question)
+        self.assertEqual([c['order'] for c in question['choices']], [1, 2, 3])
+        self.assertTrue(all('is_correct' not in c for c in question['choices']))
+
+    def test_bundle_leaves_out_hidden_choices(self):
+        Choice.objects.filter(order=2).update(hidden=True)
+        response = self.client.get(self.url)
+        self.assertEqual([c['order'] for c in response.data['slides'][0]['question']['choices']], [1, 3])
+
+    def test_bundle_keeps_answer_keys_for_staff(self):
+        self.client.force_authenticate(create_staff())
+
+        response = self.client.get(self.url)
+
+        question = response.data['slides'][0]['question']
+        self.assertFalse(response.data['learner'])
+        self.assertEqual(len(question['correct_choices']), 1)
+
+    def test_question_and_choice_endpoints_hide_answer_keys_from_learners(self):
+        question = BaseQuestion.objects.order_by('id').first()
+        question_url = reverse('learning:question-detail', kwargs={'pk': question.pk})
+        choices_url = reverse('learning:choice-list')
+
+        data = self.client.get(question_url).data
+        self.assertNotIn('correct_choices', data)
+        self.assertTrue(all('is_correct' not in c for c in data['choices']))
+        self.assertTrue(all('is_correct' not in c for c in self.client.get(choices_url).data['results']))
+
+        author = User.objects.create_user(
+            'author@example.com', 'Author', 'User', '+989121234567', password='password')
+        self.course.authors.add(Author.objects.create(user=author))
+        self.client.force_authenticate(author)
+        self.assertEqual(len(self.client.get(question_url).data['correct_choices']), 1)
+        self.assertTrue(all('is_correct' in c for c in self.client.get(choices_url).data['results']))
+
+
+class AuthorshipTests(APITestCase):
+    def setUp(self):
+        self.course = create_course(chapters=2, lessons=2, slides=1)
+        self.other = create_course(title='Other course', chapters=1, lessons=1, slides=1)
+        self.user = User.objects.create_user(
+            'author@example.com', 'Author', 'User', '+989121234567', password='password')
+        self.course.authors.add(Author.objects.create(user=self.user))
+        self.authorship = Authorship(self.user)
+
+    def test_content_is_resolved_to_its_course(self):
+        slide = Slide.objects.filter(lesson__chapter__course=self.course).first()
+        question = create_question(slide)
+        for obj in [self.course, slide.lesson.chapter, slide.lesson, slide,
+                    question, question.choices.first()]:
+            self.assertTrue(self.authorship.is_author(obj), obj)
+        for obj in [self.other, Lesson.objects.get(chapter__course=self.other)]:
+            self.assertFalse(self.authorship.is_author(obj), obj)
+
+    def test_authored_course_ids_are_loaded_once(self):
+        chapters = list(Chapter.objects.all())
+        with self.assertNumQueries(1):
+            results = [self.authorship.is_author(chapter) for chapter in chapters]
+        self.assertEqual(results, [c.course_id == self.course.id for c in chapters])
+
+    def test_unloaded_parents_cost_one_exists_query(self):
+        lesson = Lesson.objects.filter(chapter__course=self.course).first()
+        with self.assertNumQueries(1):
+            self.assertTrue(self.authorship.is_author(lesson))
+            self.assertTrue(self.authorship.is_author(lesson))
+
+    def test_authored_filters_objects_in_one_query(self):
+        slides = list(Slide.objects.all())
+        with self.assertNumQueries(1):
+            authored = self.authorship.authored(slides)
+        self.assertEqual(
+            {s.id for s in authored},
+            set(Slide.objects.filter(lesson__chapter__course=self.course).values_list('id', flat=True)))
+
+    def test_only_authors_edit_content(self):
+        lesson = Lesson.objects.filter(chapter__course=self.course).first()
+        url = reverse('learning:lesson-detail', kwargs={'pk': lesson.pk})
+        self.client.force_authenticate(create_staff())
+        self.assertEqual(self.client.patch(url, {'title': 'Renamed'}).status_code, 403)
+
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.patch(url, {'title': 'Renamed'}).status_code, 200)
+
+
+class ReorderTests(APITestCase):
+    def setUp(self):
+        self.course = create_course(chapters=1, lessons=2, slides=0)
+        self.lesson, self.other = Lesson.objects.filter(chapter__course=self.course).order_by('order')
+        Slide.objects.bulk_create([
+            Slide(lesson=self.lesson, title=f'Slide {i}', content='content', type=1, order=i)
+            for i in range(1, 501)
+        ])
+        self.slides = list(self.lesson.slides.order_by('order').values_list('id', flat=True))
+        user = create_staff()
+        self.course.authors.add(Author.objects.create(user=user))
+        self.client.force_authenticate(user)
+        self.url = reverse('learning:lesson-reorder-slides', kwargs={'pk': self.lesson.pk})
+
+    def post(self, orders):
+        return self.client.post(self.url, {'orders': [
+            {'id': id, 'order': order} for id, order in orders
+        ]}, format='json')
+
+    def test_reorder_is_a_handful_of_queries(self):
+        reversed_orders = [(id, 500 - i) for i, id in enumerate(self.slides)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(reversed_orders)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(queries), 10)
+        self.assertEqual(
+            list(self.lesson.slides.order_by('order').values_list('id', flat=True)),
+            self.slides[::-1])
+
+    def test_duplicate_and_missing_positions_are_rejected(self):
+        duplicate = [(id, 1) for id in self.slides]
+        gap = [(id, i + 2) for i, id in enumerate(self.slides)]
+        missing = [(id, i + 1) for i, id in enumerate(self.slides[:-1])]
+        for orders in [duplicate, gap, missing]:
+            self.assertEqual(self.post(orders).status_code, 400)
+
+    def test_children_of_other_parents_are_rejected(self):
+        foreign = Slide.objects.create(lesson=self.other, title='Other', content='content', type=1, order=1)
+        orders = [(id, i + 1) for i, id in enumerate(self.slides[:-1] + [foreign.id])]
+        self.assertEqual(self.post(orders).status_code, 400)
+        self.assertEqual(Slide.objects.get(id=foreign.id).order, 1)
+
+    def test_inactive_children_keep_their_place(self):
+        Slide.objects.filter(id=self.slides[1]).update(is_active=False)
+        active = [id for id in self.slides if id != self.slides[1]]
+        self.assertEqual(self.post([(id, len(active) - i) for i, id in enumerate(active)]).status_code, 200)
+        self.assertEqual(
+            list(self.lesson.slides.order_by('order').values_list('id', flat=True)),
+            [active[-1], self.slides[1]] + active[-2::-1])
+
+
+class GappedOrderingTests(APITestCase):
+    def setUp(self):
+        self.course = create_course(chapters=0)
+        user = create_staff()
+        self.course.authors.add(Author.objects.create(user=user))
+        self.client.force_authenticate(user)
+        self.chapters = [self.create(f'Chapter {i}') for i in range(3)]
+
+    def create(self, title, **data):
+        response = self.client.post(reverse('learning:chapter-list'), {
+            'course': self.course.id, 'title': title, 'description': 'description',
+            'estimated_time': 10, **data
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def titles(self):
+        return list(self.course.chapters.order_by('order').values_list('title', flat=True))
+
+    def test_creates_are_spaced_by_the_gap(self):
+        self.assertEqual(
+            list(self.course.chapters.order_by('order').values_list('order', flat=True)),
+            [ORDER_GAP, 2 * ORDER_GAP, 3 * ORDER_GAP])
+
+    def test_insert_and_move_write_one_row(self):
+        before = dict(self.course.chapters.values_list('id', 'order'))
+        inserted = self.create('Inserted', after=self.chapters[0])
+        url = reverse('learning:chapter-detail', kwargs={'pk': self.chapters[2]})
+        self.assertEqual(self.client.patch(url, {'after': None}, format='json').status_code, 200)
+
+        self.assertEqual(self.titles(), ['Chapter 2', 'Chapter 0', 'Inserted', 'Chapter 1'])
+        after = dict(self.course.chapters.values_list('id', 'order'))
+        self.assertEqual(after[inserted], ORDER_GAP * 3 // 2)
+        self.assertEqual({id: after[id] for id in self.chapters[:2]},
+                         {id: before[id] for id in self.chapters[:2]})
+
+    def test_content_only_moves_into_authored_courses(self):
+        other = create_course(title='Other', chapters=0)
+        url = reverse('learning:chapter-detail', kwargs={'pk': self.chapters[0]})
+        self.assertEqual(self.client.patch(url, {'course': other.id}, format='json').status_code, 403)
+        response = self.client.post(reverse('learning:chapter-list'), {
+            'course': other.id, 'title': 'Foreign', 'description': 'description', 'estimated_time': 10
+        }, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(other.chapters.exists())
+
+        other.authors.add(*self.course.authors.all())
+        self.assertEqual(self.client.patch(url, {'course': other.id}, format='json').status_code, 200)
+        self.assertEqual(Chapter.objects.get(id=self.chapters[0]).course_id, other.id)
+
+    def test_exhausted_gaps_rebalance_the_siblings(self):
+        for order, id in enumerate(self.chapters, start=1):
+            Chapter.objects.filter(id=id).update(order=order)
+        self.create('Inserted', after=self.chapters[0])
+
+        self.assertEqual(self.titles(), ['Chapter 0', 'Inserted', 'Chapter 1', 'Chapter 2'])
+        orders = list(self.course.chapters.order_by('order').values_list('order', flat=True))
+        self.assertTrue(all(b - a >= 2 for a, b in zip(orders, orders[1:])))
+
+    def test_rebalance_command_respaces_crowded_parents(self):
+        for order, id in enumerate(self.chapters, start=1):
+            Chapter.objects.filter(id=id).update(order=order)
+        call_command('rebalance_orders', stdout=StringIO())
+
+        self.assertEqual(
+            list(self.course.chapters.order_by('order').values_list('order', flat=True)),
+            [ORDER_GAP, 2 * ORDER_GAP, 3 * ORDER_GAP])
+
+
+class SlideCounterTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        counters.buffer.flush()
+        # Only the explicit flushes of the tests write
+        self.addCleanup(setattr, counters.buffer, 'interval', counters.buffer.interval)
+        counters.buffer.interval = 3600
+        course = create_course(chapters=1, lessons=1, slides=1)
+        self.slide = Slide.objects.get(lesson__chapter__course=course)
+        self.client.force_authenticate(User.objects.create_user(
+            'learner@example.com', 'Learner', 'User', '+989121234567', password='password'))
+
+    def url(self, name):
+        return reverse(f'learning:slide-{name}', kwargs={'pk': self.slide.pk})
+
+    def test_increments_are_buffered_until_flushed(self):
+        # One lookup of the slide, the later increments find it cached
+        with self.assertNumQueries(1):
+            for _ in range(50):
+                self.client.post(self.url('record-activity'), {'kind': 'views'})
+        self.client.force_authenticate(create_staff())
+        self.assertEqual(self.client.post(self.url('increment-comments')).status_code, 202)
+        self.assertFalse(SlideCounter.objects.exists())
+
+        counters.buffer.flush()
+        self.assertEqual(
+            SlideCounter.objects.filter(slide=self.slide).aggregate(total=Sum('value'))['total'], 51)
+        self.assertEqual(self.client.get(self.url('activity')).data, {
+            'comments': 1, 'views': 50, 'attempts': 0, 'completions': 0})
+
+    def test_only_staff_count_comments(self):
+        self.assertEqual(self.client.post(self.url('increment-comments')).status_code, 403)
+
+    def test_inactive_and_out_of_range_slides_are_not_found(self):
+        Slide.objects.filter(pk=self.slide.pk).update(is_active=False)
+        response = self.client.post(self.url('record-activity'), {'kind': 'views'})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post(
+            reverse('learning:slide-record-activity', kwargs={'pk': 1 << 63}), {'kind': 'views'})
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(counters.buffer.pending(self.slide.id, LearningConstants.COUNTER_VIEWS))
+
+    def test_unknown_kinds_and_deleted_slides_are_dropped(self):
+        response = self.client.post(self.url('record-activity'), {'kind': 'likes'})
+        self.assertEqual(response.status_code, 400)
+
+        counters.increment(self.slide.id + 1000, LearningConstants.COUNTER_VIEWS)
+        counters.buffer.flush()
+        self.assertFalse(SlideCounter.objects.exists())
+
+    def test_unwritable_counts_are_dropped_and_the_rest_written(self):
+        counters.increment(1 << 63, LearningConstants.COUNTER_VIEWS)
+        counters.increment(self.slide.id, LearningConstants.COUNTER_VIEWS)
+        counters.buffer.flush()
+        self.assertFalse(counters.buffer.pending(1 << 63, LearningConstants.COUNTER_VIEWS))
+        self.assertEqual(counters.get_counts([self.slide])[self.slide.id]['views'], 1)
+
+
+class CourseRatingTests(APITestCase):
+    def setUp(self):
+        self.course = create_course(chapters=0)
+        self.users = [
+            User.objects.create_user(f'reviewer{i}@example.com', 'Reviewer', 'User',
+                                     f'+98912000000{i}', password='password')
+            for i in range(3)
+        ]
+
+    def review(self, user, rating):
+        self.client.force_authenticate(user)
+        url = reverse('learning:course-reviews-list', kwargs={'course_slug': self.course.slug})
+        return self.client.post(url, {'rating': rating, 'comment': 'comment'}, format='json')
+
+    def test_reviews_move_the_running_totals(self):
+        for user, rating in zip(self.users, [5, 4, 4]):
+            self.assertEqual(self.review(user, rating).status_code, 201)
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.rating_count, self.course.rating_total), (3, 13))
+        self.assertEqual(str(self.course.rating), '4.3')
+        self.assertEqual(self.course.rating_distribution, {1: 0, 2: 0, 3: 0, 4: 2, 5: 1})
+
+        review = CourseReview.objects.get(user=self.users[0])
+        review.rating = 1
+        review.save()
+        CourseReview.objects.get(user=self.users[1]).delete()
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.rating_count, self.course.rating_total), (2, 5))
+        self.assertEqual(str(self.course.rating), '2.5')
+        self.assertEqual(self.course.rating_distribution, {1: 1, 2: 0, 3: 0, 4: 1, 5: 0})
+
+        CourseReview.objects.all().delete()
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.rating_count, self.course.rating), (0, None))
+
+    def test_saves_leave_the_maintained_columns_alone(self):
+        course = Course.objects.defer('search_vector').get(pk=self.course.pk)
+        course.title = 'Renamed'
+        with CaptureQueriesContext(connection) as queries:
+            course.save()
+        statements = [query['sql'] for query in queries if 'search_vector' in query['sql']]
+        # Only the reindex touches the vector, the save neither loads nor writes it
+        self.assertEqual(len(statements), 1)
+        self.assertIn('to_tsvector', statements[0])
+
+    def test_deleted_courses_skip_their_totals(self):
+        for user, rating in zip(self.users, [5, 4, 4]):
+            self.review(user, rating)
+        with CaptureQueriesContext(connection) as queries:
+            self.course.delete()
+        self.assertFalse(any(
+            query['sql'].startswith('UPDATE "learning_course"') for query in queries))
+        self.assertFalse(CourseReview.objects.exists())
+
+    def test_one_review_per_user_and_only_the_reviewer_edits(self):
+        self.assertEqual(self.review(self.users[0], 5).status_code, 201)
+        self.assertEqual(self.review(self.users[0], 3).status_code, 400)
+
+        review = CourseReview.objects.get()
+        url = reverse('learning:course-reviews-detail',
+                      kwargs={'course_slug': self.course.id, 'pk': review.pk})
+        self.client.force_authenticate(self.users[1])
+        self.assertEqual(self.client.patch(url, {'rating': 1}, format='json').status_code, 403)
+        self.client.force_authenticate(self.users[0])
+        self.assertEqual(self.client.patch(url, {'rating': 2}, format='json').status_code, 200)
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.rating_total, self.course.rating_2_count), (2, 1))
+
+    def test_reconcile_reports_and_fixes_drift(self):
+        for user, rating in zip(self.users, [5, 3, 1]):
+            self.review(user, rating)
+        Course.objects.filter(pk=self.course.pk).update(rating_count=7, rating_5_count=0, rating=None)
+
+        out = StringIO()
+        call_command('reconcile_ratings', dry_run=True, stdout=out)
+        self.assertIn('1 courses drifted', out.getvalue())
+        call_command('reconcile_ratings', stdout=StringIO())
+
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.rating_count, self.course.rating_5_count), (3, 1))
+        self.assertEqual(str(self.course.rating), '3.0')
+        out = StringIO()
+        call_command('reconcile_ratings', dry_run=True, stdout=out)
+        self.assertIn('0 courses drifted', out.getvalue())
+
+
+class QueryPlanTests(APITestCase):
+    def setUp(self):
+        self.course = create_course(chapters=3, lessons=3, slides=3)
+
+    def test_nested_serializers_take_one_query_per_level(self):
+        chapters = plan_queryset(self.course.chapters.order_by('order'), OutlineChapterSerializer)
+        with self.assertNumQueries(3):
+            data = OutlineChapterSerializer(chapters, many=True).data
+        self.assertEqual([len(chapter['lessons']) for chapter in data], [3, 3, 3])
+        self.assertEqual(len(data[0]['lessons'][0]['slides']), 3)
+
+    def test_only_the_serialized_columns_are_loaded(self):
+        chapter = plan_queryset(self.course.chapters.all(), OutlineChapterSerializer).first()
+        self.assertIn('description', chapter.get_deferred_fields())
+        self.assertNotIn('estimated_time', chapter.get_deferred_fields())
+
+        # Primary keys of foreign keys come from the key column
+        slide = plan_queryset(Slide.objects.all(), SlideSerializer).first()
+        with self.assertNumQueries(0):
+            self.assertEqual(SlideSerializer(slide).data['lesson'], slide.lesson_id)
+
+    def test_many_to_many_keys_are_prefetched(self):
+        author = Author.objects.create(user=create_staff())
+        for i in range(3):
+            create_course(title=f'Course {i}', chapters=0).authors.add(author)
+        courses = plan_queryset(Course.objects.all(), CourseSerializer)
+        with self.assertNumQueries(4):
+            data = CourseSerializer(courses, many=True).data
+        self.assertEqual(sum(len(course['authors']) for course in data), 3)
+
+
+class GradingTests(APITestCase):
+    def setUp(self):
+        grading.answer_keys.clear()
+        course = create_course(chapters=1, lessons=1, slides=3)
+        slides = list(Slide.objects.filter(lesson__chapter__course=course).order_by('order'))
+        self.single = create_question(slides[0])
+        self.multiple = create_question(slides[1])
+        self.multiple.question_type = 2
+        self.multiple.save()
+        self.multiple.choices.filter(order=2).update(is_correct=True)
+        self.text = create_question(slides[2])
+        self.text.question_type = 3
+        self.text.save()
+        self.text.choices.filter(order=2).update(text='Hello  World', is_correct=True)
+        self.user = User.objects.create_user(
+            'learner@example.com', 'Learner', 'User', '+989121234567', password='password')
+
+    def choice(self, question, order):
+        return question.choices.get(order=order)
+
+    def submit(self, question, choices=(), text_answer=None):
+        self.client.force_authenticate(self.user)
+        response = self.client.post(reverse('users:userresponse-list'), {
+            'question': question.id, 'choice_answers': [choice.id for choice in choices],
+            'text_answer': text_answer,
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['is_correct']
+
+    def test_submissions_are_graded_inline(self):
+        self.assertTrue(self.submit(self.single, [self.choice(self.single, 1)]))
+        self.assertFalse(self.submit(self.single, [self.choice(self.single, 2)]))
+        self.assertTrue(self.submit(self.multiple, [self.choice(self.multiple, 1), self.choice(self.multiple, 2)]))
+        self.assertFalse(self.submit(self.multiple, [self.choice(self.multiple, 1)]))
+        self.assertTrue(self.submit(self.text, text_answer=[' hello world ']))
+        self.assertFalse(self.submit(self.text, text_answer=['goodbye']))
+
+    def test_keys_are_compiled_once_until_a_choice_changes(self):
+        grading.answer_keys.get_many([self.single.id])
+        with self.assertNumQueries(0):
+            grading.answer_keys.get_many([self.single.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.choice(self.single, 1).save()
+        self.assertEqual(grading.answer_keys.get_many([self.single.id])[self.single.id].correct,
+                         {self.choice(self.single, 1).id})
+
+    def test_regrade_follows_changed_keys(self):
+        responses = []
+        for order in (1, 2, 2):
+            responses.append(UserResponse.objects.create(
+                user=self.user, question=self.single, choice_ids=[self.choice(self.single, order).id]))
+
+        call_command('grade_responses', batch_size=2, stdout=StringIO())
+        self.assertEqual([r.is_correct for r in UserResponse.objects.order_by('id')], [True, False, False])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.single.choices.update(is_correct=False)
+            correct = self.choice(self.single, 2)
+            correct.is_correct = True
+            correct.save()
+        call_command('grade_responses', stdout=StringIO())
+        self.assertEqual([r.is_correct for r in UserResponse.objects.order_by('id')], [False, True, True])
+
+
+class LearningQueryBudgetTests(QueryBudgetTestMixin, APITestCase):
+    urlconf = 'learning.urls'
+    namespace = 'learning'
+    query_budgets = {
+        'api-root': 0,
+        'category-list': 1,
+        'category-detail': 1,
+        'course-list': 4,
+        'course-detail': 4,
+        'course-statistics': 3,
+        'course-outline': 4,
+        'category-courses-list': 4,
+        'category-courses-detail': 4,
+        'category-courses-statistics': 3,
+        'category-courses-outline': 4,
+        'chapter-list': 1,
+        'chapter-detail': 1,
+        'course-chapters-list': 1,
+        'course-chapters-detail': 1,
+        'course-reviews-list': 1,
+        'course-reviews-detail': 1,
+        'lesson-list': 1,
+        'lesson-detail': 1,
+        'lesson-bundle': 3,
+        'chapter-lessons-list': 1,
+        'chapter-lessons-detail': 1,
+        'chapter-lessons-bundle': 3,
+        'editor-list': 1,
+        'editor-detail': 1,
+        'slide-editors-list': 1,
+        'slide-editors-detail': 1,
+        'question-list': 2,
+        'question-detail': 2,
+        'slide-questions-list': 2,
+        'slide-questions-detail': 2,
+        'choice-list': 1,
+        'choice-detail': 1,
+        'question-choices-list': 1,
+        'question-choices-detail': 1,
+        'slide-list': 1,
+        'slide-detail': 1,
+        'lesson-slides-list': 1,
+        'lesson-slides-detail': 1,
+        'slide-activity': 2,
+        'lesson-slides-activity': 2,
+        'search-list': 0,
+        'search-autocomplete': 0,
+    }
+
+    def setUp(self):
+        cache.clear()
+        staff = create_staff()
+        author = Author.objects.create(user=staff)
+        category = Category.objects.create(title='Programming', description='description')
+        courses = [create_course(title=f'Course {i}', chapters=3, lessons=3, slides=3)
+                   for i in range(3)]
+        for course in courses:
+            course.authors.add(author)
+            course.categories.add(category)
+            course.requirements.set([c for c in courses if c != course])
+
+        chapter = courses[0].chapters.order_by('order').first()
+        lesson = chapter.lessons.order_by('order').first()
+        slides = list(lesson.slides.order_by('order'))
+        questions = [create_question(slide) for slide in slides]
+
+        self.route_objects = {
+            'category': category,
+            'course': courses[0],
+            'chapter': chapter,
+            'lesson': lesson,
+            'slide': slides[0],
+            'question': questions[0],
+            'editor': slides[0].editor,
+            'choice': questions[0].choices.first(),
+            'review': CourseReview.objects.create(course=courses[0], user=staff, rating=4),
+        }
+        self.client.force_authenticate(staff)
+
+
+class SeedDataTests(APITestCase):
+    def test_seed_data_builds_the_requested_tree(self):
+        call_command(
+            'seed_data', categories=2, authors=2, courses=3, chapters=2, lessons=2,
+            slides=4, choices=3, users=5, responses=20, batch_size=7, stdout=StringIO()
+        )
+
+        self.assertEqual(Course.objects.count(), 3)
+        self.assertEqual(Slide.objects.count(), 3 * 2 * 2 * 4)
+        self.assertEqual(BaseQuestion.objects.count(), 3 * 2 * 2 * 2)
+        self.assertEqual(Choice.objects.count(), 3 * 2 * 2 * 2 * 3)
+        self.assertEqual(Slide.objects.filter(question__isnull=False).count(), 3 * 2 * 2 * 2)
+        self.assertEqual(UserResponse.objects.count(), 20)
+        self.assertEqual(UserResponse.objects.filter(question__isnull=False).count(), 20)
+        # The indexes the signals would have filled are built too
+        self.assertFalse(Course.objects.filter(search_vector__isnull=True).exists())
+        self.assertEqual(SearchDocument.objects.count(), 3 * 2 * 2 + 3 * 2 * 2 * 4 + 2 * 3 * 2 * 2 * 2)
+
+
+class KeysetPaginationTests(APITestCase):
+    def setUp(self):
+        self.courses = [create_course(title=f'Course {i}', chapters=0) for i in range(5)]
+        # Shared timestamps leave the ordering to the id tie breaker
+        Course.objects.filter(id__in=[c.id for c in self.courses[:3]]).update(
+            created_at=self.courses[0].created_at)
+
+    def get(self, url=None, **params):
+        return self.client.get(url or reverse('learning:course-list'), params).data
+
+    def test_next_links_walk_every_row_once_in_order(self):
+        expected = list(Course.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        ids = []
+        page = self.get(page_size=2)
+        while True:
+            ids += [c['id'] for c in page['results']]
+            if not page['next']:
+                break
+            page = self.get(page['next'])
+        self.assertEqual(ids, expected)
+
+    def test_previous_link_returns_the_previous_page(self):
+        first = self.get(page_size=2)
+        second = self.get(first['next'])
+        self.assertIsNone(first['previous'])
+        self.assertEqual(self.get(second['previous'])['results'], first['results'])
+
+    def test_count_is_opt_in(self):
+        self.assertNotIn('count', self.get())
+        self.assertIsInstance(self.get(count='true')['count'], int)
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get(reverse('learning:course-list'), {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_values_of_the_wrong_type_are_not_found(self):
+        for position in (['x', 1], ['2024-01-01T00:00:00+00:00', 'x']):
+            cursor = KeysetPagination.encode_cursor(position)
+            response = self.client.get(reverse('learning:course-list'), {'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
+
+
+class CourseSearchTests(APITestCase):
+    def setUp(self):
+        self.python = create_course(title='Python for data science', chapters=0)
+        self.django = create_course(title='Web development with Django', chapters=0)
+        self.django.description = 'Build web applications in Python'
+        self.django.save()
+
+    def search(self, query):
+        return self.client.get(reverse('learning:course-list'), {'q': query})
+
+    def test_title_matches_rank_above_description_matches(self):
+        response = self.search('python')
+
+        results = response.data['results']
+        self.assertEqual([c['id'] for c in results], [self.python.id, self.django.id])
+        self.assertIn('<b>Python</b>', results[0]['title_headline'])
+
+    def test_vector_follows_category_and_author_changes(self):
+        category = Category.objects.create(title='Backend', description='description')
+        self.django.categories.add(category)
+        self.assertEqual([c['id'] for c in self.search('backend').data['results']], [self.django.id])
+
+        category.title = 'Frontend'
+        category.save()
+        self.assertEqual(self.search('backend').data['results'], [])
+
+        user = create_staff()
+        self.python.authors.add(Author.objects.create(user=user))
+        self.assertEqual([c['id'] for c in self.search('staff member').data['results']], [self.python.id])
+
+    def test_author_filter_matches_first_or_last_name(self):
+        self.python.authors.add(Author.objects.create(user=create_staff()))
+        url = reverse('learning:course-list')
+        for name in ['staff', 'Member']:
+            response = self.client.get(url, {'author': name})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([c['id'] for c in response.data['results']], [self.python.id])
+        self.assertEqual(self.client.get(url, {'author': 'nobody'}).data['results'], [])
+
+
+class ContentSearchTests(APITestCase):
+    def setUp(self):
+        self.course = create_course(chapters=1, lessons=1, slides=2)
+        self.lesson = Lesson.objects.get(chapter__course=self.course)
+        self.lesson.title = 'The for loop'
+        self.lesson.save()
+        slide = self.lesson.slides.order_by('order').first()
+        slide.content = 'A for loop walks over any iterable'
+        slide.save()
+        question = create_question(slide)
+        question.question_body = 'What does this loop print?'
+        question.save()
+        self.client.force_authenticate(create_staff())
+
+    def search(self, **params):
+        return self.client.get(reverse('learning:search-list'), params)
+
+    def test_results_are_grouped_and_resolved_to_their_path(self):
+        with self.assertNumQueries(1):
+            response = self.search(q='loop')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['lessons']), 1)
+        self.assertEqual(len(response.data['slides']), 1)
+        self.assertEqual(len(response.data['questions']), 1)
+        self.assertEqual(response.data['questions'][0]['course']['slug'], self.course.slug)
+        self.assertEqual(response.data['slides'][0]['lesson']['id'], self.lesson.id)
+
+    def test_saved_slides_and_questions_are_indexed(self):
+        slide = self.lesson.slides.order_by('order').last()
+        slide.title = 'Nested loops'
+        slide.hints = 'Indent the inner loop'
+        slide.save()
+        question = BaseQuestion.objects.create(title='Loop question', question_type=1)
+        slide.question = question
+        slide.save()
+
+        document = SearchDocument.objects.get(
+            entity_type=LearningConstants.SEARCH_SLIDE, object_id=slide.id)
+        self.assertEqual(document.title, 'Nested loops')
+        self.assertIn('Indent the inner loop', document.body)
+        self.assertTrue(SearchDocument.objects.filter(
+            entity_type=LearningConstants.SEARCH_QUESTION, object_id=question.id,
+            lesson=self.lesson, course=self.course).exists())
+
+    def test_type_filter_and_deletes(self):
+        response = self.search(q='loop', type='slides')
+        self.assertEqual(response.data['lessons'], [])
+        self.assertEqual(len(response.data['slides']), 1)
+
+        self.lesson.delete()
+        response = self.search(q='loop')
+        self.assertEqual(response.data['lessons'], [])
+        self.assertEqual(response.data['slides'], [])
+
+    def test_hidden_content_is_not_found(self):
+        slide = self.lesson.slides.get(content__contains='loop')
+        slide.is_active = False
+        slide.save()
+        response = self.search(q='loop')
+        self.assertEqual((response.data['slides'], response.data['questions']), ([], []))
+        self.assertEqual(len(response.data['lessons']), 1)
+
+        self.course.is_published = False
+        self.course.save()
+        self.assertEqual(self.search(q='loop').data['lessons'], [])
+
+    def test_moved_chapters_take_their_documents_along(self):
+        other = create_course(title='Other', chapters=0)
+        chapter = Chapter.objects.get(course=self.course)
+        chapter.course = other
+        chapter.save()
+        response = self.search(q='loop')
+        self.assertEqual(
+            {response.data[name][0]['course']['slug'] for name in ('lessons', 'slides', 'questions')},
+            {other.slug})
+
+
+class AutocompleteTests(APITestCase):
+    def setUp(self):
+        create_course(title='Python basics', chapters=0)
+        create_course(title='Advanced Python', chapters=0)
+        create_course(title='Pythonic patterns', chapters=0)
+        hidden = create_course(title='Python drafts', chapters=0)
+        hidden.is_published = False
+        hidden.save()
+        self.client.force_authenticate(create_staff())
+
+    def autocomplete(self, query):
+        return self.client.get(reverse('learning:search-autocomplete'), {'q': query})
+
+    def test_title_prefixes_rank_before_word_prefixes(self):
+        with self.assertNumQueries(2):
+            response = self.autocomplete('pyth')
+
+        self.assertEqual(
+            [c['title'] for c in response.data['courses']],
+            ['Python basics', 'Pythonic patterns', 'Advanced Python'])
+
+    def test_limits_are_clamped(self):
+        response = self.client.get(reverse('learning:search-autocomplete'), {'q': 'pyth', 'limit': -5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['courses']), 1)
+
+    def test_short_prefixes_return_nothing(self):
+        with self.assertNumQueries(0):
+            response = self.autocomplete('py')
+        self.assertEqual(response.data, {'courses': [], 'lessons': []})
@@ -4,7 +4,7 @@ from rest_framework_nested import routers
 from .views import (
     CategoryViewSet, CourseViewSet, ChapterViewSet,
     LessonViewSet, EditorViewSet, BaseQuestionViewSet,
-    ChoiceViewSet, SlideViewSet
+    ChoiceViewSet, SlideViewSet, SearchViewSet, CourseReviewViewSet
 )
 
 router = routers.DefaultRouter()
@@ -18,12 +18,14 @@ router.register(r'editors', EditorViewSet, basename='editor')
 router.register(r'questions', BaseQuestionViewSet, basename='question')
 router.register(r'choices', ChoiceViewSet, basename='choice')
 router.register(r'slides', SlideViewSet, basename='slide')
+router.register(r'search', SearchViewSet, basename='search')
 
 categories_router = routers.NestedDefaultRouter(router, r'categories', lookup='category')
 categories_router.register(r'courses', CourseViewSet, basename='category-courses')
 
 courses_router = routers.NestedDefaultRouter(router, r'courses', lookup='course')
 courses_router.register(r'chapters', ChapterViewSet, basename='course-chapters')
+courses_router.register(r'reviews', CourseReviewViewSet, basename='course-reviews')
 
 chapters_router = routers.NestedDefaultRouter(router, r'chapters', lookup='chapter')
 chapters_router.register(r'lessons', LessonViewSet, basename='chapter-lessons')
@@ -57,9 +59,15 @@ urlpatterns = [
          CourseViewSet.as_view({'get': 'statistics'}),
          name='course-statistics'),
 
+    path('chapters/<int:pk>/reorder-lessons/',
+         ChapterViewSet.as_view({'post': 'reorder_lessons'}),
+         name='chapter-reorder-lessons'),
     path('lessons/<int:pk>/reorder-slides/',
          LessonViewSet.as_view({'post': 'reorder_slides'}),
          name='lesson-reorder-slides'),
+    path('questions/<int:pk>/reorder-choices/',
+         BaseQuestionViewSet.as_view({'post': 'reorder_choices'}),
+         name='question-reorder-choices'),
 
     path('questions/<int:pk>/add-choice/',
          BaseQuestionViewSet.as_view({'post': 'add_choice'}),
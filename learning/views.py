@@ -1,32 +1,118 @@
-from django.db import models
+from django.db import IntegrityError, transaction
 from typing import cast, Union
 from django.db.models.query import QuerySet
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from Hallino.planning import QueryPlanMixin
+from . import counters
+from .caching import get_course_tree
+from .ordering import LAST, PARENT_FIELDS, allocate_order, get_parent_model, lock_parent, reorder
+from .learning_constants import LearningConstants
+from .search import search_documents, autocomplete
 from .filters import (
-    CourseFilter, ChapterFilter, LessonFilter,
-    QuestionFilter, SlideFilter
+    CourseFilter, CourseSearchFilter, ChapterFilter,
+    LessonFilter, QuestionFilter, SlideFilter
 )
 from .models import (
     Category, Course, Chapter, Lesson,
-    Editor, BaseQuestion, Choice, Slide
+    Editor, BaseQuestion, Choice, Slide, CourseReview
 )
 from .permissions import (
     IsAuthorOrReadOnly, IsStaffOrReadOnly,
-    IsCourseAuthorOrReadOnly
+    IsCourseAuthorOrReadOnly, IsReviewerOrReadOnly, get_authorship
 )
 from .serializers import (
     CategorySerializer, CourseSerializer, ChapterSerializer,
     LessonSerializer, EditorSerializer, BaseQuestionSerializer,
-    ChoiceSerializer, SlideSerializer
+    ChoiceSerializer, SlideSerializer, BundleSlideSerializer,
+    CourseSearchSerializer, SearchDocumentSerializer, ReorderSerializer,
+    CourseReviewSerializer
 )
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class OrderedChildMixin:
+    """
+    Gapped order keys for the viewset's objects. Creates go last, or right
+    after the sibling given as ``after`` (first for null). Updates with
+    ``after``, or to another parent, move the object by rewriting its own row.
+    The new parent has to pass the viewset's object permissions too, so
+    authors can't create or move content into a course of someone else.
+    """
+    def save_ordered(self, serializer, parent_id, after=LAST, exclude=None):
+        model = serializer.Meta.model
+        with transaction.atomic():
+            lock_parent(get_parent_model(model), parent_id)
+            return serializer.save(order=allocate_order(model, parent_id, after, exclude))
+
+    def perform_create(self, serializer):
+        field = PARENT_FIELDS[serializer.Meta.model]
+        after = serializer.validated_data.pop('after', LAST)
+        self.check_object_permissions(self.request, serializer.validated_data[field])
+        self.save_ordered(serializer, serializer.validated_data[field].pk, after)
+
+    def perform_update(self, serializer):
+        field = PARENT_FIELDS[serializer.Meta.model]
+        current_parent_id = getattr(serializer.instance, f'{field}_id')
+        parent = serializer.validated_data.get(field)
+        parent_id = parent.pk if parent is not None else current_parent_id
+        after = serializer.validated_data.pop('after', LAST)
+        if parent_id != current_parent_id:
+            self.check_object_permissions(self.request, parent)
+        if after is LAST and parent_id == current_parent_id:
+            serializer.save()
+        else:
+            self.save_ordered(serializer, parent_id, after, exclude=serializer.instance.pk)
+
+
+class ReorderMixin:
+    """
+    Bulk reorder of the ordered children of the viewset's objects
+    """
+    def reorder_children(self, parent, children):
+        serializer = ReorderSerializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        changed = reorder(parent, children, serializer.validated_data['orders'])
+        return Response({'status': 'success', 'changed': changed})
+
+
+class AnswerKeyMixin:
+    """
+    Hides the answer keys of questions and choices from anyone but staff
+    and the authors of their course, or from anyone asking for ?mode=learner
+    """
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['learner'] = self.hides_answer_keys
+        return context
+
+    def get_serializer(self, *args, **kwargs):
+        if kwargs.get('many') and args and self.request.user.is_authenticated and not self.request.user.is_staff:
+            # One query for the page instead of one per question
+            get_authorship(self.request).authored(self.get_questions(args[0]))
+        return super().get_serializer(*args, **kwargs)
+
+    @staticmethod
+    def get_questions(objects):
+        question_ids = {obj.question_id if isinstance(obj, Choice) else obj.pk for obj in objects}
+        return [BaseQuestion(pk=question_id) for question_id in question_ids]
+
+    def hides_answer_keys(self, obj):
+        user = self.request.user
+        if self.request.query_params.get('mode') == 'learner' or not user.is_authenticated:
+            return True
+        if user.is_staff:
+            return False
+        question = BaseQuestion(pk=obj.question_id) if isinstance(obj, Choice) else obj
+        return not get_authorship(self.request).is_author(question)
+
+
+class CategoryViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsStaffOrReadOnly]
@@ -36,13 +122,13 @@ class CategoryViewSet(viewsets.ModelViewSet):
     ordering = ['title']
 
 
-class CourseViewSet(viewsets.ModelViewSet):
+class CourseViewSet(QueryPlanMixin, ReorderMixin, viewsets.ModelViewSet):
     serializer_class = CourseSerializer
     permission_classes = [IsCourseAuthorOrReadOnly]
-    filter_backends = [DjangoFilterBackend,
-                       filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, filters.SearchFilter,
+                       filters.OrderingFilter, CourseSearchFilter]
     filterset_class = CourseFilter
-    search_fields = ['title', 'description', 'authors__username']
+    search_fields = ['title', 'description', 'authors__user__firstname', 'authors__user__lastname']
     ordering_fields = ['title', 'created_at', 'price', 'rating']
     ordering = ['-created_at']
     lookup_field = 'slug'
@@ -51,15 +137,21 @@ class CourseViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         category_pk = self.kwargs.get('category_pk')
         if category_pk:
-            return Course.objects.filter(categories__id=category_pk, is_published=True, is_active=True)
+            queryset = Course.objects.filter(categories__id=category_pk, is_published=True, is_active=True)
+        else:
+            queryset = Course.objects.filter(is_published=True, is_active=True)
+        return queryset.defer('search_vector')
 
-        return Course.objects.filter(is_published=True, is_active=True)
+    def get_serializer_class(self):
+        if self.action == 'list' and self.request.query_params.get(CourseSearchFilter.search_param):
+            return CourseSearchSerializer
+        return CourseSerializer
 
     def get_object(self):
         """
         Get object by either slug or pk
         """
-        queryset = self.get_queryset()
+        queryset = self.filter_queryset(self.get_queryset())
         lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
         print(lookup_url_kwarg)
         lookup_value = self.kwargs[lookup_url_kwarg]
@@ -142,15 +234,31 @@ class CourseViewSet(viewsets.ModelViewSet):
         })
 
     @action(detail=True, methods=['get'])
-    def statistics(self, request, pk=None):
+    def statistics(self, request, slug=None, category_pk=None):
         course = self.get_object()
         return Response({
             'total_chapters': course.chapters.count(),
             'total_lessons': Lesson.objects.filter(chapter__course=course).count(),
         })
 
+    @action(detail=True, methods=['get'])
+    def outline(self, request, slug=None, category_pk=None):
+        """
+        Active chapters, lessons and slide stubs of the course in one response
+        """
+        course = self.get_object()
+        return Response(get_course_tree(course))
+
+    @action(detail=True, methods=['post'])
+    def reorder_chapters(self, request, slug=None, category_pk=None):
+        """
+        Reorder every chapter of the course, {"orders": [{"id": 1, "order": 2}, ...]}
+        """
+        course = self.get_object()
+        return self.reorder_children(course, course.chapters.all())
+
 
-class ChapterViewSet(viewsets.ModelViewSet):
+class ChapterViewSet(QueryPlanMixin, OrderedChildMixin, ReorderMixin, viewsets.ModelViewSet):
     serializer_class = ChapterSerializer
     permission_classes = [IsAuthorOrReadOnly]
     filter_backends = [DjangoFilterBackend,
@@ -162,23 +270,24 @@ class ChapterViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         course_pk = self.kwargs.get('course_slug')
+        if not course_pk:
+            return Chapter.objects.filter(is_active=True)
         try:
             course_id = int(course_pk)
             return Chapter.objects.filter(course__id=course_id, is_active=True)
         except ValueError:
             return Chapter.objects.filter(course__slug=course_pk, is_active=True)
 
-    def perform_create(self, serializer):
-        course = serializer.validated_data['course']
-        if not serializer.validated_data.get('order'):
-            last_order = course.chapters.aggregate(
-                models.Max('order'))['order__max']
-            serializer.save(order=last_order + 1 if last_order else 1)
-        else:
-            serializer.save()
+    @action(detail=True, methods=['post'])
+    def reorder_lessons(self, request, pk=None, course_slug=None):
+        """
+        Reorder every lesson of the chapter, {"orders": [{"id": 1, "order": 2}, ...]}
+        """
+        chapter = self.get_object()
+        return self.reorder_children(chapter, chapter.lessons.all())
 
 
-class LessonViewSet(viewsets.ModelViewSet):
+class LessonViewSet(QueryPlanMixin, OrderedChildMixin, ReorderMixin, viewsets.ModelViewSet):
     serializer_class = LessonSerializer
     permission_classes = [IsAuthorOrReadOnly]
     filter_backends = [DjangoFilterBackend,
@@ -189,29 +298,54 @@ class LessonViewSet(viewsets.ModelViewSet):
     ordering = ['order']
 
     def get_queryset(self):
-        return Lesson.objects.filter(chapter__id=self.kwargs.get('chapter_pk'), is_active=True)
+        chapter_pk = self.kwargs.get('chapter_pk')
+        if chapter_pk:
+            return Lesson.objects.filter(chapter__id=chapter_pk, is_active=True)
 
-    @action(detail=True, methods=['post'])
-    def reorder_slides(self, request, pk=None):
-        """Reorder slides in the lesson"""
-        lesson = self.get_object()
-        slide_orders = request.data.get('slide_orders', [])
+        return Lesson.objects.filter(is_active=True)
 
-        if not slide_orders:
-            return Response(
-                {'error': 'No slide orders provided'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+    def is_learner(self, lesson):
+        """
+        Anyone but staff and the course authors, or anyone asking for ?mode=learner
+        """
+        user = self.request.user
+        if self.request.query_params.get('mode') == 'learner':
+            return True
+        if not user.is_authenticated:
+            return True
+        if user.is_staff:
+            return False
+        return not get_authorship(self.request).is_author(lesson)
 
-        for order_data in slide_orders:
-            slide = get_object_or_404(Slide, id=order_data['slide_id'])
-            slide.order = order_data['order']
-            slide.save()
+    @action(detail=True, methods=['get'])
+    def bundle(self, request, pk=None, chapter_pk=None):
+        """
+        Every active slide of the lesson with its question, choices and
+        editor inlined. Learners get the payload without the answer keys.
+        """
+        lesson = self.get_object()
+        context = self.get_serializer_context()
+        context['learner'] = self.is_learner(lesson)
+        return Response({
+            'id': lesson.id,
+            'title': lesson.title,
+            'lesson_type': lesson.lesson_type,
+            'learner': context['learner'],
+            'slides': BundleSlideSerializer(
+                lesson.get_bundle(), many=True, context=context
+            ).data
+        })
 
-        return Response({'status': 'success'})
+    @action(detail=True, methods=['post'])
+    def reorder_slides(self, request, pk=None, chapter_pk=None):
+        """
+        Reorder every slide of the lesson, {"orders": [{"id": 1, "order": 2}, ...]}
+        """
+        lesson = self.get_object()
+        return self.reorder_children(lesson, lesson.slides.all())
 
 
-class EditorViewSet(viewsets.ModelViewSet):
+class EditorViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Editor.objects.all()
     serializer_class = EditorSerializer
     permission_classes = [IsStaffOrReadOnly]
@@ -221,7 +355,7 @@ class EditorViewSet(viewsets.ModelViewSet):
     ordering = ['-created_at']
 
 
-class BaseQuestionViewSet(viewsets.ModelViewSet):
+class BaseQuestionViewSet(QueryPlanMixin, AnswerKeyMixin, ReorderMixin, viewsets.ModelViewSet):
     serializer_class = BaseQuestionSerializer
     permission_classes = [IsStaffOrReadOnly]
     filter_backends = [DjangoFilterBackend,
@@ -234,8 +368,10 @@ class BaseQuestionViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         question_id = self.kwargs.get('pk')
         if question_id:
-            return BaseQuestion.objects.filter(id=question_id)
-        return BaseQuestion.objects.filter(questions_slides=self.kwargs.get('slide_pk'))
+            queryset = BaseQuestion.objects.filter(id=question_id)
+        else:
+            queryset = BaseQuestion.objects.filter(questions_slides=self.kwargs.get('slide_pk'))
+        return queryset
 
     @action(detail=True, methods=['post'])
     def add_choice(self, request, pk=None):
@@ -244,13 +380,24 @@ class BaseQuestionViewSet(viewsets.ModelViewSet):
         serializer = ChoiceSerializer(data=request.data)
 
         if serializer.is_valid():
-            serializer.save(question=question)
+            after = serializer.validated_data.pop('after', LAST)
+            with transaction.atomic():
+                lock_parent(BaseQuestion, question.pk)
+                serializer.save(question=question, order=allocate_order(Choice, question.pk, after))
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=True, methods=['post'])
+    def reorder_choices(self, request, pk=None, slide_pk=None):
+        """
+        Reorder every choice of the question, {"orders": [{"id": 1, "order": 2}, ...]}
+        """
+        question = self.get_object()
+        return self.reorder_children(question, question.choices.all())
+
 
-class ChoiceViewSet(viewsets.ModelViewSet):
+class ChoiceViewSet(QueryPlanMixin, AnswerKeyMixin, OrderedChildMixin, viewsets.ModelViewSet):
     queryset = Choice.objects.all()
     serializer_class = ChoiceSerializer
     permission_classes = [IsStaffOrReadOnly]
@@ -260,7 +407,7 @@ class ChoiceViewSet(viewsets.ModelViewSet):
     ordering = ['order']
 
 
-class SlideViewSet(viewsets.ModelViewSet):
+class SlideViewSet(QueryPlanMixin, OrderedChildMixin, viewsets.ModelViewSet):
     serializer_class = SlideSerializer
     permission_classes = [IsStaffOrReadOnly]
     filter_backends = [DjangoFilterBackend,
@@ -271,7 +418,11 @@ class SlideViewSet(viewsets.ModelViewSet):
     ordering = ['order']
 
     def get_queryset(self):
-        return Slide.objects.filter(lesson__id=self.kwargs.get('lesson_pk'), is_active=True)
+        lesson_pk = self.kwargs.get('lesson_pk')
+        if lesson_pk:
+            return Slide.objects.filter(lesson__id=lesson_pk, is_active=True)
+
+        return Slide.objects.filter(is_active=True)
 
     @action(detail=True, methods=['post'])
     def toggle_activity(self, request, pk=None):
@@ -284,13 +435,152 @@ class SlideViewSet(viewsets.ModelViewSet):
             'is_active': slide.is_active
         })
 
+    def get_permissions(self):
+        if self.action == 'record_activity':
+            return [IsAuthenticated()]
+        return super().get_permissions()
+
+    def get_slide_id(self):
+        # Increments skip loading the slide, only its cached lesson is checked
+        try:
+            slide_id = int(self.kwargs['pk'])
+        except ValueError:
+            raise NotFound()
+        lesson_id = counters.get_active_lesson_id(slide_id)
+        lesson_pk = self.kwargs.get('lesson_pk')
+        if not lesson_id or (lesson_pk and str(lesson_id) != str(lesson_pk)):
+            raise NotFound()
+        return slide_id
+
+    @action(detail=True, methods=['post'])
+    def increment_comments(self, request, pk=None, lesson_pk=None):
+        """
+        Count a comment, buffered without touching the slide row
+        """
+        counters.increment(self.get_slide_id(), LearningConstants.COUNTER_COMMENTS)
+        return Response({'status': 'accepted'}, status=status.HTTP_202_ACCEPTED)
+
     @action(detail=True, methods=['post'])
-    def increment_comments(self, request, pk=None):
-        """Increment comments count"""
+    def record_activity(self, request, pk=None, lesson_pk=None):
+        """
+        Count a view, attempt or completion, {"kind": "views"}
+        """
+        kind = counters.COUNTER_KINDS.get(request.data.get('kind'))
+        if kind is None:
+            return Response(
+                {'kind': f'Must be one of {", ".join(counters.COUNTER_KINDS)}.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        counters.increment(self.get_slide_id(), kind)
+        return Response({'status': 'accepted'}, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['get'])
+    def activity(self, request, pk=None, lesson_pk=None):
+        """
+        Comment, view, attempt and completion counts of the slide
+        """
         slide = self.get_object()
-        slide.comments_count += 1
-        slide.save()
-        return Response({
-            'status': 'success',
-            'comments_count': slide.comments_count
-        })
+        return Response(counters.get_counts([slide])[slide.id])
+
+
+class CourseReviewViewSet(QueryPlanMixin, viewsets.ModelViewSet):
+    """
+    Reviews of a course, one per user. Every write moves the course's
+    running rating totals in the same transaction.
+    """
+    serializer_class = CourseReviewSerializer
+    permission_classes = [IsReviewerOrReadOnly]
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = ['created_at', 'rating']
+    ordering = ['-created_at']
+
+    def get_course_lookup(self, prefix=''):
+        course_slug = self.kwargs['course_slug']
+        try:
+            return {f'{prefix}pk': int(course_slug)}
+        except ValueError:
+            return {f'{prefix}slug': course_slug}
+
+    def get_queryset(self):
+        return CourseReview.objects.filter(**self.get_course_lookup('course__'))
+
+    def perform_create(self, serializer):
+        course = get_object_or_404(Course, is_published=True, is_active=True, **self.get_course_lookup())
+        try:
+            with transaction.atomic():
+                serializer.save(course=course, user_id=self.request.user.pk)
+        except IntegrityError:
+            raise ValidationError({'course': 'You have already reviewed this course.'})
+
+    def lock_review(self, review):
+        """
+        Lock the review and take its rating as stored, so concurrent writes
+        move the course totals one after the other
+        """
+        stored = CourseReview.objects.select_for_update().filter(pk=review.pk).values_list(
+            'rating', flat=True).first()
+        if stored is None:
+            raise NotFound()
+        review.stored_rating = stored
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            self.lock_review(serializer.instance)
+            serializer.save()
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            self.lock_review(instance)
+            instance.delete()
+
+
+class SearchViewSet(viewsets.ViewSet):
+    """
+    Full-text search over lessons, slides, questions and editors.
+    ?q=<query>&type=lessons,slides&limit=10, results grouped by entity type.
+    """
+    max_limit = 50
+
+    def list(self, request):
+        query = request.query_params.get('q', '').strip()
+        entity_types = dict((name, value) for value, name in LearningConstants.SEARCH_ENTITY_CHOICES)
+        results = {name: [] for name in entity_types}
+        if not query:
+            return Response(results)
+
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 10)), self.max_limit))
+        except ValueError:
+            return Response(
+                {'error': 'limit must be a number'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        requested = [name for name in request.query_params.get('type', '').split(',') if name]
+        unknown = set(requested) - set(entity_types)
+        if unknown:
+            return Response(
+                {'error': f'Unknown types: {", ".join(sorted(unknown))}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        documents = search_documents(
+            query, limit=limit, entity_types=[entity_types[name] for name in requested])
+        for document in documents:
+            results[document.get_entity_type_display()].append(
+                SearchDocumentSerializer(document).data)
+        return Response(results)
+
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """
+        Published courses and lessons whose title has a word starting with ?q=
+        """
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 10)), self.max_limit))
+        except ValueError:
+            return Response(
+                {'error': 'limit must be a number'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(autocomplete(request.query_params.get('q', ''), limit=limit))
@@ -77,29 +77,25 @@ class StreakAdmin(admin.ModelAdmin):
     list_filter = ('type', 'last_interaction')
     search_fields = ('user__email', 'user__firstname', 'user__lastname')
     raw_id_fields = ('user',)
-    readonly_fields = ('current_streak', 'highest_streak', 'last_interaction')
+    readonly_fields = ('current_streak', 'highest_streak', 'last_interaction', 'reminded_on')
 
     actions = ['reset_streaks']
 
     def reset_streaks(self, request, queryset):
-        queryset.update(current_streak=0, highest_streak=0, last_interaction=None)
+        queryset.update(current_streak=0, highest_streak=0, last_interaction=None, reminded_on=None)
 
     reset_streaks.short_description = "Reset selected streaks"
 
 
 @admin.register(UserResponse)
 class UserResponseAdmin(admin.ModelAdmin):
-    list_display = ('user', 'submitted_at', 'question_count', 'has_text_answer', 'choice_count')
-    list_filter = ('submitted_at',)
+    list_display = ('user', 'question', 'submitted_at', 'has_text_answer', 'choice_count', 'is_correct')
+    list_filter = ('submitted_at', 'is_correct')
+    list_select_related = ('user', 'question')
     search_fields = ('user__email', 'text_answer')
-    raw_id_fields = ('user',)
-    filter_horizontal = ('question', 'choice_answers')
-    readonly_fields = ('submitted_at',)
-
-    def question_count(self, obj):
-        return obj.question.count()
-
-    question_count.short_description = 'Questions'
+    raw_id_fields = ('user', 'question')
+    exclude = ('legacy_questions', 'legacy_choice_answers')
+    readonly_fields = ('submitted_at', 'is_correct')
 
     def has_text_answer(self, obj):
         return bool(obj.text_answer)
@@ -108,7 +104,7 @@ class UserResponseAdmin(admin.ModelAdmin):
     has_text_answer.short_description = 'Has Text Answer'
 
     def choice_count(self, obj):
-        return obj.choice_answers.count()
+        return len(obj.choice_ids)
 
     choice_count.short_description = 'Selected Choices'
 
@@ -0,0 +1,259 @@
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+
+from Hallino.benchmarks import benchmark
+from learning.models import Course
+from learning.pagination import KeysetPagination
+from learning.permissions import IsCourseAuthorOrReadOnly
+from . import leaderboard, streaks
+from .filters import UserSearchFilter
+from .models import User, UserCourse, UserResponse
+from .serializers import UserCourseSerializer
+from .tokens import ClaimsRefreshToken
+
+
+@benchmark('users.user_course_serializer')
+def user_course_serializer(size):
+    user_courses = list(UserCourse.objects.select_related('user').prefetch_related(
+        'courses__authors', 'courses__categories', 'courses__requirements')[:size])
+    return lambda: UserCourseSerializer(user_courses, many=True).data
+
+
+@benchmark('users.search')
+def user_search(size):
+    """
+    ``size`` searches by name, email and phone prefixes taken from stored
+    users, meant to run after seed_data --users 1000000
+    """
+    users = list(User.objects.order_by('?')[:max(1, size // 3)])
+    queries = [user.firstname[:4] for user in users]
+    queries += [user.email.split('@')[0] for user in users]
+    queries += [str(user.phone_number)[:8] for user in users]
+    requests = [Request(APIRequestFactory().get('/', {'q': query})) for query in queries]
+    search = UserSearchFilter()
+    return lambda: [
+        list(search.filter_queryset(request, User.objects.all(), None)[:10])
+        for request in requests
+    ]
+
+
+def response_page_request(offset, paginator):
+    """
+    Request for the user responses page starting ``offset`` rows deep,
+    through the cursor of the row just before it
+    """
+    responses = UserResponse.objects.order_by('-submitted_at', '-pk')
+    params = {}
+    if offset:
+        last = responses.values_list('submitted_at', 'pk')[offset - 1]
+        params[paginator.cursor_query_param] = paginator.encode_cursor(list(last))
+    return Request(APIRequestFactory().get('/', params)), responses
+
+
+@benchmark('users.keyset_page')
+def keyset_page(size):
+    """
+    A user responses page ``size`` rows deep, e.g. --size 1000000 after
+    seed_data, stays as fast as the first page
+    """
+    paginator = KeysetPagination()
+    request, responses = response_page_request(size, paginator)
+    return lambda: paginator.paginate_queryset(responses, request)
+
+
+@benchmark('users.offset_page')
+def offset_page(size):
+    """
+    The same page through LIMIT/OFFSET, for comparison with users.keyset_page
+    """
+    responses = UserResponse.objects.order_by('-submitted_at', '-pk')
+    return lambda: list(responses[size:size + KeysetPagination.page_size])
+
+
+def authenticated_requests(size, header):
+    """
+    ``size`` PATCH requests with the Authorization header of ``header(user)``
+    for users with authored courses
+    """
+    users = list(User.objects.filter(author__courses__isnull=False).distinct()[:max(1, size // 10)])
+    factory = APIRequestFactory()
+    return [
+        Request(factory.patch('/', HTTP_AUTHORIZATION=header(users[i % len(users)])))
+        for i in range(size)
+    ]
+
+
+def authenticate_and_check(requests, authentication):
+    permission = IsCourseAuthorOrReadOnly()
+    course = Course(pk=1)
+    for request in requests:
+        request.user, request.auth = authentication.authenticate(request)
+        permission.has_object_permission(request, None, course)
+
+
+@benchmark('users.token_auth')
+def token_auth(size):
+    """
+    Authentication and an author check per request with database tokens
+    """
+    requests = authenticated_requests(
+        size, lambda user: f'Token {Token.objects.get_or_create(user=user)[0].key}')
+    return lambda: authenticate_and_check(requests, TokenAuthentication())
+
+
+@benchmark('users.jwt_auth')
+def jwt_auth(size):
+    """
+    The same with claim carrying access tokens, no query at all
+    """
+    requests = authenticated_requests(
+        size, lambda user: f'Bearer {ClaimsRefreshToken.for_user(user).access_token}')
+    return lambda: authenticate_and_check(requests, JWTStatelessUserAuthentication())
+
+
+def response_pairs(size):
+    """
+    ``size`` (user id, question id, choice id) picks of stored responses,
+    meant to run after seed_data --responses 10000000
+    """
+    rows = list(UserResponse.objects.filter(question__isnull=False).order_by('?').values_list(
+        'user_id', 'question_id', 'choice_ids')[:size])
+    return [(user_id, question_id, choice_ids[0] if choice_ids else None)
+            for user_id, question_id, choice_ids in rows]
+
+
+@benchmark('users.response_lookup')
+def response_lookup(size):
+    """
+    ``size`` "did the user answer this question" checks on the covering
+    (user, question) index
+    """
+    pairs = response_pairs(size)
+    return lambda: [
+        UserResponse.objects.filter(user_id=user_id, question_id=question_id).exists()
+        for user_id, question_id, _ in pairs
+    ]
+
+
+@benchmark('users.response_lookup_legacy')
+def response_lookup_legacy(size):
+    """
+    The same checks joined through the legacy question table
+    """
+    pairs = response_pairs(size)
+    return lambda: [
+        UserResponse.objects.filter(user_id=user_id, legacy_questions=question_id).exists()
+        for user_id, question_id, _ in pairs
+    ]
+
+
+@benchmark('users.response_write')
+def response_write(size):
+    """
+    ``size`` submissions written as single rows, rolled back after timing
+    """
+    pairs = response_pairs(size)
+
+    def write():
+        with transaction.atomic():
+            UserResponse.objects.bulk_create([
+                UserResponse(user_id=user_id, question_id=question_id, choice_ids=[choice_id])
+                for user_id, question_id, choice_id in pairs
+            ])
+            transaction.set_rollback(True)
+    return write
+
+
+@benchmark('users.response_write_legacy')
+def response_write_legacy(size):
+    """
+    The same submissions written as a row plus two through rows each
+    """
+    pairs = response_pairs(size)
+    questions = UserResponse.legacy_questions.through
+    choices = UserResponse.legacy_choice_answers.through
+
+    def write():
+        with transaction.atomic():
+            responses = UserResponse.objects.bulk_create([
+                UserResponse(user_id=user_id) for user_id, _, _ in pairs])
+            questions.objects.bulk_create([
+                questions(userresponse_id=response.id, basequestion_id=question_id)
+                for response, (_, question_id, _) in zip(responses, pairs)
+            ])
+            choices.objects.bulk_create([
+                choices(userresponse_id=response.id, choice_id=choice_id)
+                for response, (_, _, choice_id) in zip(responses, pairs)
+            ])
+            transaction.set_rollback(True)
+    return write
+
+
+def leaderboard_entries(size):
+    """
+    ``size`` global board entries picked at random, meant to run after
+    seed_data --users 1000000, one enrollment per user
+    """
+    return list(leaderboard.board_entries(leaderboard.GLOBAL_BOARD).order_by('?')[:size])
+
+
+@benchmark('users.leaderboard_rank')
+def leaderboard_rank(size):
+    """
+    ``size`` "my rank" lookups on the count tree
+    """
+    scores = [entry.score for entry in leaderboard_entries(size)]
+    return lambda: [leaderboard.get_rank(leaderboard.GLOBAL_BOARD, score) for score in scores]
+
+
+@benchmark('users.leaderboard_rank_count')
+def leaderboard_rank_count(size):
+    """
+    The same ranks counted over the enrollments, for comparison with
+    users.leaderboard_rank
+    """
+    scores = [entry.score for entry in leaderboard_entries(size)]
+    return lambda: [UserCourse.objects.filter(score__gt=score).count() + 1 for score in scores]
+
+
+@benchmark('users.leaderboard_around')
+def leaderboard_around(size):
+    """
+    ``size`` "the ten learners around me" pages
+    """
+    entries = leaderboard_entries(size)
+    return lambda: [leaderboard.around(leaderboard.GLOBAL_BOARD, entry) for entry in entries]
+
+
+@benchmark('users.leaderboard_place')
+def leaderboard_place(size):
+    """
+    ``size`` score changes moved through both boards, rolled back after timing
+    """
+    entries = leaderboard_entries(size)
+
+    def place():
+        with transaction.atomic():
+            for entry in entries:
+                UserCourse.objects.filter(pk=entry.user_course_id).update(score=entry.score + 10)
+                leaderboard.place(entry.user_course_id)
+            transaction.set_rollback(True)
+    return place
+
+
+@benchmark('users.roll_streaks')
+def roll_streaks(size):
+    """
+    The daily rollover in chunks of ``size`` streaks, rolled back after
+    timing. After seed_data a third of the streaks break and a third lapse.
+    """
+    def run():
+        with transaction.atomic():
+            streaks.roll_streaks(timezone.localdate(), size)
+            transaction.set_rollback(True)
+    return run
@@ -0,0 +1,65 @@
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db.models import FloatField, Q
+from django.db.models.functions import Cast, Greatest
+from rest_framework.filters import BaseFilterBackend
+
+PHONE_PATTERN = re.compile(r'^\+?[\d\s().-]{3,}$')
+DEFAULT_COUNTRY_CODE = getattr(settings, 'PHONE_DEFAULT_COUNTRY_CODE', '98')
+
+
+def normalize_phone(value):
+    """
+    E.164 form of a full or partial phone number: 0912... and 0098912...
+    both become +98912...
+    """
+    digits = re.sub(r'\D', '', value)
+    if value.strip().startswith('+'):
+        return f'+{digits}'
+    if digits.startswith('00'):
+        return f'+{digits[2:]}'
+    if digits.startswith('0'):
+        return f'+{DEFAULT_COUNTRY_CODE}{digits[1:]}'
+    return f'+{digits}'
+
+
+class UserSearchFilter(BaseFilterBackend):
+    """
+    Indexed user search, ?q=<query>, or ?search=<query> as before it.
+
+    Phone-like queries match E.164 numbers exactly or by prefix. Anything
+    else matches names and email through the trigram indexes, every word
+    of the query has to match, ranked by word similarity.
+    """
+    search_param = 'q'
+    legacy_search_param = 'search'
+    fields = ['firstname', 'lastname', 'email']
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        query = (params.get(self.search_param) or params.get(self.legacy_search_param, '')).strip()
+        if not query:
+            return queryset
+        if PHONE_PATTERN.match(query):
+            return self.filter_phone(queryset, normalize_phone(query))
+        return self.filter_text(queryset, query)
+
+    @staticmethod
+    def filter_phone(queryset, phone):
+        # A complete number sorts before the longer numbers it prefixes
+        return queryset.filter(phone_number__startswith=phone).order_by('phone_number')
+
+    def filter_text(self, queryset, query):
+        words = query.split()
+        for word in words:
+            matches = Q()
+            # Served by the trigram indexes, which also cover substring matches
+            for field in self.fields:
+                matches |= Q(**{f'{field}__trigram_word_similar': word})
+            queryset = queryset.filter(matches)
+        return queryset.annotate(
+            # float8, so the rank survives the round trip through a page cursor
+            rank=Cast(Greatest(*[TrigramWordSimilarity(query, field) for field in self.fields]), FloatField())
+        ).order_by('-rank', 'id')
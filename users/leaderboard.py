@@ -0,0 +1,233 @@
+"""
+Leaderboards of enrollments, one global and one per course.
+
+Every board keeps two tables in step, both shared by all workers:
+
+* LeaderboardEntry rows, one per enrollment on the board, whose
+  (board, -score, -user_course) index answers "top N" and "the learners
+  around me" with an index seek
+* a Fenwick tree over scores in LeaderboardNode rows, so the number of
+  entries above a score, and with it a rank, is a sum of at most
+  log2(LEADERBOARD_MAX_SCORE) nodes
+
+A score change locks the enrollment row, moves its entries and adds +1/-1
+along the tree paths of the old and new score in one upsert. Every path
+ends in the top nodes of the tree, so each node is split over
+LEADERBOARD_NODE_SHARDS rows, a write adds to a random one and reads sum
+them, like the slide counters. Ranks are
+competition ranks: equal scores share a rank. Scores above
+LEADERBOARD_MAX_SCORE share the last slot of the tree and are told apart
+by the entry index. rebuild_leaderboards recreates both tables from the
+enrollments when scores were changed behind the signals' back.
+"""
+import random
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q, Sum
+
+from .models import UserCourse, LeaderboardEntry, LeaderboardNode
+
+LEADERBOARD_MAX_SCORE = getattr(settings, 'LEADERBOARD_MAX_SCORE', (1 << 20) - 1)
+LEADERBOARD_NODE_SHARDS = getattr(settings, 'LEADERBOARD_NODE_SHARDS', 16)
+
+GLOBAL_BOARD = 0
+TREE_SIZE = LEADERBOARD_MAX_SCORE + 1
+
+
+def _slot(score):
+    return min(max(score, 0), LEADERBOARD_MAX_SCORE) + 1
+
+
+def _update_path(slot):
+    while slot <= TREE_SIZE:
+        yield slot
+        slot += slot & -slot
+
+
+def _prefix_path(slot):
+    while slot > 0:
+        yield slot
+        slot -= slot & -slot
+
+
+def write_nodes(deltas):
+    """
+    Add {(board, node): delta} to random shards of the tree in one statement
+    """
+    # Sorted, so concurrent writes lock shared rows in the same order
+    rows = sorted((board, node, random.randrange(LEADERBOARD_NODE_SHARDS), delta)
+                  for (board, node), delta in deltas.items() if delta)
+    if not rows:
+        return
+    table = connection.ops.quote_name(LeaderboardNode._meta.db_table)
+    values = ', '.join(['(%s::bigint, %s::integer, %s::smallint, %s::bigint)'] * len(rows))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (board, node, shard, count) VALUES {values} '
+            f'ON CONFLICT (board, node, shard) DO UPDATE SET count = {table}.count + EXCLUDED.count',
+            [value for row in rows for value in row]
+        )
+
+
+def _move(deltas, board, old=None, new=None):
+    if old is not None:
+        for node in _update_path(_slot(old)):
+            deltas[board, node] -= 1
+    if new is not None:
+        for node in _update_path(_slot(new)):
+            deltas[board, node] += 1
+
+
+def place(user_course_id, boards=()):
+    """
+    Put the enrollment at its stored score on every board it is on and on
+    ``boards``
+    """
+    with transaction.atomic():
+        # The score is read under the lock, a stale copy can't undo a newer write
+        score = UserCourse.objects.select_for_update().filter(pk=user_course_id).values_list(
+            'score', flat=True).first()
+        if score is None:
+            return
+        current = dict(LeaderboardEntry.objects.filter(
+            user_course_id=user_course_id).values_list('board', 'score'))
+        deltas = Counter()
+        for board in set(current) | set(boards):
+            if current.get(board) != score:
+                _move(deltas, board, current.get(board), score)
+        if not deltas:
+            return
+        LeaderboardEntry.objects.bulk_create(
+            [LeaderboardEntry(board=board, user_course_id=user_course_id, score=score)
+             for board in set(current) | set(boards)],
+            update_conflicts=True, unique_fields=['board', 'user_course'], update_fields=['score'])
+        write_nodes(deltas)
+
+
+def remove(user_course_id, boards=None):
+    """
+    Take the enrollment off ``boards``, off every board for None
+    """
+    with transaction.atomic():
+        list(UserCourse.objects.select_for_update().filter(pk=user_course_id).values_list('pk'))
+        entries = LeaderboardEntry.objects.filter(user_course_id=user_course_id)
+        if boards is not None:
+            entries = entries.filter(board__in=boards)
+        current = dict(entries.values_list('board', 'score'))
+        if not current:
+            return
+        deltas = Counter()
+        for board, score in current.items():
+            _move(deltas, board, old=score)
+        entries.delete()
+        write_nodes(deltas)
+
+
+def drop_board(board):
+    with transaction.atomic():
+        LeaderboardEntry.objects.filter(board=board).delete()
+        LeaderboardNode.objects.filter(board=board).delete()
+
+
+def count_above(board, scores):
+    """
+    ({score: number of entries with a higher score}, entries on the board)
+    for the given scores, from one read of the tree
+    """
+    scores = set(scores)
+    paths = {score: list(_prefix_path(_slot(score))) for score in scores}
+    total_path = list(_prefix_path(TREE_SIZE))
+    wanted = set(total_path).union(*paths.values())
+    counts = dict(LeaderboardNode.objects.filter(board=board, node__in=wanted).values('node').annotate(
+        total=Sum('count')).values_list('node', 'total').order_by())
+
+    total = sum(counts.get(node, 0) for node in total_path)
+    above = {}
+    for score, path in paths.items():
+        above[score] = total - sum(counts.get(node, 0) for node in path)
+        if score >= LEADERBOARD_MAX_SCORE:
+            # The last slot holds every score from the maximum up
+            above[score] += LeaderboardEntry.objects.filter(board=board, score__gt=score).count()
+    return above, total
+
+
+def get_rank(board, score):
+    """
+    (rank of ``score``, entries on the board)
+    """
+    above, total = count_above(board, [score])
+    return above[score] + 1, total
+
+
+def board_entries(board):
+    return LeaderboardEntry.objects.filter(board=board).select_related('user_course__user').only(
+        'score', 'user_course_id', 'user_course__user_id',
+        'user_course__user__firstname', 'user_course__user__lastname')
+
+
+def top(board, limit=10):
+    """
+    The best ``limit`` entries with their ``rank`` set
+    """
+    entries = list(board_entries(board).order_by('-score', '-user_course_id')[:limit])
+    for position, entry in enumerate(entries):
+        tied = position and entries[position - 1].score == entry.score
+        entry.rank = entries[position - 1].rank if tied else position + 1
+    return entries
+
+
+def around(board, entry, size=10):
+    """
+    Up to ``size`` entries centered on ``entry`` with their ``rank`` set
+    """
+    higher = Q(score__gt=entry.score) | Q(score=entry.score, user_course_id__gt=entry.user_course_id)
+    lower = Q(score__lt=entry.score) | Q(score=entry.score, user_course_id__lt=entry.user_course_id)
+    before = list(board_entries(board).filter(higher).order_by('score', 'user_course_id')[:size // 2])[::-1]
+    after = list(board_entries(board).filter(lower).order_by('-score', '-user_course_id')[:size - len(before) - 1])
+    entries = before + [entry] + after
+    above, _ = count_above(board, [row.score for row in entries])
+    for row in entries:
+        row.rank = above[row.score] + 1
+    return entries
+
+
+def get_entry(board, user_course_id):
+    return board_entries(board).filter(user_course_id=user_course_id).first()
+
+
+def rebuild(batch_size=10000):
+    """
+    Recreate every board from the enrollments and store the global rank
+    snapshot in UserCourse.rank. Score changes wait until it commits.
+    """
+    entries = connection.ops.quote_name(LeaderboardEntry._meta.db_table)
+    nodes = connection.ops.quote_name(LeaderboardNode._meta.db_table)
+    user_courses = connection.ops.quote_name(UserCourse._meta.db_table)
+    through = connection.ops.quote_name(UserCourse.courses.through._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {entries}, {nodes} IN EXCLUSIVE MODE')
+        cursor.execute(f'DELETE FROM {entries}')
+        cursor.execute(f'DELETE FROM {nodes}')
+        cursor.execute(
+            f'INSERT INTO {entries} (board, user_course_id, score) '
+            f'SELECT %s, id, score FROM {user_courses}', [GLOBAL_BOARD])
+        cursor.execute(
+            f'INSERT INTO {entries} (board, user_course_id, score) '
+            f'SELECT t.course_id, u.id, u.score FROM {through} t JOIN {user_courses} u ON u.id = t.usercourse_id')
+
+        deltas = Counter()
+        cursor.execute(f'SELECT board, score, COUNT(*) FROM {entries} GROUP BY board, score')
+        for board, score, count in cursor.fetchall():
+            for node in _update_path(_slot(score)):
+                deltas[board, node] += count
+        LeaderboardNode.objects.bulk_create(
+            [LeaderboardNode(board=board, node=node, count=count) for (board, node), count in deltas.items()],
+            batch_size=batch_size)
+
+        cursor.execute(
+            f'UPDATE {user_courses} u SET rank = r.rank FROM '
+            f'(SELECT id, RANK() OVER (ORDER BY score DESC) AS rank FROM {user_courses}) r '
+            f'WHERE u.id = r.id AND u.rank IS DISTINCT FROM r.rank')
+    return len(deltas)
@@ -0,0 +1,92 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from learning.models import Choice
+from users.models import UserResponse
+
+
+class Command(BaseCommand):
+    help = ('Move user responses from the legacy question and choice tables to '
+            'the question column and inline choice ids')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Response ids converted per transaction')
+
+    def handle(self, *args, **options):
+        pending = UserResponse.objects.filter(question__isnull=True).order_by('id').values_list('id', flat=True)
+        first, last = pending.first(), pending.last()
+        converted = split = empty = 0
+        position = first
+        while position is not None and position <= last:
+            stop = position + options['batch_size']
+            with transaction.atomic():
+                counts = self.convert_range(position, stop)
+            converted, split, empty = (total + count for total, count in zip((converted, split, empty), counts))
+            if options['verbosity'] > 1:
+                self.stdout.write(f'up to id {stop - 1}: {counts[0]} converted')
+            position = stop
+
+        self.stdout.write(f'{converted} responses converted, {split} new rows for extra questions, '
+                          f'{empty} without a question left as they are')
+        if split:
+            self.stdout.write('Run grade_responses --ungraded-only to grade the split responses')
+        self.stdout.write(self.style.SUCCESS('Responses converted'))
+
+    @staticmethod
+    def convert_range(start, stop):
+        """
+        Convert the pending responses with ids in [start, stop). A response
+        of several questions keeps the first and gets a row per other one,
+        each with the chosen choices of its own question.
+        """
+        responses = list(UserResponse.objects.select_for_update().filter(
+            id__gte=start, id__lt=stop, question__isnull=True
+        ).only('id', 'user_id', 'text_answer', 'submitted_at'))
+        if not responses:
+            return 0, 0, 0
+        ids = [response.id for response in responses]
+
+        questions = defaultdict(list)
+        for response_id, question_id in UserResponse.legacy_questions.through.objects.filter(
+                userresponse_id__in=ids).order_by('basequestion_id').values_list(
+                'userresponse_id', 'basequestion_id'):
+            questions[response_id].append(question_id)
+        choices = defaultdict(list)
+        for response_id, choice_id in UserResponse.legacy_choice_answers.through.objects.filter(
+                userresponse_id__in=ids).order_by('choice_id').values_list('userresponse_id', 'choice_id'):
+            choices[response_id].append(choice_id)
+        owners = dict(Choice.objects.filter(
+            id__in={choice_id for chosen in choices.values() for choice_id in chosen}
+        ).values_list('id', 'question_id'))
+
+        updated, extra, submitted = [], [], []
+        for response in responses:
+            question_ids = questions.get(response.id)
+            if not question_ids:
+                continue
+            chosen = choices.get(response.id, [])
+            for index, question_id in enumerate(question_ids):
+                choice_ids = [choice_id for choice_id in chosen if owners.get(choice_id) == question_id]
+                if index == 0:
+                    response.question_id, response.choice_ids = question_id, choice_ids
+                    updated.append(response)
+                else:
+                    extra.append(UserResponse(
+                        user_id=response.user_id, question_id=question_id, choice_ids=choice_ids,
+                        text_answer=response.text_answer))
+                    submitted.append(response.submitted_at)
+
+        split_ids = {response.id for response in updated if len(questions[response.id]) > 1}
+        UserResponse.objects.bulk_update(updated, ['question', 'choice_ids'])
+        # Graded across all of their questions before, each row is one question now
+        UserResponse.objects.filter(id__in=split_ids).update(is_correct=None)
+        UserResponse.objects.bulk_create(extra)
+        # auto_now_add stamped the new rows, they keep the time of the original
+        for response, submitted_at in zip(extra, submitted):
+            response.submitted_at = submitted_at
+        UserResponse.objects.bulk_update(extra, ['submitted_at'])
+        return len(updated), len(extra), len(responses) - len(updated)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from users.leaderboard import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild every leaderboard from the enrollments and snapshot the global ranks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Count tree nodes written per insert')
+
+    def handle(self, *args, **options):
+        nodes = rebuild(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Leaderboards rebuilt, {nodes} tree nodes written'))
@@ -0,0 +1,29 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from users.streaks import STREAK_BATCH_SIZE, break_streaks, remind_lapsing
+
+
+class Command(BaseCommand):
+    help = 'Break the streaks missed yesterday and remind the users whose streak lapses tonight'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, default=None,
+                            help='Day to roll over as YYYY-MM-DD, today by default')
+        parser.add_argument('--batch-size', type=int, default=STREAK_BATCH_SIZE,
+                            help='Streaks reset or reminded per statement')
+
+    def handle(self, *args, **options):
+        today, batch_size = options['date'], options['batch_size']
+        verbose = options['verbosity'] > 1
+        broken = reminded = 0
+        for reset in break_streaks(today, batch_size):
+            broken += reset
+            if verbose:
+                self.stdout.write(f'{broken} streaks broken')
+        for users in remind_lapsing(today, batch_size):
+            reminded += users
+            if verbose:
+                self.stdout.write(f'{reminded} users reminded')
+        self.stdout.write(self.style.SUCCESS(f'{broken} streaks broken, {reminded} users reminded'))
@@ -1,7 +1,8 @@
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
+from django.db import connection, models
 from django.utils import timezone
 from phonenumber_field.modelfields import PhoneNumberField
 
@@ -97,6 +98,12 @@ class User(AbstractBaseUser, PermissionsMixin):
 
         indexes = [
             models.Index(fields=['email']),
+            models.Index(fields=['-created_at', '-id'], name='user_created_keyset'),
+            models.Index(fields=['phone_number'], name='user_phone_prefix',
+                         opclasses=['varchar_pattern_ops']),
+            GinIndex(fields=['firstname'], name='user_firstname_trgm', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['lastname'], name='user_lastname_trgm', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['email'], name='user_email_trgm', opclasses=['gin_trgm_ops']),
         ]
 
     def __str__(self):
@@ -135,12 +142,15 @@ class Author(models.Model):
 class UserCourse(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     courses = models.ManyToManyField('learning.Course', related_name='user_courses')
+    # Average of the enrolled courses, computed from the completed slides by learning.progress
     progress = models.IntegerField(
         default=0,
-        validators=[MinValueValidator(0), MaxValueValidator(100)]
+        validators=[MinValueValidator(0), MaxValueValidator(100)],
+        editable=False
     )
     score = models.IntegerField(default=0, validators=[MinValueValidator(0)])
-    rank = models.IntegerField()
+    # Global rank as of the last rebuild_leaderboards, live ranks come from users.leaderboard
+    rank = models.IntegerField(default=0, editable=False)
 
     class Meta:
         verbose_name = 'User course'
@@ -150,6 +160,105 @@ class UserCourse(models.Model):
         return f"{self.user.full_name} - {self.courses}"
 
 
+class CourseProgress(models.Model):
+    """
+    Completed slides of a user in a course, one bit per slide position of
+    the course layout, see learning.progress
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='course_progress')
+    course = models.ForeignKey('learning.Course', on_delete=models.CASCADE, related_name='+')
+    completed = models.BinaryField(default=bytes)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Course progress'
+        verbose_name_plural = 'Course progress'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'course'], name='unique_course_progress'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.course_id}"
+
+
+class LeaderboardEntry(models.Model):
+    """
+    Score of an enrollment on a leaderboard, 0 for the global board or
+    the id of a course, kept in board order by the index
+    """
+    board = models.BigIntegerField()
+    user_course = models.ForeignKey(
+        UserCourse,
+        on_delete=models.CASCADE,
+        related_name='leaderboard_entries'
+    )
+    score = models.IntegerField()
+
+    class Meta:
+        verbose_name = 'Leaderboard entry'
+        verbose_name_plural = 'Leaderboard entries'
+        constraints = [
+            models.UniqueConstraint(fields=['board', 'user_course'], name='unique_leaderboard_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['board', '-score', '-user_course'], name='leaderboard_order'),
+        ]
+
+    def __str__(self):
+        return f"{self.board}: {self.user_course_id} - {self.score}"
+
+
+class LeaderboardNode(models.Model):
+    """
+    Shard of a node of the Fenwick tree counting the entries of a board per
+    score, the node's count is the sum of its shards. Only shards that ever
+    held a count are stored.
+    """
+    board = models.BigIntegerField()
+    node = models.IntegerField()
+    shard = models.SmallIntegerField(default=0)
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Leaderboard node'
+        verbose_name_plural = 'Leaderboard nodes'
+        constraints = [
+            models.UniqueConstraint(fields=['board', 'node', 'shard'], name='unique_leaderboard_node'),
+        ]
+
+    def __str__(self):
+        return f"{self.board}[{self.node}/{self.shard}] - {self.count}"
+
+
+class StreakManager(models.Manager):
+    def record_interaction(self, user_id, streak_type, interaction_date=None):
+        """
+        Record an interaction of the user on ``interaction_date``, today by
+        default, creating the streak on the first one. One atomic upsert,
+        repeating an interaction of the same or an earlier day changes
+        nothing. Returns (current_streak, highest_streak, last_interaction).
+        """
+        if interaction_date is None:
+            interaction_date = timezone.localdate()
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        continued = 'CASE WHEN s.last_interaction = %(date)s::date - 1 THEN s.current_streak + 1 ELSE 1 END'
+        params = {'user': user_id, 'type': streak_type, 'date': interaction_date}
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} AS s (user_id, type, last_interaction, current_streak, highest_streak) '
+                f'VALUES (%(user)s, %(type)s, %(date)s, 1, 1) '
+                f'ON CONFLICT (user_id, type) DO UPDATE SET current_streak = {continued}, '
+                f'highest_streak = GREATEST(s.highest_streak, {continued}), last_interaction = %(date)s '
+                f'WHERE s.last_interaction IS NULL OR s.last_interaction < %(date)s '
+                f'RETURNING current_streak, highest_streak, last_interaction',
+                params)
+            row = cursor.fetchone()
+        if row is None:
+            row = self.filter(user_id=user_id, type=streak_type).values_list(
+                'current_streak', 'highest_streak', 'last_interaction').get()
+        return row
+
+
 class Streak(models.Model):
     STREAK_TYPE_CHOICES = [
         (7, '7 days'),
@@ -165,50 +274,83 @@ class Streak(models.Model):
     current_streak = models.IntegerField(default=0)
     type = models.IntegerField(choices=STREAK_TYPE_CHOICES)
     highest_streak = models.IntegerField('highest streak', default=0)
+    # Day of the last lapse reminder, set by users.streaks.roll_streaks
+    reminded_on = models.DateField(null=True, blank=True, editable=False)
+
+    objects = StreakManager()
 
     class Meta:
         verbose_name = 'Streak'
         verbose_name_plural = 'Streaks'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'type'], name='unique_user_streak_type'),
+        ]
+        indexes = [
+            # Only running streaks can break or lapse, see users.streaks
+            models.Index(fields=['last_interaction', 'id'], condition=models.Q(current_streak__gt=0),
+                         name='streak_running_interaction'),
+        ]
 
     def update_streak(self, interaction_date=None):
-        if interaction_date is None:
-            interaction_date = timezone.now().date()
-
-        if not self.last_interaction:
-            self.current_streak = 1
-        else:
-            days_diff = (interaction_date - self.last_interaction).days
-            if days_diff == 1:  # consecutive day
-                self.current_streak += 1
-            elif days_diff > 1:  # streak broken
-                self.current_streak = 1
-
-        self.last_interaction = interaction_date
-        self.highest_streak = max(self.highest_streak, self.current_streak)
-        self.save()
+        self.current_streak, self.highest_streak, self.last_interaction = \
+            Streak.objects.record_interaction(self.user_id, self.type, interaction_date)
 
 
 class UserResponse(models.Model):
+    """
+    One answer of a user to one question. The chosen choice ids are stored
+    inline, so a submission is a single row and "did the user answer this
+    question" is one index-only lookup.
+    """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
 
-    question = models.ManyToManyField(learning.models.BaseQuestion, related_name='question_for_user_response')
+    # Null only on rows convert_responses has not moved off the legacy tables yet
+    question = models.ForeignKey(
+        learning.models.BaseQuestion,
+        on_delete=models.CASCADE,
+        related_name='user_responses',
+        null=True
+    )
 
     text_answer = ArrayField(
         models.CharField(max_length=255),
         null=True,
         blank=True)
 
-    choice_answers = models.ManyToManyField(
-        learning.models.Choice,
-        related_name='correct_choices_for_user_response',
-        help_text="Correct choice options",
+    choice_ids = ArrayField(
+        models.IntegerField(),
+        default=list,
+        blank=True,
+        help_text="Ids of the chosen choices"
     )
 
     submitted_at = models.DateTimeField('submitted at', auto_now_add=True)
+    # Set by learning.grading, None until graded
+    is_correct = models.BooleanField(null=True, blank=True, editable=False)
+
+    # Previous many-to-many storage, kept on its tables until every row is
+    # converted by convert_responses, then dropped
+    legacy_questions = models.ManyToManyField(
+        learning.models.BaseQuestion,
+        db_table='users_userresponse_question',
+        related_name='+',
+        blank=True
+    )
+    legacy_choice_answers = models.ManyToManyField(
+        learning.models.Choice,
+        db_table='users_userresponse_choice_answers',
+        related_name='+',
+        blank=True
+    )
 
     class Meta:
         verbose_name = 'User response'
         verbose_name_plural = 'User responses'
+        indexes = [
+            models.Index(fields=['-submitted_at', '-id'], name='response_submitted_keyset'),
+            models.Index(fields=['user', '-submitted_at', '-id'], name='response_user_keyset'),
+            models.Index(fields=['user', 'question'], include=['is_correct'], name='response_user_question'),
+        ]
 
     def __str__(self):
         return f"{self.user.full_name} - {self.question}"
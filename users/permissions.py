@@ -8,7 +8,7 @@ class IsOwnerOrStaff(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.user.is_staff:
             return True
-        return obj == request.user
+        return obj.pk == request.user.pk
 
 
 class IsStaffOrReadOnly(permissions.BasePermission):
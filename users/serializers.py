@@ -2,10 +2,16 @@ from django.contrib.auth import authenticate
 from django.forms import ValidationError
 from django.utils import timezone
 from rest_framework import serializers
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
 
 from django.contrib.auth import password_validation
+from learning.grading import answer_keys, grade_answers
+from learning.models import Slide
 from learning.serializers import CategorySerializer, CourseSerializer
-from .models import User, Author, UserCourse, Streak, UserResponse, Staff
+from .models import User, Author, UserCourse, LeaderboardEntry, Streak, UserResponse, Staff
+from .tokens import ClaimsRefreshToken
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -103,7 +109,8 @@ class LoginSerializer(serializers.Serializer):
 
 class AuthorSerializer(serializers.ModelSerializer):
     user = UserSerializer()
-    specializations = CategorySerializer()
+    specializations = CategorySerializer(many=True)
+    total_courses = serializers.SerializerMethodField()
     active_courses = serializers.SerializerMethodField()
 
     class Meta:
@@ -113,27 +120,50 @@ class AuthorSerializer(serializers.ModelSerializer):
             'total_courses', 'active_courses'
         ]
 
-    def get_active_courses(self, obj):
-        active_courses = obj.courses.filter(is_active=True)
+    @staticmethod
+    def get_total_courses(obj):
+        if hasattr(obj, 'courses_count'):
+            return obj.courses_count
+        return obj.courses.count()
+
+    @staticmethod
+    def get_active_courses(obj):
+        # Prefetched by AuthorViewSet
+        if hasattr(obj, 'active_courses'):
+            active_courses = obj.active_courses
+        else:
+            active_courses = obj.courses.filter(is_active=True)
         return CourseSerializer(active_courses, many=True).data
 
 
 class UserCourseSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
-    course = CourseSerializer(read_only=True)
+    courses = CourseSerializer(many=True, read_only=True)
 
     class Meta:
         model = UserCourse
         fields = [
-            'id', 'user', 'course', 'progress',
+            'id', 'user', 'courses', 'progress',
             'score', 'rank'
         ]
 
-    def validate_progress(self, value):
-        if not 0 <= value <= 100:
-            raise serializers.ValidationError(
-                "Progress must be between 0 and 100")
-        return value
+
+class LeaderboardUserSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['id', 'firstname', 'lastname']
+
+
+class LeaderboardEntrySerializer(serializers.ModelSerializer):
+    """
+    Entry of users.leaderboard, ``rank`` is set by the leaderboard query
+    """
+    rank = serializers.IntegerField(read_only=True)
+    user = LeaderboardUserSerializer(source='user_course.user', read_only=True)
+
+    class Meta:
+        model = LeaderboardEntry
+        fields = ['rank', 'user_course', 'user', 'score']
 
 
 class StreakSerializer(serializers.ModelSerializer):
@@ -150,20 +180,97 @@ class StreakSerializer(serializers.ModelSerializer):
     def get_days_remaining(self, obj):
         if not obj.last_interaction:
             return 0
-        days_passed = (timezone.now().date() - obj.last_interaction).days
+        days_passed = (timezone.localdate() - obj.last_interaction).days
         return max(0, obj.type - days_passed)
 
 
 class UserResponseSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
+    choice_answers = serializers.ListField(
+        child=serializers.IntegerField(), source='choice_ids', required=False)
 
     class Meta:
         model = UserResponse
         fields = [
             'id', 'user', 'question', 'text_answer',
-            'choice_answers', 'submitted_at'
+            'choice_answers', 'submitted_at', 'is_correct'
         ]
-        read_only_fields = ['submitted_at']
+        read_only_fields = ['submitted_at', 'is_correct']
+        extra_kwargs = {'question': {'required': True, 'allow_null': False}}
+
+    def validate(self, data):
+        question = data.get('question', getattr(self.instance, 'question', None))
+        choice_ids = data.get('choice_ids')
+        if question is not None and choice_ids:
+            key = answer_keys.get_many([question.pk]).get(question.pk)
+            if key is None or not key.options.issuperset(choice_ids):
+                raise serializers.ValidationError({'choice_answers': 'Choices must belong to the question.'})
+        return data
+
+
+class AnswerSerializer(serializers.Serializer):
+    question = serializers.IntegerField()
+    choice_answers = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    text_answer = serializers.ListField(
+        child=serializers.CharField(max_length=255, allow_blank=True),
+        required=False, allow_null=True, default=None)
+
+
+class BulkResponseSerializer(serializers.Serializer):
+    """
+    Every answer to the questions of a lesson, stored and graded at once:
+    {"lesson": 1, "answers": [{"question": 2, "choice_answers": [3]}, ...]}
+    """
+    lesson = serializers.IntegerField()
+    answers = AnswerSerializer(many=True, allow_empty=False, max_length=200)
+
+    def validate(self, data):
+        question_ids = [answer['question'] for answer in data['answers']]
+        if len(set(question_ids)) != len(question_ids):
+            raise serializers.ValidationError({'answers': 'Each question can be answered only once.'})
+
+        # One query for the questions, the choices are checked against the answer keys
+        in_lesson = set(Slide.objects.filter(
+            lesson_id=data['lesson'], question_id__in=question_ids).values_list('question_id', flat=True))
+        keys = answer_keys.get_many(question_ids)
+        errors = {}
+        for index, answer in enumerate(data['answers']):
+            key = keys.get(answer['question'])
+            if answer['question'] not in in_lesson or key is None:
+                errors[index] = {'question': 'Not a question of this lesson.'}
+            elif not key.options.issuperset(answer['choice_answers']):
+                errors[index] = {'choice_answers': 'Choices must belong to the question.'}
+        if errors:
+            raise serializers.ValidationError({'answers': errors})
+        data['keys'] = keys
+        return data
+
+    def create(self, validated_data):
+        """
+        The graded responses, written with one bulk insert
+        """
+        keys = validated_data['keys']
+        return UserResponse.objects.bulk_create([
+            UserResponse(
+                user_id=validated_data['user_id'],
+                question_id=answer['question'],
+                choice_ids=sorted(set(answer['choice_answers'])),
+                text_answer=answer['text_answer'],
+                is_correct=grade_answers(
+                    keys, [answer['question']], answer['choice_answers'], answer['text_answer'])
+            )
+            for answer in validated_data['answers']
+        ])
+
+    def to_representation(self, responses):
+        return {
+            'correct': sum(1 for response in responses if response.is_correct),
+            'total': len(responses),
+            'responses': [
+                {'id': response.pk, 'question': response.question_id, 'is_correct': response.is_correct}
+                for response in responses
+            ],
+        }
 
 
 class StaffSerializer(serializers.ModelSerializer):
@@ -191,3 +298,25 @@ class PasswordChangeSerializer(serializers.Serializer):
         if data['new_password'] != data['confirm_password']:
             raise serializers.ValidationError("New passwords don't match")
         return data
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = ClaimsRefreshToken
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Rotates the refresh token with the current claims of its user, so a
+    promotion to staff or a new authored course lands at the next refresh
+    """
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user = User.objects.filter(
+            pk=refresh[jwt_settings.USER_ID_CLAIM], is_active=True).first()
+        if user is None:
+            raise AuthenticationFailed('No active account found for the given token')
+        if hasattr(refresh, 'blacklist') and jwt_settings.BLACKLIST_AFTER_ROTATION:
+            refresh.blacklist()
+
+        refresh = ClaimsRefreshToken.for_user(user)
+        return {'access': str(refresh.access_token), 'refresh': str(refresh)}
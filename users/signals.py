@@ -0,0 +1,55 @@
+from django.db.models.signals import post_save, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from learning.models import Course
+from . import leaderboard
+from .models import UserCourse
+
+
+@receiver(post_save, sender=UserCourse)
+def place_on_leaderboards(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields and 'score' not in update_fields):
+        return
+    leaderboard.place(instance.id, [leaderboard.GLOBAL_BOARD])
+
+
+@receiver(m2m_changed, sender=UserCourse.courses.through)
+def move_between_course_boards(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # pk_set is empty on clear, remember the boards before they are detached
+        if reverse:
+            instance._cleared_user_courses = list(instance.user_courses.values_list('id', flat=True))
+        else:
+            instance._cleared_course_ids = list(instance.courses.values_list('id', flat=True))
+        return
+    if action == 'post_clear':
+        if reverse:
+            for user_course_id in instance.__dict__.pop('_cleared_user_courses', []):
+                leaderboard.remove(user_course_id, [instance.id])
+        else:
+            leaderboard.remove(instance.id, instance.__dict__.pop('_cleared_course_ids', []))
+        return
+    if action not in ('post_add', 'post_remove') or not pk_set:
+        return
+
+    if not reverse:
+        if action == 'post_add':
+            leaderboard.place(instance.id, pk_set)
+        else:
+            leaderboard.remove(instance.id, pk_set)
+    elif action == 'post_add':
+        for user_course_id in sorted(pk_set):
+            leaderboard.place(user_course_id, [instance.id])
+    else:
+        for user_course_id in pk_set:
+            leaderboard.remove(user_course_id, [instance.id])
+
+
+@receiver(pre_delete, sender=UserCourse)
+def remove_from_leaderboards(sender, instance, **kwargs):
+    leaderboard.remove(instance.id)
+
+
+@receiver(pre_delete, sender=Course)
+def drop_course_board(sender, instance, **kwargs):
+    leaderboard.drop_board(instance.id)
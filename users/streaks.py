@@ -0,0 +1,92 @@
+"""
+Daily streak rollover.
+
+A streak is running while it has an interaction yesterday or today. The
+daily job works only on running streaks, through the partial index on
+last_interaction, in chunks of STREAK_BATCH_SIZE rows that each commit
+on their own:
+
+* streaks without an interaction since the day before yesterday are
+  broken, current_streak drops to 0 after highest_streak took it in
+* streaks whose last interaction was yesterday lapse tonight, their users
+  are handed to the receivers of ``streak_lapsing`` once per day
+
+Every step only touches rows still matching its condition, so the job can
+be rerun or resumed on the same day without repeating any work, and an
+interaction recorded meanwhile is never reset.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Greatest
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import Streak
+
+STREAK_BATCH_SIZE = getattr(settings, 'STREAK_BATCH_SIZE', 50000)
+
+# Sent with user_ids, the users whose streak lapses tonight without an
+# interaction today, and the day. Receivers queue the reminders.
+streak_lapsing = Signal()
+
+
+def broken_streaks(today):
+    return Streak.objects.filter(current_streak__gt=0, last_interaction__lt=today - timedelta(days=1))
+
+
+def lapsing_streaks(today):
+    return Streak.objects.filter(current_streak__gt=0, last_interaction=today - timedelta(days=1)).filter(
+        Q(reminded_on__isnull=True) | Q(reminded_on__lt=today))
+
+
+def break_streaks(today=None, batch_size=STREAK_BATCH_SIZE):
+    """
+    Reset the broken streaks, yielding the number reset per chunk
+    """
+    today = today or timezone.localdate()
+    streaks = broken_streaks(today)
+    while True:
+        chunk = streaks.order_by('last_interaction').values('id')[:batch_size]
+        # The conditions are checked again on the locked rows, a streak
+        # continued in the meantime stays as it is
+        reset = streaks.filter(id__in=chunk).update(
+            highest_streak=Greatest('highest_streak', 'current_streak'), current_streak=0)
+        if not reset:
+            return
+        yield reset
+
+
+def remind_lapsing(today=None, batch_size=STREAK_BATCH_SIZE):
+    """
+    Mark the lapsing streaks reminded and send ``streak_lapsing`` for their
+    users, yielding the number of users per chunk
+    """
+    today = today or timezone.localdate()
+    streaks = lapsing_streaks(today)
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            # Keyset over the (last_interaction, id) index, rows reminded
+            # by an earlier chunk are not read again
+            rows = list(streaks.filter(id__gt=last_id).order_by('id').select_for_update(
+                skip_locked=True).values_list('id', 'user_id')[:batch_size])
+            if not rows:
+                return
+            Streak.objects.filter(id__in=[streak_id for streak_id, _ in rows]).update(reminded_on=today)
+        last_id = rows[-1][0]
+        user_ids = sorted({user_id for _, user_id in rows})
+        streak_lapsing.send(sender=Streak, user_ids=user_ids, day=today)
+        yield len(user_ids)
+
+
+def roll_streaks(today=None, batch_size=STREAK_BATCH_SIZE):
+    """
+    Run the daily rollover, returns (streaks broken, users reminded)
+    """
+    today = today or timezone.localdate()
+    broken = sum(break_streaks(today, batch_size))
+    reminded = sum(remind_lapsing(today, batch_size))
+    return broken, reminded
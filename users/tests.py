@@ -1,3 +1,428 @@
-from django.test import TestCase
+from datetime import date, timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from Hallino.testing import QueryBudgetTestMixin
+from learning.models import Category, Choice, CourseLayout, Slide
+from learning.permissions import Authorship
+from learning.progress import course_progress, refresh_layout
+from learning.tests import create_course, create_question, create_staff
+from . import leaderboard
+from .streaks import roll_streaks, streak_lapsing
+from .filters import normalize_phone
+from .models import User, Author, UserCourse, LeaderboardNode, Streak, UserResponse, Staff
+from .tokens import ClaimsUser
+
+
+class UsersQueryBudgetTests(QueryBudgetTestMixin, APITestCase):
+    urlconf = 'users.urls'
+    namespace = 'users'
+    query_budgets = {
+        'api-root': 0,
+        'user-list': 1,
+        'user-detail': 1,
+        'author-list': 6,
+        'author-detail': 6,
+        'author-courses': 5,
+        'usercourse-list': 5,
+        'usercourse-detail': 5,
+        'usercourse-leaderboard': 2,
+        'usercourse-rank': 3,
+        'usercourse-around': 5,
+        'usercourse-progress': 2,
+        'streak-list': 1,
+        'streak-detail': 1,
+        'userresponse-list': 1,
+        'userresponse-detail': 1,
+        'staff-list': 1,
+        'staff-detail': 1,
+    }
+
+    def setUp(self):
+        users = [create_staff(email=f'user{i}@example.com') for i in range(3)]
+        category = Category.objects.create(title='Programming', description='description')
+        courses = [create_course(title=f'Course {i}', chapters=1, lessons=1, slides=1)
+                   for i in range(3)]
+        slide = courses[0].chapters.get().lessons.get().slides.get()
+        question = create_question(slide)
+
+        for user in users:
+            author = Author.objects.create(user=user)
+            author.specializations.add(category)
+            for course in courses:
+                course.authors.add(author)
+                course.categories.add(category)
+
+            user_course = UserCourse.objects.create(user=user, rank=1)
+            user_course.courses.set(courses)
+            Streak.objects.create(user=user, type=7)
+            Staff.objects.create(user=user, role_type=1)
+            UserResponse.objects.create(user=user, question=question, choice_ids=list(
+                Choice.objects.filter(question=question).values_list('id', flat=True)))
+
+        self.route_objects = {
+            'user': users[0],
+            'author': users[0].author,
+            'usercourse': UserCourse.objects.filter(user=users[0]).first(),
+            'streak': Streak.objects.filter(user=users[0]).first(),
+            'userresponse': UserResponse.objects.filter(user=users[0]).first(),
+            'staff': users[0].staff,
+        }
+        self.client.force_authenticate(users[0])
+
+
+class UserSearchTests(APITestCase):
+    def setUp(self):
+        for email, firstname, lastname, phone in [
+            ('sara@example.com', 'Sara', 'Ahmadi', '+989121111111'),
+            ('reza@example.com', 'Reza', 'Karimi', '+989122222222'),
+            ('ahmad@example.com', 'Ahmad', 'Rezaei', '+989351111111'),
+        ]:
+            User.objects.create_user(email, firstname, lastname, phone, password='password')
+        self.client.force_authenticate(create_staff())
+
+    def search(self, query):
+        response = self.client.get(reverse('users:user-list'), {'q': query})
+        return [user['email'] for user in response.data['results']]
+
+    def test_phone_numbers_are_normalized(self):
+        self.assertEqual(normalize_phone('0912 111 1111'), '+989121111111')
+        self.assertEqual(normalize_phone('0098-912'), '+98912')
+        self.assertEqual(normalize_phone('+98 935'), '+98935')
+
+    def test_phone_search_matches_exact_numbers_and_prefixes(self):
+        self.assertEqual(self.search('09121111111'), ['sara@example.com'])
+        self.assertEqual(
+            self.search('+98912'),
+            ['staff@example.com', 'sara@example.com', 'reza@example.com'])
+
+    def test_phone_search_pages_through_every_match(self):
+        emails = []
+        page = self.client.get(reverse('users:user-list'), {'q': '+98912', 'page_size': 1}).data
+        while True:
+            emails += [user['email'] for user in page['results']]
+            if not page['next']:
+                break
+            page = self.client.get(page['next']).data
+        self.assertEqual(emails, self.search('+98912'))
+
+    def test_name_search_ranks_every_word(self):
+        self.assertEqual(self.search('reza'), ['reza@example.com', 'ahmad@example.com'])
+        self.assertEqual(self.search('sara ahmadi'), ['sara@example.com'])
+
+    def test_legacy_search_param_takes_the_indexed_path(self):
+        response = self.client.get(reverse('users:user-list'), {'search': 'sara ahmadi'})
+        self.assertEqual([user['email'] for user in response.data['results']], ['sara@example.com'])
+
+
+class ClaimsTokenTests(APITestCase):
+    def setUp(self):
+        self.course = create_course(chapters=1, lessons=1, slides=0)
+        self.user = User.objects.create_user(
+            'author@example.com', 'Author', 'User', '+989121234567', password='password')
+        self.course.authors.add(Author.objects.create(user=self.user))
+
+    def obtain(self):
+        return self.client.post(reverse('users:token_obtain_pair'), {
+            'email': 'author@example.com', 'password': 'password'}).data
+
+    def test_access_token_carries_claims(self):
+        access = AccessToken(self.obtain()['access'])
+        self.assertFalse(access['is_staff'])
+        self.assertEqual(access['user_type'], 1)
+        self.assertEqual(access['course_ids'], [self.course.id])
+
+    def test_author_permissions_need_no_query(self):
+        user = ClaimsUser(AccessToken(self.obtain()['access']))
+        with self.assertNumQueries(0):
+            self.assertTrue(Authorship(user).is_author(self.course))
+            self.assertFalse(user.is_staff)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.obtain()["access"]}')
+        url = reverse('learning:course-detail', kwargs={'slug': self.course.slug})
+        self.assertEqual(self.client.patch(url, {'title': 'Renamed'}).status_code, 200)
+
+    def test_refresh_rotates_claims(self):
+        tokens = self.obtain()
+        self.user.is_staff = True
+        self.user.save()
+        self.course.authors.clear()
+
+        refreshed = self.client.post(reverse('users:token_refresh'), {'refresh': tokens['refresh']}).data
+        access = AccessToken(refreshed['access'])
+        self.assertTrue(access['is_staff'])
+        self.assertEqual(access['course_ids'], [])
+        self.assertNotEqual(refreshed['refresh'], tokens['refresh'])
+
+
+class BulkResponseTests(APITestCase):
+    def setUp(self):
+        course = create_course(chapters=1, lessons=1, slides=20)
+        self.lesson = course.chapters.get().lessons.get()
+        self.questions = [create_question(slide) for slide in self.lesson.slides.order_by('order')]
+        self.user = User.objects.create_user(
+            'learner@example.com', 'Learner', 'User', '+989121234567', password='password')
+        self.client.force_authenticate(self.user)
+
+    def submit(self, answers, lesson=None):
+        return self.client.post(reverse('users:userresponse-bulk'), {
+            'lesson': lesson or self.lesson.id, 'answers': answers}, format='json')
+
+    def answer(self, question, order):
+        return {'question': question.id, 'choice_answers': [question.choices.get(order=order).id]}
+
+    def test_a_quiz_is_stored_and_graded_in_a_few_queries(self):
+        answers = [self.answer(question, 1 if i % 2 else 2) for i, question in enumerate(self.questions)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.submit(answers)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertLessEqual(len(queries), 5)
+
+        self.assertEqual((response.data['correct'], response.data['total']), (10, 20))
+        stored = UserResponse.objects.filter(user=self.user)
+        self.assertEqual(stored.count(), 20)
+        self.assertEqual(stored.filter(is_correct=True).count(), 10)
+        self.assertEqual(
+            [response.choice_ids for response in stored.order_by('id')],
+            [answer['choice_answers'] for answer in answers])
+
+    def test_invalid_answers_store_nothing(self):
+        other = create_question(create_course(title='Other', chapters=1, lessons=1, slides=1)
+                                .chapters.get().lessons.get().slides.get())
+        foreign_choice = {'question': self.questions[0].id, 'choice_answers': [other.choices.first().id]}
+        for answers in ([self.answer(other, 1)], [foreign_choice],
+                        [self.answer(self.questions[0], 1)] * 2):
+            self.assertEqual(self.submit(answers).status_code, 400)
+        self.assertFalse(UserResponse.objects.exists())
+
+
+class ConvertResponsesTests(APITestCase):
+    def test_legacy_responses_move_to_one_row_per_question(self):
+        slides = create_course(chapters=1, lessons=1, slides=2).chapters.get().lessons.get().slides.order_by('order')
+        first, second = [create_question(slide) for slide in slides]
+        user = create_staff()
+        response = UserResponse.objects.create(user=user, text_answer=['answer'])
+        response.legacy_questions.set([first, second])
+        response.legacy_choice_answers.set([first.choices.get(order=1), second.choices.get(order=2)])
+        untouched = UserResponse.objects.create(user=user)
+
+        call_command('convert_responses', stdout=StringIO())
+
+        rows = UserResponse.objects.exclude(pk=untouched.pk).order_by('id')
+        self.assertEqual(
+            [(row.question_id, row.choice_ids, row.text_answer) for row in rows],
+            [(first.id, [first.choices.get(order=1).id], ['answer']),
+             (second.id, [second.choices.get(order=2).id], ['answer'])])
+        self.assertEqual(rows[0].submitted_at, rows[1].submitted_at)
+        self.assertIsNone(UserResponse.objects.get(pk=untouched.pk).question_id)
+
+
+class LeaderboardTests(APITestCase):
+    def setUp(self):
+        self.course, self.other = create_course(title='Course'), create_course(title='Other')
+        self.enrollments = []
+        for i, score in enumerate([50, 30, 30, 10, 80]):
+            user = User.objects.create_user(
+                f'learner{i}@example.com', f'Learner{i}', 'User', f'+98912123456{i}', password='password')
+            enrollment = UserCourse.objects.create(user=user, score=score)
+            enrollment.courses.add(self.course, *([self.other] if i % 2 else []))
+            self.enrollments.append(enrollment)
+        self.client.force_authenticate(self.enrollments[0].user)
+
+    def assert_ranks_match_a_full_sort(self, board):
+        enrollments = UserCourse.objects.all() if board == leaderboard.GLOBAL_BOARD else \
+            UserCourse.objects.filter(courses=board)
+        for enrollment in enrollments:
+            expected = enrollments.filter(score__gt=enrollment.score).count() + 1
+            self.assertEqual(leaderboard.get_rank(board, enrollment.score), (expected, enrollments.count()))
+
+    def test_ranks_follow_score_and_enrollment_changes(self):
+        self.enrollments[3].score = 60
+        self.enrollments[3].save()
+        self.enrollments[1].courses.remove(self.other)
+        self.enrollments[0].courses.add(self.other)
+        self.enrollments[4].delete()
+        for board in (leaderboard.GLOBAL_BOARD, self.course.id, self.other.id):
+            self.assert_ranks_match_a_full_sort(board)
+
+        self.other.user_courses.clear()
+        self.assertEqual(leaderboard.get_rank(self.other.id, 0), (1, 0))
+
+    def test_boards_take_the_stored_score_over_the_instance(self):
+        stale = self.enrollments[0]
+        UserCourse.objects.filter(pk=stale.pk).update(score=60)
+        stale.courses.add(self.other)
+        for board in (leaderboard.GLOBAL_BOARD, self.other.id):
+            self.assertEqual(leaderboard.get_entry(board, stale.pk).score, 60)
+
+    def test_scores_above_the_tree_are_ranked_from_the_index(self):
+        for enrollment, score in zip(self.enrollments, [leaderboard.LEADERBOARD_MAX_SCORE + 5,
+                                                        leaderboard.LEADERBOARD_MAX_SCORE * 2]):
+            enrollment.score = score
+            enrollment.save()
+        self.assert_ranks_match_a_full_sort(leaderboard.GLOBAL_BOARD)
+
+    def test_top_rank_and_around(self):
+        response = self.client.get(reverse('users:usercourse-leaderboard'), {'limit': 4})
+        self.assertEqual(response.data['total'], 5)
+        self.assertEqual(
+            [(row['rank'], row['score']) for row in response.data['results']],
+            [(1, 80), (2, 50), (3, 30), (3, 30)])
+        self.assertEqual(
+            set(response.data['results'][0]['user']), {'id', 'firstname', 'lastname'})
+
+        url = reverse('users:usercourse-rank', args=[self.enrollments[0].id])
+        response = self.client.get(url, {'course': self.other.id})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(url)
+        self.assertEqual((response.data['rank'], response.data['total']), (2, 5))
+
+        response = self.client.get(
+            reverse('users:usercourse-around', args=[self.enrollments[0].id]), {'size': 3})
+        self.assertEqual(
+            [(row['rank'], row['user_course']) for row in response.data['results']],
+            [(1, self.enrollments[4].id), (2, self.enrollments[0].id), (3, self.enrollments[2].id)])
+
+    def test_rebuild_matches_the_incremental_boards(self):
+        self.enrollments[2].score = 90
+        self.enrollments[2].save()
+        def node_counts():
+            return set(LeaderboardNode.objects.values('board', 'node').annotate(total=Sum('count')).exclude(
+                total=0).values_list('board', 'node', 'total').order_by())
+
+        nodes = node_counts()
+        call_command('rebuild_leaderboards', stdout=StringIO())
+        self.assertEqual(node_counts(), nodes)
+        self.assertEqual(
+            [enrollment.rank for enrollment in UserCourse.objects.order_by('id')], [3, 4, 1, 5, 2])
+
+
+class CourseProgressTests(APITestCase):
+    def setUp(self):
+        self.course, self.other = create_course(chapters=1, lessons=2), create_course(title='Other')
+        self.slides = list(Slide.objects.filter(lesson__chapter__course=self.course).order_by(
+            'lesson__order', 'order'))
+        Slide.objects.filter(pk=self.slides[1].pk).update(is_required=False)
+        self.user = create_staff()
+        self.enrollment = UserCourse.objects.create(user=self.user)
+        self.enrollment.courses.add(self.course)
+        self.client.force_authenticate(self.user)
+
+    def complete(self, slide):
+        return self.client.post(
+            reverse('users:usercourse-update-progress', args=[self.enrollment.id]), {'slide': slide.id},
+            format='json')
+
+    def progress(self):
+        return course_progress(self.user.id, [self.course.id])[self.course.id]
+
+    def test_progress_is_weighted_by_required_slides(self):
+        self.assertEqual(self.complete(self.slides[0]).data['course_progress'], 33)
+        self.assertEqual(self.complete(self.slides[1]).data['course_progress'], 33)
+        for _ in range(2):
+            response = self.complete(self.slides[2])
+            self.assertEqual((response.data['course_progress'], response.data['progress']), (66, 66))
+
+        other_slide = Slide.objects.filter(lesson__chapter__course=self.other).first()
+        self.assertEqual(self.complete(other_slide).status_code, 400)
+
+        self.enrollment.courses.add(self.other)
+        refresh_layout(self.other.id)
+        with CaptureQueriesContext(connection) as queries:
+            progress = course_progress(self.user.id, [self.course.id, self.other.id])
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(progress, {self.course.id: 66, self.other.id: 0})
+
+        response = self.client.get(reverse('users:usercourse-progress', args=[self.enrollment.id]))
+        self.assertEqual(response.data['courses'], [
+            {'course': self.course.id, 'progress': 66}, {'course': self.other.id, 'progress': 0}])
+
+    def test_bitmaps_survive_content_edits(self):
+        self.complete(self.slides[0])
+        self.complete(self.slides[3])
+        self.assertEqual(self.progress(), 66)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Slide.objects.create(lesson=self.slides[0].lesson, title='New', type=1, order=0)
+        self.assertEqual(self.progress(), 50)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.slides[2].delete()
+        self.assertEqual(self.progress(), 66)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.slides[0].delete()
+        layout = CourseLayout.objects.get(course=self.course)
+        self.assertEqual(layout.slide_ids.count(0), 2)
+        self.assertEqual(self.progress(), 50)
+
+        layout = refresh_layout(self.course.id, compact=True)
+        self.assertNotIn(0, layout.slide_ids)
+        self.assertEqual(self.progress(), 50)
+        self.assertEqual(
+            set(Slide.objects.filter(lesson__chapter__course=self.course).values_list('position', flat=True)),
+            {0, 1, 2})
+
+    def test_moved_slides_leave_the_old_layout(self):
+        refresh_layout(self.other.id)
+        slide = self.slides[3]
+        slide.lesson = Slide.objects.filter(lesson__chapter__course=self.other).first().lesson
+        slide.order = 100
+        with self.captureOnCommitCallbacks(execute=True):
+            slide.save()
+        self.assertNotIn(slide.id, CourseLayout.objects.get(course=self.course).slide_ids)
+        self.assertIn(slide.id, CourseLayout.objects.get(course=self.other).slide_ids)
+
+
+class StreakTests(APITestCase):
+    day = date(2024, 3, 10)
+
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(
+                f'streaker{i}@example.com', 'Streaker', 'User', f'+98912765432{i}', password='password')
+            for i in range(3)
+        ]
+
+    def test_interactions_are_recorded_once_per_day(self):
+        record = Streak.objects.record_interaction
+        user_id = self.users[0].id
+        self.assertEqual(record(user_id, 7, self.day), (1, 1, self.day))
+        self.assertEqual(record(user_id, 7, self.day), (1, 1, self.day))
+        self.assertEqual(record(user_id, 7, self.day + timedelta(days=1)), (2, 2, self.day + timedelta(days=1)))
+        self.assertEqual(record(user_id, 7, self.day), (2, 2, self.day + timedelta(days=1)))
+        self.assertEqual(record(user_id, 7, self.day + timedelta(days=4)), (1, 2, self.day + timedelta(days=4)))
+        self.assertEqual(Streak.objects.filter(user_id=user_id).count(), 1)
+
+        streak = Streak.objects.get(user_id=user_id)
+        self.client.force_authenticate(self.users[0])
+        url = reverse('users:streak-record-interaction', args=[streak.id])
+        self.assertEqual(
+            [self.client.post(url).data['current_streak'] for _ in range(2)],
+            [1, 1])
+
+    def test_rollover_breaks_missed_streaks_and_reminds_lapsing_ones(self):
+        for user, days_ago in zip(self.users, [0, 1, 3]):
+            Streak.objects.create(user=user, type=7, current_streak=5, highest_streak=3,
+                                  last_interaction=self.day - timedelta(days=days_ago))
+        reminded = []
+
+        def remind(sender, user_ids, day, **kwargs):
+            reminded.extend(user_ids)
+        streak_lapsing.connect(remind)
+        self.addCleanup(streak_lapsing.disconnect, remind)
+
+        self.assertEqual(roll_streaks(self.day, batch_size=1), (1, 1))
+        self.assertEqual(reminded, [self.users[1].id])
+        self.assertEqual(
+            list(Streak.objects.order_by('user_id').values_list('current_streak', 'highest_streak')),
+            [(5, 3), (5, 3), (0, 5)])
+
+        self.assertEqual(roll_streaks(self.day, batch_size=1), (0, 0))
+        self.assertEqual(reminded, [self.users[1].id])
@@ -0,0 +1,43 @@
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from learning.models import Course
+
+
+def get_claims(user):
+    """
+    What the permissions need to know about ``user``, carried in its tokens
+    """
+    return {
+        'is_staff': user.is_staff,
+        'user_type': user.type,
+        'course_ids': sorted(Course.authors.through.objects.filter(
+            author__user=user).values_list('course_id', flat=True)),
+    }
+
+
+class ClaimsRefreshToken(RefreshToken):
+    """
+    Refresh token with the claims of get_claims, copied into its access tokens
+    """
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        for claim, value in get_claims(user).items():
+            token[claim] = value
+        return token
+
+
+class ClaimsUser(TokenUser):
+    """
+    User of a stateless JWT request, built from the token claims without
+    loading the user row. Claims are as fresh as the access token.
+    """
+    @cached_property
+    def type(self):
+        return self.token.get('user_type', 1)
+
+    @cached_property
+    def authored_course_ids(self):
+        return frozenset(self.token.get('course_ids', ()))
@@ -1,27 +1,33 @@
+from django.db.models import Count, Prefetch
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, status, filters
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
-from rest_framework_simplejwt.tokens import RefreshToken
 
+from Hallino.planning import QueryPlanMixin, plan_queryset
+from learning.grading import grade_response
 from learning.models import Course
+from learning.progress import complete_slide, course_progress
 from learning.serializers import CourseSerializer
+from . import leaderboard
 from .models import User, Author, UserCourse, Streak, UserResponse, Staff
+from .filters import UserSearchFilter
 from .permissions import IsOwnerOrStaff, IsStaffOrReadOnly
+from .tokens import ClaimsRefreshToken
 from .serializers import (
     UserSerializer, LoginSerializer, AuthorSerializer,
-    UserCourseSerializer, StreakSerializer, UserResponseSerializer,
+    UserCourseSerializer, LeaderboardEntrySerializer, StreakSerializer, UserResponseSerializer, BulkResponseSerializer,
     StaffSerializer, PasswordChangeSerializer
 )
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsOwnerOrStaff]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
-    search_fields = ['email', 'firstname', 'lastname', 'phone_number']
+    filter_backends = [DjangoFilterBackend, UserSearchFilter]
     filterset_fields = ['type', 'level', 'is_active', 'is_confirmed']
 
     @action(detail=False, methods=['post'])
@@ -29,7 +35,7 @@ class UserViewSet(viewsets.ModelViewSet):
         serializer = LoginSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data
-        refresh = RefreshToken.for_user(user)
+        refresh = ClaimsRefreshToken.for_user(user)
         return Response({
             'refresh': str(refresh),
             'access': str(refresh.access_token),
@@ -57,20 +63,32 @@ class UserViewSet(viewsets.ModelViewSet):
         return Response({'status': 'email confirmed'})
 
 
-class AuthorViewSet(viewsets.ModelViewSet):
+class AuthorViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Author.objects.all()
     serializer_class = AuthorSerializer
     permission_classes = [IsStaffOrReadOnly]
     filter_backends = [filters.SearchFilter]
     search_fields = ['user__firstname', 'user__lastname', 'bio']
 
+    def get_queryset(self):
+        queryset = Author.objects.all()
+        if self.action in ['list', 'retrieve']:
+            # Read by the active_courses method field, out of the planner's sight
+            active_courses = plan_queryset(Course.objects.filter(is_active=True), CourseSerializer)
+            queryset = queryset.prefetch_related(
+                Prefetch('courses', queryset=active_courses, to_attr='active_courses')
+            ).annotate(courses_count=Count('courses', distinct=True))
+        return queryset
+
     @action(detail=True, methods=['get'])
     def courses(self, request, pk=None):
         author = self.get_object()
-        active_courses = author.courses.filter(is_active=True)
+        active_courses = plan_queryset(author.courses.filter(is_active=True), CourseSerializer)
         page = self.paginate_queryset(active_courses)
-        serializer = CourseSerializer(page, many=True)
-        return self.get_paginated_response(serializer.data)
+        if page is not None:
+            serializer = CourseSerializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        return Response(CourseSerializer(active_courses, many=True).data)
 
     @action(detail=False, methods=['post'])
     def become_author(self, request):
@@ -78,7 +96,7 @@ class AuthorViewSet(viewsets.ModelViewSet):
         Allow a user to become an author
         """
         # Check if user is already an author
-        if hasattr(request.user, 'author'):
+        if Author.objects.filter(user_id=request.user.pk).exists():
             return Response(
                 {'error': 'User is already an author'},
                 status=status.HTTP_400_BAD_REQUEST
@@ -87,7 +105,7 @@ class AuthorViewSet(viewsets.ModelViewSet):
         # Create author profile
         data = request.data.copy()
         author = Author.objects.create(
-            user=request.user,
+            user_id=request.user.pk,
             bio=data.get('bio', ''),
             specializations_id=data.get('specializations')
         )
@@ -146,35 +164,111 @@ class AuthorViewSet(viewsets.ModelViewSet):
             )
 
 
-class UserCourseViewSet(viewsets.ModelViewSet):
+class UserCourseViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     queryset = UserCourse.objects.all()
     serializer_class = UserCourseSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend]
-    filterset_fields = ['course', 'progress']
+    filterset_fields = ['courses', 'progress']
 
     def get_queryset(self):
         if self.request.user.is_staff:
-            return UserCourse.objects.all()
-        return UserCourse.objects.filter(user=self.request.user)
+            queryset = UserCourse.objects.all()
+        else:
+            queryset = UserCourse.objects.filter(user_id=self.request.user.pk)
+        return queryset
 
     @action(detail=True, methods=['post'])
     def update_progress(self, request, pk=None):
+        """
+        Mark {"slide": id} completed, progress itself is computed from the
+        completed slides
+        """
         user_course = self.get_object()
-        progress = request.data.get('progress', 0)
+        slide_id = request.data.get('slide')
+        if not isinstance(slide_id, int) or isinstance(slide_id, bool):
+            return Response({'slide': 'A slide id is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        if not 0 <= progress <= 100:
+        course_ids = list(user_course.courses.values_list('id', flat=True))
+        course_id = complete_slide(user_course.user_id, slide_id, course_ids)
+        if course_id is None:
             return Response(
-                {'error': 'Progress must be between 0 and 100'},
+                {'slide': 'Not an active slide of the enrolled courses.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        user_course.progress = progress
-        user_course.save()
-        return Response(UserCourseSerializer(user_course).data)
+        progress = course_progress(user_course.user_id, course_ids)
+        user_course.progress = sum(progress.get(enrolled, 0) for enrolled in course_ids) // len(course_ids)
+        user_course.save(update_fields=['progress'])
+        return Response({
+            'course': course_id,
+            'course_progress': progress.get(course_id, 0),
+            'progress': user_course.progress,
+        })
 
+    @action(detail=True, methods=['get'])
+    def progress(self, request, pk=None):
+        """
+        Progress in every enrolled course, read in one query
+        """
+        user_course = self.get_object()
+        progress = course_progress(user_course.user_id, user_course.courses.values('id'))
+        return Response({
+            'progress': user_course.progress,
+            'courses': [{'course': course_id, 'progress': percentage}
+                        for course_id, percentage in sorted(progress.items())],
+        })
+
+    def get_board(self):
+        course = self.request.query_params.get('course')
+        if course is None:
+            return leaderboard.GLOBAL_BOARD
+        if not course.isdigit():
+            raise ValidationError({'course': 'A valid course id is required.'})
+        return int(course)
 
-class StreakViewSet(viewsets.ModelViewSet):
+    def get_bounded_param(self, name, default, maximum):
+        value = self.request.query_params.get(name, '')
+        return min(int(value), maximum) if value.isdigit() and int(value) > 0 else default
+
+    @action(detail=False, methods=['get'])
+    def leaderboard(self, request):
+        """
+        Top learners of the global board or of ?course=, ?limit= up to 100
+        """
+        board = self.get_board()
+        entries = leaderboard.top(board, self.get_bounded_param('limit', 10, 100))
+        _, total = leaderboard.count_above(board, [])
+        return Response({
+            'board': board,
+            'total': total,
+            'results': LeaderboardEntrySerializer(entries, many=True).data,
+        })
+
+    def get_entry(self):
+        board = self.get_board()
+        entry = leaderboard.get_entry(board, self.get_object().pk)
+        if entry is None:
+            raise NotFound('Not on this leaderboard.')
+        return board, entry
+
+    @action(detail=True, methods=['get'])
+    def rank(self, request, pk=None):
+        board, entry = self.get_entry()
+        entry.rank, total = leaderboard.get_rank(board, entry.score)
+        return Response({'board': board, 'total': total, **LeaderboardEntrySerializer(entry).data})
+
+    @action(detail=True, methods=['get'])
+    def around(self, request, pk=None):
+        """
+        The learners ranked around this enrollment, ?size= up to 50
+        """
+        board, entry = self.get_entry()
+        entries = leaderboard.around(board, entry, self.get_bounded_param('size', 10, 50))
+        return Response({'board': board, 'results': LeaderboardEntrySerializer(entries, many=True).data})
+
+
+class StreakViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Streak.objects.all()
     serializer_class = StreakSerializer
     permission_classes = [IsAuthenticated]
@@ -182,7 +276,7 @@ class StreakViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         if self.request.user.is_staff:
             return Streak.objects.all()
-        return Streak.objects.filter(user=self.request.user)
+        return Streak.objects.filter(user_id=self.request.user.pk)
 
     @action(detail=True, methods=['post'])
     def record_interaction(self, request, pk=None):
@@ -191,7 +285,7 @@ class StreakViewSet(viewsets.ModelViewSet):
         return Response(StreakSerializer(streak).data)
 
 
-class UserResponseViewSet(viewsets.ModelViewSet):
+class UserResponseViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     queryset = UserResponse.objects.all()
     serializer_class = UserResponseSerializer
     permission_classes = [IsAuthenticated]
@@ -200,14 +294,29 @@ class UserResponseViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         if self.request.user.is_staff:
-            return UserResponse.objects.all()
-        return UserResponse.objects.filter(user=self.request.user)
+            queryset = UserResponse.objects.all()
+        else:
+            queryset = UserResponse.objects.filter(user_id=self.request.user.pk)
+        return queryset.order_by('-submitted_at')
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        grade_response(serializer.save(user_id=self.request.user.pk))
+
+    def perform_update(self, serializer):
+        grade_response(serializer.save())
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Submit every answer of a lesson in one request, see BulkResponseSerializer
+        """
+        serializer = BulkResponseSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(user_id=request.user.pk)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class StaffViewSet(viewsets.ModelViewSet):
+class StaffViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Staff.objects.all()
     serializer_class = StaffSerializer
     permission_classes = [IsAdminUser]